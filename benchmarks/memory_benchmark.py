@@ -0,0 +1,80 @@
+import sys
+import argparse
+import resource
+import tracemalloc
+
+from microportraits.microportraits import extract_portraits_from_naf, load_naf
+
+
+def count_description_objects(description, counts):
+    '''
+    Function that counts a description and the objects it contains
+    :param description: cDescription
+    :param counts: dictionary of object kind and count (updated)
+    :return: None
+    '''
+    counts['descriptions'] += 1
+    counts['constituent components'] += len(description.constituent_components)
+    for dependent in description.dependents:
+        counts['dependents'] += 1
+        counts['constituent components'] += len(dependent.constituent_components)
+
+
+def count_portrait_objects(portraits):
+    '''
+    Function that counts the objects making up the portraits of a document
+    :param portraits: dictionary of term ids and their microportraits
+    :return: dictionary of object kind and count
+    '''
+    counts = {'portraits': 0, 'descriptions': 0, 'dependents': 0, 'constituent components': 0}
+    for portrait in portraits.values():
+        counts['portraits'] += 1
+        for description in portrait.labels + portrait.properties + portrait.activities:
+            count_description_objects(description, counts)
+    return counts
+
+
+def measure_file(inputfile, reader, surface, nocoref):
+    '''
+    Function that extracts the portraits of a file and measures the memory used by the extraction
+    :param inputfile: naf file
+    :param reader: naf reader to use (see load_naf)
+    :param surface: if True, descriptions use surface forms rather than lemmas
+    :param nocoref: if True, portraits are not merged based on coreference
+    :return: dictionary of object counts, retained and peak memory (in bytes)
+    '''
+    nafobj = load_naf(inputfile, reader)
+    tracemalloc.start()
+    portraits = extract_portraits_from_naf(nafobj, surface, nocoref)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    counts = count_portrait_objects(portraits)
+    return counts, retained, peak
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measures memory used by microportrait extraction (naf reading excluded)')
+    parser.add_argument('inputfiles', nargs='+', help='Input NAF files')
+    parser.add_argument('--reader', choices=['kafnaf', 'stream'], default='stream')
+    parser.add_argument('-s', '--surface', action='store_true', default=False)
+    parser.add_argument('-c', '--nocoref', action='store_true', default=False)
+    parser.add_argument('--limit', type=float, default=None, help='Exit with status 1 if the peak of any file exceeds this number of MB')
+    args = parser.parse_args()
+
+    exceeded = False
+    for inputfile in args.inputfiles:
+        counts, retained, peak = measure_file(inputfile, args.reader, args.surface, args.nocoref)
+        print('{}: {} portraits, {} descriptions, {} dependents, {} constituent components'.format(
+            inputfile, counts['portraits'], counts['descriptions'], counts['dependents'], counts['constituent components']))
+        print('    retained {:.1f} MB, peak {:.1f} MB'.format(retained / 1024.0 / 1024.0, peak / 1024.0 / 1024.0))
+        if args.limit is not None and peak > args.limit * 1024 * 1024:
+            exceeded = True
+    #ru_maxrss is in kilobytes on linux
+    print('max resident set size of process: {:.1f} MB'.format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+    if exceeded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
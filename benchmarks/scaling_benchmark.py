@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import math
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from collections import OrderedDict
+
+from microportraits.microportraits import extract_microportraits
+from microportraits.stats import cDocumentStats, stages
+from benchmarks.synthetic_naf import generate_naf
+
+
+class cTracedStats(cDocumentStats):
+    '''
+    Document statistics that also record the peak memory (traced by tracemalloc) of each stage
+    '''
+
+    def __init__(self, inputfile):
+
+        cDocumentStats.__init__(self, inputfile)
+        self.peaks = OrderedDict()
+        self.current = 0
+
+    def add_time(self, stage, wall, cpu):
+        '''
+        Records the peak of the stage that just ended (relative to the memory in use when it started)
+        '''
+        cDocumentStats.add_time(self, stage, wall, cpu)
+        current, peak = tracemalloc.get_traced_memory()
+        self.peaks[stage] = max(self.peaks.get(stage, 0), peak - self.current)
+        self.current = current
+        tracemalloc.reset_peak()
+
+
+def run_extraction(inputfile, stats, reader, nocoref):
+
+    with open(os.devnull, 'w', newline='') as outfile:
+        extract_microportraits(inputfile, outfile, False, nocoref, reader=reader, stats=stats)
+
+
+def measure_size(inputfile, repeat, reader, nocoref):
+    '''
+    Function that measures time (best of repeat runs) and peak memory (one run under tracemalloc) per stage
+    :param inputfile: naf file
+    :param repeat: number of timed runs
+    :param reader: naf reader to use (see load_naf)
+    :param nocoref: if True, portraits are not merged based on coreference
+    :return: dictionary of stage and its wall time, cpu time and peak memory; document counts
+    '''
+    results = OrderedDict()
+    for run in range(repeat):
+        stats = cDocumentStats(inputfile)
+        run_extraction(inputfile, stats, reader, nocoref)
+        for stage, times in stats.stages.items():
+            if not stage in results:
+                results[stage] = {'wall': times['wall'], 'cpu': times['cpu']}
+            else:
+                results[stage]['wall'] = min(results[stage]['wall'], times['wall'])
+                results[stage]['cpu'] = min(results[stage]['cpu'], times['cpu'])
+    stats = cTracedStats(inputfile)
+    tracemalloc.start()
+    try:
+        run_extraction(inputfile, stats, reader, nocoref)
+    finally:
+        tracemalloc.stop()
+    for stage, peak in stats.peaks.items():
+        results[stage]['peak'] = peak
+    return results, stats.counts
+
+
+def fit_exponent(sizes, values):
+    '''
+    Function that fits values = c * sizes ^ k (least squares on log-log scale)
+    :param sizes: list of document sizes
+    :param values: list of measured values
+    :return: exponent k (None if fewer than two positive values)
+    '''
+    points = [(math.log(size), math.log(value)) for size, value in zip(sizes, values) if size > 0 and value > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, y in points) / len(points)
+    mean_y = sum(y for x, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, y in points)
+    if variance == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def get_revision():
+
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.STDOUT)
+        return output.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sentence_counts, parameters, repeat, reader, nocoref):
+    '''
+    Function that generates a synthetic document per size and measures each stage on it
+    :param sentence_counts: list of numbers of sentences
+    :param parameters: dictionary of generation parameters (see generate_naf)
+    :return: dictionary with measurements per size and scaling exponents per stage
+    '''
+    measurements = []
+    tmpdir = tempfile.mkdtemp(prefix='microportraits_benchmark')
+    try:
+        for sentences in sentence_counts:
+            inputfile = os.path.join(tmpdir, 'synthetic{}.naf'.format(sentences))
+            with open(inputfile, 'w') as outfile:
+                outfile.write(generate_naf(sentences, **parameters))
+            results, counts = measure_size(inputfile, repeat, reader, nocoref)
+            os.remove(inputfile)
+            measurement = OrderedDict([('sentences', sentences), ('terms', counts.get('terms', 0)),
+                                       ('rows', counts.get('rows', 0)), ('stages', results)])
+            measurements.append(measurement)
+            sys.stderr.write('{} sentences ({} terms) done\n'.format(sentences, measurement['terms']))
+    finally:
+        os.rmdir(tmpdir)
+    terms = [measurement['terms'] for measurement in measurements]
+    exponents = OrderedDict()
+    for stage in stages + ['total']:
+        if stage == 'total':
+            times = [sum(times['wall'] for times in measurement['stages'].values()) for measurement in measurements]
+            peaks = [max(times['peak'] for times in measurement['stages'].values()) for measurement in measurements]
+        elif all(stage in measurement['stages'] for measurement in measurements):
+            times = [measurement['stages'][stage]['wall'] for measurement in measurements]
+            peaks = [measurement['stages'][stage]['peak'] for measurement in measurements]
+        else:
+            continue
+        exponents[stage] = {'time': fit_exponent(terms, times), 'memory': fit_exponent(terms, peaks)}
+    report = OrderedDict()
+    report['revision'] = get_revision()
+    report['reader'] = reader
+    report['nocoref'] = nocoref
+    report['parameters'] = parameters
+    report['measurements'] = measurements
+    report['exponents'] = exponents
+    return report
+
+
+def format_exponent(exponent):
+
+    if exponent is None:
+        return '-'
+    return '{:.2f}'.format(exponent)
+
+
+def print_report(report, outputfile=sys.stdout):
+    '''
+    Prints wall time (ms) and peak memory (MB) per stage and size, followed by the scaling exponents
+    '''
+    outputfile.write('revision {}, reader {}\n'.format(report['revision'], report['reader']))
+    for measurement in report['measurements']:
+        outputfile.write('{} sentences, {} terms, {} rows\n'.format(measurement['sentences'], measurement['terms'], measurement['rows']))
+        for stage, results in measurement['stages'].items():
+            outputfile.write('    {:<36}{:>10.1f} ms{:>10.2f} MB\n'.format(stage, results['wall'] * 1000, results['peak'] / 1024.0 / 1024.0))
+    outputfile.write('scaling exponent (time ~ terms^k, peak memory ~ terms^k)\n')
+    for stage, exponents in report['exponents'].items():
+        outputfile.write('    {:<36}{:>8}{:>8}\n'.format(stage, format_exponent(exponents['time']), format_exponent(exponents['memory'])))
+
+
+def compare_reports(old, new, outputfile=sys.stdout):
+    '''
+    Prints the ratio new/old of the wall time of each stage for the sizes measured in both reports and the
+    difference of the scaling exponents
+    :param old: report (see run_benchmark)
+    :param new: report
+    :return: None
+    '''
+    outputfile.write('{} -> {}\n'.format(old['revision'], new['revision']))
+    old_measurements = dict((measurement['sentences'], measurement) for measurement in old['measurements'])
+    for measurement in new['measurements']:
+        old_measurement = old_measurements.get(measurement['sentences'])
+        if old_measurement is None:
+            continue
+        outputfile.write('{} sentences\n'.format(measurement['sentences']))
+        for stage, results in measurement['stages'].items():
+            old_results = old_measurement['stages'].get(stage)
+            if old_results is None or old_results['wall'] == 0:
+                continue
+            outputfile.write('    {:<36}{:>10.1f} ms{:>10.1f} ms{:>8.2f}x\n'.format(stage, old_results['wall'] * 1000,
+                             results['wall'] * 1000, results['wall'] / old_results['wall']))
+    outputfile.write('scaling exponent of time (old -> new)\n')
+    for stage, exponents in new['exponents'].items():
+        old_exponents = old['exponents'].get(stage)
+        if old_exponents is None:
+            continue
+        outputfile.write('    {:<36}{:>8}{:>8}\n'.format(stage, format_exponent(old_exponents['time']), format_exponent(exponents['time'])))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measures time and peak memory per extraction stage on synthetic naf documents of increasing size')
+    parser.add_argument('--sentences', type=int, nargs='+', default=[50, 100, 200, 400, 800], help='Sizes (numbers of sentences) to measure')
+    parser.add_argument('--depth', type=int, default=1, help='Depth of prepositional modifier chains')
+    parser.add_argument('--coordination', type=float, default=0.2, help='Probability that an argument is coordinated')
+    parser.add_argument('--passives', type=float, default=0.1, help='Probability that a sentence is passive')
+    parser.add_argument('--chain-length', type=int, default=5, help='Number of mentions per coreference chain')
+    parser.add_argument('--single-chain', action='store_true', default=False, help='Put all mentions in one coreference chain')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs per size (the fastest is reported)')
+    parser.add_argument('--reader', choices=['kafnaf', 'stream'], default='kafnaf')
+    parser.add_argument('-c', '--nocoref', action='store_true', default=False)
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files instead of running the benchmark')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as infile:
+            old = json.load(infile)
+        with open(args.compare[1]) as infile:
+            new = json.load(infile)
+        compare_reports(old, new)
+        return
+    parameters = OrderedDict([('depth', args.depth), ('coordination', args.coordination), ('passives', args.passives),
+                              ('chain_length', args.chain_length), ('single_chain', args.single_chain), ('seed', args.seed)])
+    report = run_benchmark(args.sentences, parameters, args.repeat, args.reader, args.nocoref)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
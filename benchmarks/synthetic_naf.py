@@ -0,0 +1,185 @@
+import sys
+import random
+import argparse
+from xml.sax.saxutils import escape, quoteattr
+
+
+nouns = ['minister', 'burger', 'partij', 'rapport', 'gemeente', 'moskee', 'school', 'wet', 'kabinet', 'krant']
+names = [['Mark', 'Rutte'], ['Geert', 'Wilders'], ['Jan', 'de', 'Vries'], ['Fatima', 'El', 'Amrani'], ['Amsterdam']]
+pronouns = ['hij', 'zij', 'het', 'ze']
+verbs = ['zeg', 'bezoek', 'steun', 'kritiseer', 'noem', 'verdedig', 'open', 'sluit']
+participles = ['gesteund', 'bezocht', 'bekritiseerd', 'genoemd', 'verdedigd']
+adjectives = ['groot', 'nieuw', 'omstreden', 'lokaal', 'oud']
+prepositions = ['in', 'van', 'met', 'over', 'voor']
+determiners = ['de', 'het', 'een', 'deze']
+
+
+class cNafBuilder():
+    '''
+    Class that collects the tokens, terms, dependencies and coreference chains of a synthetic naf document
+    '''
+
+    def __init__(self):
+
+        self.terms = []
+        self.dependencies = []
+        self.chains = []
+        self.offset = 0
+
+    def add_term(self, lemma, pos, sentence):
+        '''
+        Adds term (with a single token) and returns its id
+        '''
+        tid = 't_{}'.format(len(self.terms))
+        self.terms.append((tid, lemma, pos, sentence, self.offset))
+        self.offset += len(lemma) + 1
+        return tid
+
+    def add_dependency(self, head, dependent, relation):
+
+        self.dependencies.append((head, dependent, relation))
+
+    def to_xml(self):
+        '''
+        Returns document as naf (with text, terms, deps and coreferences layers)
+        '''
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<NAF xml:lang="nl" version="v3">', '<text>']
+        for number, (tid, lemma, pos, sentence, offset) in enumerate(self.terms):
+            lines.append('<wf id="w{}" offset="{}" length="{}" sent="{}">{}</wf>'.format(number, offset, len(lemma), sentence, escape(lemma)))
+        lines.append('</text>')
+        lines.append('<terms>')
+        for number, (tid, lemma, pos, sentence, offset) in enumerate(self.terms):
+            lines.append('<term id="{}" lemma={} pos="{}"><span><target id="w{}"/></span></term>'.format(tid, quoteattr(lemma), pos, number))
+        lines.append('</terms>')
+        lines.append('<deps>')
+        for head, dependent, relation in self.dependencies:
+            lines.append('<dep from="{}" to="{}" rfunc="{}"/>'.format(head, dependent, relation))
+        lines.append('</deps>')
+        lines.append('<coreferences>')
+        for number, chain in enumerate(self.chains):
+            lines.append('<coref id="co{}" type="entity">'.format(number))
+            for tid in chain:
+                lines.append('<span><target id="{}" head="yes"/></span>'.format(tid))
+            lines.append('</coref>')
+        lines.append('</coreferences>')
+        lines.append('</NAF>')
+        return '\n'.join(lines) + '\n'
+
+
+def add_noun_phrase(builder, rnd, sentence, depth):
+    '''
+    Function that adds a noun phrase: a name (possibly multiword), a pronoun or a noun with determiner, adjective
+    and a chain of prepositional modifiers of the given depth
+    :return: term id of head
+    '''
+    choice = rnd.random()
+    if choice < 0.25:
+        name = rnd.choice(names)
+        head = builder.add_term(name[0], 'name', sentence)
+        for part in name[1:]:
+            builder.add_dependency(head, builder.add_term(part, 'name', sentence), 'mwp/mwp')
+        return head
+    if choice < 0.4:
+        return builder.add_term(rnd.choice(pronouns), 'pron', sentence)
+    determiner = builder.add_term(rnd.choice(determiners), 'det', sentence)
+    if rnd.random() < 0.3:
+        adjective = builder.add_term(rnd.choice(adjectives), 'adj', sentence)
+    else:
+        adjective = None
+    head = builder.add_term(rnd.choice(nouns), 'noun', sentence)
+    builder.add_dependency(head, determiner, 'hd/det')
+    if adjective is not None:
+        builder.add_dependency(head, adjective, 'hd/mod')
+    if depth > 0:
+        preposition = builder.add_term(rnd.choice(prepositions), 'prep', sentence)
+        builder.add_dependency(head, preposition, 'hd/mod')
+        builder.add_dependency(preposition, add_noun_phrase(builder, rnd, sentence, depth - 1), 'hd/obj1')
+    return head
+
+
+def add_argument(builder, rnd, sentence, depth, coordination, mentions):
+    '''
+    Function that adds a (possibly coordinated) argument and records the heads of its noun phrases as mentions
+    :return: term id of head of argument
+    '''
+    if rnd.random() < coordination:
+        first = add_noun_phrase(builder, rnd, sentence, depth)
+        conjunction = builder.add_term('en', 'vg', sentence)
+        second = add_noun_phrase(builder, rnd, sentence, depth)
+        builder.add_dependency(conjunction, first, 'crd/cnj')
+        builder.add_dependency(conjunction, second, 'crd/cnj')
+        mentions.extend([first, second])
+        return conjunction
+    head = add_noun_phrase(builder, rnd, sentence, depth)
+    mentions.append(head)
+    return head
+
+
+def add_sentence(builder, rnd, sentence, depth, coordination, passives, mentions):
+    '''
+    Function that adds an active sentence (subject, verb, object and a prepositional modifier) or a passive
+    (auxiliary with a subject that is also the object of the participle)
+    '''
+    if rnd.random() < passives:
+        subject = add_argument(builder, rnd, sentence, depth, coordination, mentions)
+        auxiliary = builder.add_term('word', 'verb', sentence)
+        participle = builder.add_term(rnd.choice(participles), 'verb', sentence)
+        builder.add_dependency(auxiliary, subject, 'hd/su')
+        builder.add_dependency(auxiliary, participle, 'hd/vc')
+        builder.add_dependency(participle, subject, 'hd/obj1')
+        head = participle
+    else:
+        subject = add_argument(builder, rnd, sentence, depth, coordination, mentions)
+        head = builder.add_term(rnd.choice(verbs), 'verb', sentence)
+        obj = add_argument(builder, rnd, sentence, depth, coordination, mentions)
+        builder.add_dependency(head, subject, 'hd/su')
+        builder.add_dependency(head, obj, 'hd/obj1')
+    preposition = builder.add_term(rnd.choice(prepositions), 'prep', sentence)
+    builder.add_dependency(head, preposition, 'hd/mod')
+    builder.add_dependency(preposition, add_noun_phrase(builder, rnd, sentence, depth), 'hd/obj1')
+    builder.add_term('.', 'punct', sentence)
+
+
+def generate_naf(sentences, depth=1, coordination=0.2, passives=0.1, chain_length=5, single_chain=False, seed=1):
+    '''
+    Function that generates a synthetic Dutch naf document
+    :param sentences: number of sentences
+    :param depth: depth of prepositional modifier chains in noun phrases
+    :param coordination: probability that an argument is coordinated
+    :param passives: probability that a sentence is passive
+    :param chain_length: number of mentions per coreference chain (0: no coreference layer content)
+    :param single_chain: if True, all mentions are in one coreference chain (chain_length is ignored)
+    :param seed: random seed
+    :return: naf document (string)
+    '''
+    rnd = random.Random(seed)
+    builder = cNafBuilder()
+    mentions = []
+    for sentence in range(1, sentences + 1):
+        add_sentence(builder, rnd, sentence, depth, coordination, passives, mentions)
+    if single_chain:
+        builder.chains.append(mentions)
+    elif chain_length > 1:
+        rnd.shuffle(mentions)
+        for start in range(0, len(mentions) - chain_length + 1, chain_length):
+            builder.chains.append(mentions[start:start + chain_length])
+    return builder.to_xml()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Writes a synthetic Dutch naf document to stdout')
+    parser.add_argument('sentences', type=int)
+    parser.add_argument('--depth', type=int, default=1)
+    parser.add_argument('--coordination', type=float, default=0.2)
+    parser.add_argument('--passives', type=float, default=0.1)
+    parser.add_argument('--chain-length', type=int, default=5)
+    parser.add_argument('--single-chain', action='store_true', default=False)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    sys.stdout.write(generate_naf(args.sentences, args.depth, args.coordination, args.passives, args.chain_length,
+                                  args.single_chain, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,9 @@
-from .microportraits import main
-main()
+import sys
+
+#python -m microportraits serve [options] starts the extraction server, anything else is a normal extraction run
+if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+    from .serve import main
+    main(sys.argv[2:])
+else:
+    from .microportraits import main
+    main()
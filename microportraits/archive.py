@@ -0,0 +1,269 @@
+import io
+import os
+import time
+import posixpath
+import tarfile
+import zipfile
+import logging
+import threading
+import traceback
+from multiprocessing import Pool, cpu_count
+
+from .writers import output_writers, binary_formats
+from .stats import run_stage
+from .compression import open_compressed_output
+from .batch import get_output_filename, collect_failures
+from .pipeline import extract_rows, write_output
+
+
+#output archives are recognised by extension; tar archives are compressed according to the extension
+tar_write_modes = {'.tar': 'w|', '.tar.gz': 'w|gz', '.tgz': 'w|gz', '.tar.xz': 'w|xz', '.tar.bz2': 'w|bz2'}
+
+
+def is_archive_name(path):
+
+    return path.endswith('.zip') or any(path.endswith(extension) for extension in tar_write_modes)
+
+
+def is_safe_member_name(name):
+    '''
+    Function that checks that a member name is relative and does not go up a directory, so that its output stays
+    inside the output directory or archive
+    :param name: name of input member
+    :return: bool
+    '''
+    parts = name.replace('\\', '/').split('/')
+    return not (parts[0] == '' or ':' in parts[0] or '..' in parts)
+
+
+def get_member_output_name(name, output_format='csv', compression=None):
+    '''
+    Function that determines the name of the output of an input member (keeping its directories)
+    :param name: name of input member
+    :param output_format: output format (see writers.py)
+    :param compression: compression of output (None: not compressed)
+    :return: relative output name
+    '''
+    if not is_safe_member_name(name):
+        raise ValueError('member name {} is absolute or goes up a directory'.format(name))
+    name = posixpath.normpath(name.replace('\\', '/'))
+    return get_output_filename(name, posixpath.dirname(name), output_format, compression)
+
+
+def iterate_members(path):
+    '''
+    Generator that yields the regular (non hidden) files of a tar or zip archive. Tar archives (also compressed
+    ones) are read as a stream, so members are yielded in the order in which they are stored without an index.
+    :param path: path of archive
+    :return: tuples of member name and content (bytes)
+    '''
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and not os.path.basename(info.filename).startswith('.'):
+                    yield info.filename, archive.read(info)
+        return
+    with tarfile.open(path, 'r|*') as archive:
+        for member in archive:
+            if member.isfile() and not os.path.basename(member.name).startswith('.'):
+                yield member.name, archive.extractfile(member).read()
+
+
+def serialise_rows(rows, output_format, compression=None):
+    '''
+    Function that writes rows to bytes (the content of an output member)
+    :param rows: iterable of output rows
+    :param output_format: output format (see writers.py)
+    :param compression: compression of output (None: not compressed)
+    :return: bytes
+    '''
+    buffer = io.BytesIO()
+    outfile = buffer
+    if compression is not None:
+        outfile = open_compressed_output(buffer, compression)
+    if output_format in binary_formats:
+        output_writers[output_format](rows, outfile)
+    else:
+        textfile = io.TextIOWrapper(outfile, encoding='utf-8', newline='')
+        output_writers[output_format](rows, textfile)
+        #flushes the text without closing the stream below it
+        textfile.detach()
+    if outfile is not buffer:
+        outfile.close()
+    return buffer.getvalue()
+
+
+class cArchiveWriter():
+    '''
+    Class that writes output members to a tar or zip archive, or output files to a directory (keeping the
+    directories of the input members)
+    '''
+
+    def __init__(self, path, output_format='csv', compression=None):
+        '''
+        Opens output
+        :param path: path of output archive (.tar, .tar.gz, .tgz, .tar.xz, .tar.bz2 or .zip) or directory
+        :param output_format: output format (see writers.py)
+        :param compression: compression of each output member (None: not compressed)
+        '''
+
+        self.path = path
+        self.output_format = output_format
+        self.compression = compression
+        self.tar = None
+        self.zip = None
+        #input member of each output name written so far
+        self.output_members = {}
+        if path.endswith('.zip'):
+            self.zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        elif is_archive_name(path):
+            mode = [tar_write_modes[extension] for extension in tar_write_modes if path.endswith(extension)][0]
+            self.tar = tarfile.open(path, mode)
+        elif not os.path.isdir(path):
+            os.makedirs(path)
+
+    def get_output_name(self, name):
+        '''
+        Returns the output name of an input member. Like input files in batch mode, members whose names only differ in
+        their .naf or compression extension (x/a.naf and x/a.naf.gz) would get the same output; only the first of them
+        is written.
+        :param name: name of input member
+        :return: output name
+        :raise ValueError: if the name is absolute or goes up a directory, or an earlier member has the same output
+        '''
+        output_name = get_member_output_name(name, self.output_format, self.compression)
+        earlier = self.output_members.get(output_name)
+        if earlier is not None:
+            raise ValueError('output of member {} would be written to {}, the output of {}'.format(name, output_name, earlier))
+        return output_name
+
+    def write(self, name, rows, stats=None):
+        '''
+        Writes the rows of an input member
+        :param name: name of input member
+        :param rows: list of output rows
+        :param stats: cDocumentStats in which the number of rows is recorded (None: not recorded)
+        :return: None
+        '''
+        output_name = self.get_output_name(name)
+        self.output_members[output_name] = name
+        if self.tar is None and self.zip is None:
+            outputfile = os.path.join(self.path, output_name)
+            #directories in the output directory may be links to elsewhere
+            output_root = os.path.realpath(self.path)
+            if not os.path.realpath(outputfile).startswith(os.path.join(output_root, '')):
+                raise ValueError('output of member {} would be written outside {}'.format(name, self.path))
+            if not os.path.isdir(os.path.dirname(outputfile)):
+                os.makedirs(os.path.dirname(outputfile), exist_ok=True)
+            write_output(rows, outputfile, self.output_format, self.compression, stats)
+            return
+        if stats is not None:
+            rows = stats.count_rows(rows)
+        content = serialise_rows(rows, self.output_format, self.compression)
+        if self.zip is not None:
+            self.zip.writestr(output_name, content)
+        else:
+            info = tarfile.TarInfo(output_name)
+            info.size = len(content)
+            info.mtime = time.time()
+            self.tar.addfile(info, io.BytesIO(content))
+
+    def close(self):
+
+        if self.zip is not None:
+            self.zip.close()
+        if self.tar is not None:
+            self.tar.close()
+
+
+def create_archive_tasks(members, options, collect_stats, collect_coverage, slots, stopped):
+    '''
+    Generator that turns the members of an archive into tasks for extract_rows; it waits while too many members
+    are being extracted or written, so the archive is read no faster than it is processed
+    :param members: iterable of (member name, content) tuples
+    :param options: dictionary of extraction options
+    :param collect_stats: whether statistics are collected
+    :param collect_coverage: whether rule coverage is collected
+    :param slots: semaphore with a slot per member that may be in progress
+    :param stopped: event set when the run stops early (a slot is then released to wake the generator)
+    :return: tuples of task, content and (empty) manifest record
+    '''
+    for name, content in members:
+        slots.acquire()
+        if stopped.is_set():
+            return
+        yield (name, None, options, collect_stats, collect_coverage, False), content, None
+
+
+def extract_member(task):
+
+    return extract_rows(*task)
+
+
+def run_archive(inputarchive, output, surface=False, nocoref=False, workers=None, reader='kafnaf',
+                merge_redundant=False, language='nl', output_format='csv', stats=None, cache_dir=None, compression=None):
+    '''
+    Function that extracts microportraits of all naf files in a tar or zip archive. Members are read as a stream and
+    sent to worker processes; their rows are written to an output archive or directory in the order of the input.
+    Portrait identifiers start with the member name (without .naf), like the input file name in other runs.
+    :param inputarchive: path of input archive (tar, possibly compressed, or zip)
+    :param output: path of output archive or directory (see cArchiveWriter)
+    :param workers: number of worker processes (default: number of cores)
+    :param stats: cBatchStats in which time per stage and counts of each member are collected (None: not collected)
+    :param compression: compression of each output member (None: not compressed)
+    :return: list of members for which extraction failed
+    '''
+    if workers is None:
+        workers = cpu_count()
+    options = {'surface': surface, 'nocoref': nocoref, 'reader': reader, 'merge_redundant': merge_redundant,
+               'language': language, 'output_format': output_format, 'cache_dir': cache_dir}
+    collect_stats = stats is not None
+    collect_coverage = collect_stats and stats.coverage is not None
+    #not bounded: a slot is released without a member when the run stops early
+    slots = threading.Semaphore(2 * workers)
+    stopped = threading.Event()
+    tasks = create_archive_tasks(iterate_members(inputarchive), options, collect_stats, collect_coverage, slots, stopped)
+    writer = cArchiveWriter(output, output_format, compression)
+    failed = []
+    number_of_members = 0
+    pool = None
+    try:
+        if workers == 1:
+            results = map(extract_member, tasks)
+        else:
+            pool = Pool(workers)
+            results = pool.imap(extract_member, tasks)
+        for task, error, rows, document_stats, record in results:
+            name = task[0]
+            number_of_members += 1
+            if error is None:
+                try:
+                    writer.get_output_name(name)
+                except ValueError as rejected:
+                    error = '{}, output not written'.format(rejected)
+            if error is None:
+                try:
+                    run_stage(document_stats, 'create_output', writer.write, name, rows, document_stats)
+                except Exception:
+                    error = 'could not write output of {}\n{}'.format(name, traceback.format_exc())
+            rows = None
+            if error is not None:
+                result = (name, error, None, None)
+            elif document_stats is not None:
+                result = (name, None, document_stats.to_dict(), None)
+            else:
+                result = (name, None, None, None)
+            failed.extend(collect_failures([result], stats))
+            slots.release()
+    finally:
+        if pool is not None:
+            #all results have been received, unless the run was interrupted; the archive reader runs in the task
+            #thread of the pool, which terminate waits for, so it must not be left waiting for a slot
+            stopped.set()
+            slots.release()
+            pool.terminate()
+            pool.join()
+        writer.close()
+
+    logging.info('processed %d members of %s, %d failed', number_of_members, inputarchive, len(failed))
+    return failed
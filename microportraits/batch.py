@@ -0,0 +1,213 @@
+import os
+import logging
+import traceback
+from collections import defaultdict
+from multiprocessing import Pool, cpu_count
+
+from .microportraits import extract_microportraits
+from .writers import output_extensions
+from .stats import cDocumentStats
+from .manifest import cManifest, create_record
+from .compression import compression_extensions, open_output, strip_compression_extension
+
+
+def collect_input_files(inputdir=None, filelist=None):
+    '''
+    Function that collects the naf files to process in batch mode. Output files are named after the input file name
+    only, so input files whose names only differ in their directory, .naf or compression extension are refused.
+    :param inputdir: directory whose (non hidden) files are processed
+    :param filelist: file with one input path per line
+    :return: list of input paths
+    :raise ValueError: if two input files would be written to the same output file
+    '''
+    inputfiles = []
+    if inputdir is not None:
+        for filename in sorted(os.listdir(inputdir)):
+            path = os.path.join(inputdir, filename)
+            if not filename.startswith('.') and os.path.isfile(path):
+                inputfiles.append(path)
+    if filelist is not None:
+        with open(filelist) as infile:
+            for line in infile:
+                path = line.strip()
+                if path:
+                    inputfiles.append(path)
+    check_output_names(inputfiles)
+    return inputfiles
+
+
+def check_output_names(inputfiles):
+    '''
+    Function that checks that no two input files get the same output file
+    :param inputfiles: list of input paths
+    :return: None
+    :raise ValueError: listing (up to 10) groups of input files that share an output file
+    '''
+    output_names = defaultdict(list)
+    for inputfile in inputfiles:
+        output_names[get_output_filename(inputfile, '')].append(inputfile)
+    collisions = [files for files in output_names.values() if len(files) > 1]
+    if len(collisions) > 0:
+        lines = [', '.join(files) for files in collisions[:10]]
+        raise ValueError('output of these input files would be written to the same file:\n{}'.format('\n'.join(lines)))
+
+
+def get_output_filename(inputfile, outputdir, output_format='csv', compression=None):
+    '''
+    Function that determines where the output for an input file is written (inputname without .naf and compression
+    extension + extension of format and of output compression)
+    :param inputfile: path of the input naf
+    :param outputdir: output directory
+    :param output_format: output format (see writers.py)
+    :param compression: compression of output (None: not compressed)
+    :return: path of output file
+    '''
+    basename = strip_compression_extension(os.path.basename(inputfile))
+    if basename.endswith('.naf'):
+        basename = basename[:-len('.naf')]
+    extension = output_extensions[output_format]
+    if compression is not None:
+        extension += compression_extensions[compression]
+    return os.path.join(outputdir, basename + extension)
+
+
+def extract_file(task):
+    '''
+    Function that extracts microportraits of one file; errors are caught so that a single file cannot stop a batch
+    :param task: tuple of inputfile, outputfile, dictionary of options for extract_microportraits, whether
+    statistics are collected, whether rule coverage is collected and whether a manifest record is created
+    :return: tuple of inputfile, error message (None if extraction succeeded), statistics (dictionary, None if
+    not collected) and manifest record (see create_record, None if not created)
+    '''
+    inputfile, outputfile, options, collect_stats, collect_coverage, incremental = task
+    stats = None
+    if collect_stats:
+        stats = cDocumentStats(inputfile, collect_coverage)
+    record = None
+    try:
+        #the state of the input is recorded before extraction, so a change during extraction is seen next run
+        if incremental:
+            record = create_record(inputfile)
+            record['output'] = outputfile
+        extract_options = dict(options)
+        compression = extract_options.pop('compression', None)
+        with open_output(outputfile, options.get('output_format', 'csv'), compression) as outfile:
+            extract_microportraits(inputfile, outfile, stats=stats, **extract_options)
+    except Exception:
+        #do not leave partial output behind
+        if os.path.exists(outputfile):
+            os.remove(outputfile)
+        return inputfile, traceback.format_exc(), None, None
+    if stats is not None:
+        return inputfile, None, stats.to_dict(), record
+    return inputfile, None, None, record
+
+
+def get_chunksize(number_of_tasks, workers):
+    '''
+    Function that determines how many files are sent to a worker at once (same heuristic as Pool.map)
+    :param number_of_tasks: number of files in batch
+    :param workers: number of worker processes
+    :return: chunksize
+    '''
+    chunksize, extra = divmod(number_of_tasks, workers * 4)
+    if extra:
+        chunksize += 1
+    return max(chunksize, 1)
+
+
+def collect_failures(results, stats=None, manifest=None):
+    '''
+    Function that reports errors of extraction results as they come in
+    :param results: iterable of (inputfile, error, document statistics, manifest record) tuples
+    :param stats: cBatchStats to which document statistics are added (None: statistics are ignored)
+    :param manifest: cManifest to which records of extracted files are added (None: no manifest)
+    :return: list of files for which extraction failed
+    '''
+    failed = []
+    for inputfile, error, document_stats, record in results:
+        if error is not None:
+            logging.error('could not extract microportraits from %s\n%s', inputfile, error)
+            failed.append(inputfile)
+            if stats is not None:
+                stats.add_failure()
+            continue
+        if stats is not None and document_stats is not None:
+            stats.add_document(document_stats)
+        if manifest is not None and record is not None:
+            manifest.add(record)
+    return failed
+
+
+def run_batch(inputfiles, outputdir, surface=False, nocoref=False, workers=None, chunksize=None, reader='kafnaf',
+              merge_redundant=False, language='nl', output_format='csv', stats=None, incremental=False, cache_dir=None,
+              window=None, readers=None, compression=None):
+    '''
+    Function that extracts microportraits for a list of files, writing one output file per file to outputdir
+    :param inputfiles: list of input naf files
+    :param outputdir: directory where output csv files are written
+    :param surface: if True, descriptions use surface forms rather than lemmas
+    :param nocoref: if True, portraits are not merged based on coreference
+    :param workers: number of worker processes (default: number of cores)
+    :param chunksize: number of files sent to a worker at once (default: derived from batch size)
+    :param reader: naf reader to use ('kafnaf' or 'stream')
+    :param merge_redundant: if True, new information of redundant portraits is kept
+    :param language: language whose extraction rules are used
+    :param output_format: format of output files (see writers.py)
+    :param stats: cBatchStats in which time per stage and counts of each document are collected (None: not collected)
+    :param incremental: if True, files whose content, extractor version and options are unchanged since they were
+    last extracted (according to the manifest in outputdir) are skipped
+    :param cache_dir: directory with compiled layers of naf files (see naf_cache.py; None: no cache)
+    :param window: if set, each file is extracted this number of sentences at a time (see windowed.py)
+    :param readers: if set, files are read by this number of threads ahead of extraction and written by a separate
+    thread (see pipeline.py; cannot be combined with window)
+    :param compression: compression of output files ('gzip', 'xz' or 'zstd'; None: not compressed)
+    :return: list of files for which extraction failed
+    '''
+    if not os.path.isdir(outputdir):
+        os.makedirs(outputdir)
+    if workers is None:
+        workers = cpu_count()
+    options = {'surface': surface, 'nocoref': nocoref, 'reader': reader, 'merge_redundant': merge_redundant,
+               'language': language, 'output_format': output_format, 'cache_dir': cache_dir,
+               'window': window, 'compression': compression}
+    collect_stats = stats is not None
+    collect_coverage = collect_stats and stats.coverage is not None
+    manifest = None
+    if incremental:
+        manifest = cManifest(outputdir, options)
+    tasks = []
+    for inputfile in inputfiles:
+        outputfile = get_output_filename(inputfile, outputdir, output_format, compression)
+        if manifest is None or not manifest.is_up_to_date(inputfile, outputfile):
+            tasks.append((inputfile, outputfile, options, collect_stats, collect_coverage, incremental))
+    if manifest is not None:
+        logging.info('%d of %d files unchanged since last run', len(inputfiles) - len(tasks), len(inputfiles))
+
+    failed = []
+    try:
+        if readers is not None and len(tasks) > 0:
+            from .pipeline import run_pipeline
+
+            def handle_result(result):
+                failed.extend(collect_failures([result], stats, manifest))
+
+            run_pipeline(tasks, workers, readers, handle_result)
+        elif workers == 1 or len(tasks) == 0:
+            results = map(extract_file, tasks)
+            failed = collect_failures(results, stats, manifest)
+        else:
+            if chunksize is None:
+                chunksize = get_chunksize(len(tasks), workers)
+            pool = Pool(workers)
+            try:
+                failed = collect_failures(pool.imap_unordered(extract_file, tasks, chunksize), stats, manifest)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+    logging.info('processed %d files, %d failed', len(tasks), len(failed))
+    return failed
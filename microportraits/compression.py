@@ -0,0 +1,141 @@
+import io
+import gzip
+import lzma
+from contextlib import contextmanager
+
+#zstandard is only needed for zstd compressed input and output
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .writers import binary_formats
+
+
+#compression of input files is recognised by extension or, failing that, by the first bytes of the file
+compression_extensions = {'gzip': '.gz', 'xz': '.xz', 'zstd': '.zst'}
+compression_magic = {'gzip': b'\x1f\x8b', 'xz': b'\xfd7zXZ\x00', 'zstd': b'\x28\xb5\x2f\xfd'}
+magic_length = max(len(magic) for magic in compression_magic.values())
+
+
+def check_zstd():
+
+    if zstandard is None:
+        raise ImportError('zstd compression requires zstandard (pip install zstandard)')
+
+
+def detect_compression(header):
+    '''
+    Function that recognises compressed data by its first bytes
+    :param header: first bytes of data
+    :return: name of compression (None if not compressed)
+    '''
+    for compression, magic in compression_magic.items():
+        if header.startswith(magic):
+            return compression
+    return None
+
+
+def get_input_compression(inputfile):
+    '''
+    Function that determines how an input file is compressed
+    :param inputfile: path or binary file object (file objects are only recognised by their first bytes if they
+    can be peeked at or rewound)
+    :return: name of compression (None if not compressed)
+    '''
+    if isinstance(inputfile, str):
+        for compression, extension in compression_extensions.items():
+            if inputfile.endswith(extension):
+                return compression
+        with open(inputfile, 'rb') as infile:
+            return detect_compression(infile.read(magic_length))
+    if hasattr(inputfile, 'peek'):
+        return detect_compression(inputfile.peek(magic_length)[:magic_length])
+    if hasattr(inputfile, 'seekable') and inputfile.seekable():
+        position = inputfile.tell()
+        header = inputfile.read(magic_length)
+        inputfile.seek(position)
+        return detect_compression(header)
+    return None
+
+
+def strip_compression_extension(filename):
+    '''
+    Function that removes the extension of a compression from a file name (doc.naf.gz becomes doc.naf)
+    '''
+    for extension in compression_extensions.values():
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return filename
+
+
+def open_decompressed(inputfile, compression):
+    '''
+    Function that opens a compressed input for reading
+    :param inputfile: path or binary file object
+    :param compression: name of compression
+    :return: binary file object with the decompressed data
+    '''
+    if compression == 'gzip':
+        if isinstance(inputfile, str):
+            return gzip.open(inputfile, 'rb')
+        return gzip.GzipFile(fileobj=inputfile, mode='rb')
+    if compression == 'xz':
+        return lzma.LZMAFile(inputfile, 'rb')
+    check_zstd()
+    if isinstance(inputfile, str):
+        return zstandard.ZstdDecompressor().stream_reader(open(inputfile, 'rb'), closefd=True)
+    return zstandard.ZstdDecompressor().stream_reader(inputfile, closefd=False)
+
+
+@contextmanager
+def open_naf(inputfile):
+    '''
+    Context manager that gives the input to pass to a naf reader: the input itself if it is not compressed, a
+    decompressing file object otherwise (so no decompressed copy is written)
+    :param inputfile: path or binary file object
+    :return: path or file object
+    '''
+    compression = get_input_compression(inputfile)
+    if compression is None:
+        yield inputfile
+    else:
+        with open_decompressed(inputfile, compression) as infile:
+            yield infile
+
+
+def open_compressed_output(outputfile, compression):
+    '''
+    Function that opens a binary file object that compresses what is written to it
+    :param outputfile: path or binary file object (which is left open when the compressed stream is closed)
+    :param compression: name of compression
+    :return: binary file object
+    '''
+    if compression == 'gzip':
+        if isinstance(outputfile, str):
+            return gzip.open(outputfile, 'wb')
+        return gzip.GzipFile(fileobj=outputfile, mode='wb')
+    if compression == 'xz':
+        return lzma.LZMAFile(outputfile, 'wb')
+    check_zstd()
+    if isinstance(outputfile, str):
+        return zstandard.ZstdCompressor().stream_writer(open(outputfile, 'wb'), closefd=True)
+    return zstandard.ZstdCompressor().stream_writer(outputfile, closefd=False)
+
+
+def open_output(outputfile, output_format='csv', compression=None):
+    '''
+    Function that opens an output file for a format, compressing it if a compression is given
+    :param outputfile: path, or binary file object (e.g. sys.stdout.buffer) if a compression is given
+    :param output_format: output format (see writers.py)
+    :param compression: name of compression (None: not compressed)
+    :return: file object (binary for parquet and arrow, text otherwise)
+    '''
+    if compression is None:
+        if output_format in binary_formats:
+            return open(outputfile, 'wb')
+        return open(outputfile, 'w', newline='')
+    outfile = open_compressed_output(outputfile, compression)
+    if output_format in binary_formats:
+        return outfile
+    return io.TextIOWrapper(outfile, encoding='utf-8', newline='')
@@ -0,0 +1,135 @@
+import os
+import json
+import hashlib
+import logging
+
+
+#manifest of a batch run, stored in the output directory (hidden, so it is not taken as input of a directory)
+manifest_name = '.microportraits-manifest.jsonl'
+#options that change the output (the naf reader does not; the window changes the order of rows)
+manifest_options = ['surface', 'nocoref', 'merge_redundant', 'language', 'output_format', 'window', 'compression']
+
+
+def hash_file(path):
+    '''
+    Function that returns the sha256 of the content of a file
+    :param path: path of file
+    :return: hexadecimal digest
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_extractor_version():
+    '''
+    Function that identifies the extractor: the version of the package and a hash of its source files, so that any
+    change to the code or the rules invalidates earlier output
+    :return: version string
+    '''
+    from . import __version__
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for filename in sorted(os.listdir(package_dir)):
+        if filename.endswith('.py'):
+            digest.update(filename.encode('utf-8'))
+            with open(os.path.join(package_dir, filename), 'rb') as infile:
+                digest.update(infile.read())
+    return '{}+{}'.format(__version__, digest.hexdigest()[:12])
+
+
+def create_record(inputfile, content=None):
+    '''
+    Function that describes the current state of an input file
+    :param inputfile: path of input naf
+    :param content: content of the file if it has been read already (bytes; None: the file is read)
+    :return: dictionary with absolute path, size, mtime and content hash
+    '''
+    stat = os.stat(inputfile)
+    if content is None:
+        digest = hash_file(inputfile)
+    else:
+        digest = hashlib.sha256(content).hexdigest()
+    return {'path': os.path.abspath(inputfile), 'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': digest}
+
+
+class cManifest():
+    '''
+    Class that records which inputs were extracted with which extractor version and options. Entries are appended
+    while a run goes on (so an interrupted run keeps its progress) and the file is compacted when the run is closed.
+    '''
+
+    def __init__(self, outputdir, options):
+        '''
+        Loads manifest of output directory (if any)
+        :param outputdir: output directory of batch run
+        :param options: dictionary of extraction options of the run
+        '''
+
+        self.path = os.path.join(outputdir, manifest_name)
+        self.version = get_extractor_version()
+        self.options = dict((name, options.get(name)) for name in manifest_options)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as infile:
+                for line in infile:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        #last line of an interrupted run
+                        logging.warning('ignoring incomplete line in %s', self.path)
+                        continue
+                    self.entries[entry['path']] = entry
+        self.log = open(self.path, 'a')
+
+    def is_up_to_date(self, inputfile, outputfile):
+        '''
+        Checks whether the output of an input file was created from the same content with the same extractor version
+        and options. Files whose size and mtime are unchanged are not read; others are compared by content hash.
+        :param inputfile: path of input naf
+        :param outputfile: path of its output
+        :return: True if the file does not need to be extracted
+        '''
+        entry = self.entries.get(os.path.abspath(inputfile))
+        if entry is None or entry['version'] != self.version or entry['options'] != self.options:
+            return False
+        if not os.path.exists(outputfile):
+            return False
+        stat = os.stat(inputfile)
+        if stat.st_size == entry['size'] and stat.st_mtime == entry['mtime']:
+            return True
+        if stat.st_size != entry['size']:
+            return False
+        record = create_record(inputfile)
+        if record['hash'] != entry['hash']:
+            return False
+        #same content, only touched: remember new mtime
+        record['output'] = entry['output']
+        self.add(record)
+        return True
+
+    def add(self, record):
+        '''
+        Adds entry for an extracted file
+        :param record: state of input file (see create_record) and path of its output
+        :return: None
+        '''
+        entry = dict(record)
+        entry['version'] = self.version
+        entry['options'] = self.options
+        self.entries[entry['path']] = entry
+        self.log.write(json.dumps(entry) + '\n')
+        self.log.flush()
+
+    def close(self):
+        '''
+        Rewrites the manifest with one entry per input file
+        '''
+        self.log.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as outfile:
+            for path in sorted(self.entries):
+                outfile.write(json.dumps(self.entries[path]) + '\n')
+        os.replace(tmp_path, self.path)
@@ -1,30 +1,197 @@
 import sys
-
-if sys.version_info < (3, 0):
-    import unicodecsv as csv
-else:
-    import csv
 from collections import defaultdict
+from array import array
 import argparse
 from KafNafParserPy import *
 import logging
+from .naf_reader import read_naf_layers, cCompiledLayers
+from .rules import get_relation_code, get_rules, relation_names, rule_tables
+from .writers import output_writers, binary_formats, check_pyarrow
+from .stats import run_stage, cDocumentStats, cBatchStats
+from .compression import compression_extensions, check_zstd, open_naf, open_output, strip_compression_extension
 
 def _debug(*args):
     # best to replace with proper "message {param}".format, but good enough for now
+    #messages are only built if debug logging is enabled (-v)
+    if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        return
     msg = " ".join(str(x) for x in args)
     logging.debug(msg)
 
-target_pos = ['noun','name','pron']
-dep2heads = defaultdict(list)
-head2deps = defaultdict(list)
-dep_extractor = None
-term2lemma = {}
+
+def count_rule(context, branch, outcome, relation):
+    '''
+    Function that counts which outcome of a rule branch fired for a relation. Only called if rule coverage is
+    collected (context.coverage is not None), so that the rules do not pay for a call otherwise.
+    :param context: extraction context of input naf
+    :param branch: rule branch (e.g. 'head', 'entity dependent')
+    :param outcome: action taken, 'ignored' or 'not covered'
+    :param relation: relation code
+    :return: None
+    '''
+    context.coverage[(branch, outcome, relation_names[relation])] += 1
+
+class cTermTable():
+    '''
+    Class that stores the information we need about terms in parallel lists (one position per term, in document order)
+    '''
+
+    def __init__(self):
+        '''
+        Initiates empty table (filled by create_term_table)
+        '''
+
+        self.index = {}
+        self.ids = []
+        self.lemmas = []
+        self.surfaces = []
+        self.pos = []
+        self.offsets = []
+        self.sentences = []
+
+    def add_term(self, tid, lemma, surface, pos, offset, sentence):
+        '''
+        Adds term to table
+        :param tid: term id
+        :param lemma: lemma of term
+        :param surface: lowercased surface form of term (None if tokens are missing)
+        :param pos: pos tag
+        :param offset: offset of first token (int, None if unknown)
+        :param sentence: sentence number of first token (int, None if unknown)
+        '''
+
+        self.index[tid] = len(self.ids)
+        self.ids.append(tid)
+        self.lemmas.append(lemma)
+        self.surfaces.append(surface)
+        self.pos.append(pos)
+        self.offsets.append(offset)
+        self.sentences.append(sentence)
+
+    def get_lemma(self, tid):
+
+        return self.lemmas[self.index[tid]]
+
+    def get_pos(self, tid):
+
+        return self.pos[self.index[tid]]
+
+    def __len__(self):
+
+        return len(self.ids)
+
+
+class cDependencyGraph():
+    '''
+    Class that stores the dependencies of a document in compressed sparse row layout over term numbers.
+    The dependents of term n are dep_ids[dep_offsets[n]:dep_offsets[n+1]] with their relation codes at the same
+    positions in dep_relations; heads are stored the same way. Dependencies keep the order of the naf.
+    '''
+
+    def __init__(self, dep_rows, head_rows):
+        '''
+        Initiates graph
+        :param dep_rows: offsets, term numbers and relation codes arrays of the dependents of each term (see create_rows)
+        :param head_rows: offsets, term numbers and relation codes arrays of the heads of each term
+        '''
+
+        self.dep_offsets, self.dep_ids, self.dep_relations = dep_rows
+        self.head_offsets, self.head_ids, self.head_relations = head_rows
+
+    def has_dependents(self, term_number):
+
+        return self.dep_offsets[term_number + 1] > self.dep_offsets[term_number]
+
+    def has_heads(self, term_number):
+
+        return self.head_offsets[term_number + 1] > self.head_offsets[term_number]
+
+    def get_dependent_ids(self, term_number):
+
+        return self.dep_ids[self.dep_offsets[term_number]:self.dep_offsets[term_number + 1]]
+
+    def get_dependent_relations(self, term_number):
+
+        return self.dep_relations[self.dep_offsets[term_number]:self.dep_offsets[term_number + 1]]
+
+    def get_dependents(self, term_number):
+        '''
+        Returns (term number, relation code) of each dependent of a term
+        '''
+        start = self.dep_offsets[term_number]
+        end = self.dep_offsets[term_number + 1]
+        return zip(self.dep_ids[start:end], self.dep_relations[start:end])
+
+    def get_heads(self, term_number):
+        '''
+        Returns list of (term number, relation code) of each head of a term
+        '''
+        start = self.head_offsets[term_number]
+        end = self.head_offsets[term_number + 1]
+        return list(zip(self.head_ids[start:end], self.head_relations[start:end]))
+
+
+def create_rows(number_of_terms, sources, targets, relations):
+    '''
+    Function that sorts dependencies by source term (keeping their order) into offset, target and relation arrays
+    :param number_of_terms: number of terms
+    :param sources: array of term numbers dependencies are sorted by
+    :param targets: array of term numbers at the other side of each dependency
+    :param relations: array of relation codes
+    :return: offsets, targets and relations arrays
+    '''
+    offsets = array('i', [0]) * (number_of_terms + 1)
+    for source in sources:
+        offsets[source + 1] += 1
+    for term_number in range(number_of_terms):
+        offsets[term_number + 1] += offsets[term_number]
+
+    positions = offsets[:-1]
+    row_targets = array('i', [0]) * len(targets)
+    row_relations = array('i', [0]) * len(relations)
+    for source, target, relation in zip(sources, targets, relations):
+        position = positions[source]
+        row_targets[position] = target
+        row_relations[position] = relation
+        positions[source] = position + 1
+    return offsets, row_targets, row_relations
+
+
+class cExtractionContext():
+    '''
+    Class that holds the information of a single naf document needed during extraction
+    '''
+
+    def __init__(self, nafobj, rules):
+        '''
+        Initiates context (dictionaries are filled by create_info_dicts)
+        :param nafobj: input naf object
+        :param rules: compiled extraction rules of the language of the naf (cRules)
+        '''
+
+        self.nafobj = nafobj
+        self.rules = rules
+        #terms, their dependency graph and the forms (lemma or surface) used in descriptions, all by term number
+        self.terms = None
+        self.graph = None
+        self.forms = None
+        #cCoreferenceIndex, set when portraits are merged
+        self.coreferences = None
+        #counts of (branch, outcome, relation) of the extraction rules, None unless rule coverage is collected
+        self.coverage = None
+        #cDependentIndex of the sentence of the last requested head (see get_full_dependents)
+        self.dependent_index = None
+        #caches filled on first request for a head
+        self.constituent_components = {}
+        self.ordered_constituents = {}
 
 
 class cDescription():
     '''
     Class that captures structure of individual descriptions
     '''
+    __slots__ = ['id', 'mention_id', 'form', 'type', 'pos', 'string_representations', 'dependents',
+                 'constituent_components']
 
     def __init__(self, head_id, head_form, kind, pos, mention_id=None):
         '''
@@ -61,6 +228,7 @@ class cDependent():
     '''
     Class that captures structure of dependents for multiword descriptions
     '''
+    __slots__ = ['id', 'form', 'rel', 'pos', 'constituent_components']
 
     def __init__(self, dep_id, form, rel, pos):
         '''
@@ -84,6 +252,7 @@ class cConstituentComponent():
     '''
     Class with most basic properties of a word
     '''
+    __slots__ = ['form', 'id', 'pos']
 
     def __init__(self, form, tid, pos):
         '''
@@ -101,6 +270,7 @@ class cMicroportait():
     '''
     Class that captures microportrait information
     '''
+    __slots__ = ['portraitId', 'labels', 'properties', 'activities', 'colabels', 'pos', 'pos_list']
 
     def __init__(self, portraitId):
         '''
@@ -179,53 +349,200 @@ class cMicroportait():
 
 
 
-def get_constituent(head_id):
+class cDependentIndex():
     '''
-    Function that creates the largest constituent headed by a given term
-    :param head_id: id of head of constituent
-    :return: list of term_ids (strings) making up the constituent
+    Class that indexes the terms embedded under each head of a sentence. The terms are visited once, depth first,
+    starting from the terms of the sentence that have no head; the terms under a head are then the terms visited
+    after entering it and before leaving it, a slice of the visit order. This does not hold for a head that is part
+    of a cycle or whose terms were partly visited before it through another head (e.g. a subject shared by
+    coordinated verbs); those heads are expanded separately.
     '''
-    global dep_extractor
 
-    dependents = dep_extractor.get_full_dependents(head_id, [])
-    dependents.append(head_id)
+    def __init__(self, graph, start, end):
+        '''
+        Visits the terms of a sentence
+        :param graph: cDependencyGraph
+        :param start: first term number of sentence
+        :param end: term number after sentence
+        '''
+
+        self.graph = graph
+        order = array('i')
+        self.entry = {}
+        self.exit = {}
+        #heads whose dependents are not a slice of the visit order, and their dependents once requested
+        self.separate = {}
+        roots = [term_number for term_number in range(start, end) if not graph.has_heads(term_number)]
+        #terms of cycles that no root leads to
+        roots += range(start, end)
+        for root in roots:
+            if not root in self.entry:
+                self.visit(root, order)
+        self.order = memoryview(order).toreadonly()
+
+    def visit(self, root, order):
+        '''
+        Visits the terms under root that have not been visited yet. For each term, the lowest visit position of a term
+        that a dependency from it or the terms under it leads to is kept: if that position is not after the term's own,
+        its dependents are not exactly the terms visited while it was entered.
+        '''
+        dep_offsets = self.graph.dep_offsets
+        dep_ids = self.graph.dep_ids
+        entry = self.entry
+        #a position after the term's own stands for no such dependency
+        lowest = {root: len(order) + 1}
+        entry[root] = len(order)
+        order.append(root)
+        stack = [[root, dep_offsets[root]]]
+        while stack:
+            top = stack[-1]
+            term_number, position = top
+            if position < dep_offsets[term_number + 1]:
+                top[1] = position + 1
+                dep_id = dep_ids[position]
+                dep_entry = entry.get(dep_id)
+                if dep_entry is None:
+                    entry[dep_id] = len(order)
+                    order.append(dep_id)
+                    if dep_offsets[dep_id + 1] == dep_offsets[dep_id]:
+                        #nothing under it
+                        self.exit[dep_id] = len(order)
+                    else:
+                        lowest[dep_id] = len(order)
+                        stack.append([dep_id, dep_offsets[dep_id]])
+                elif dep_entry < lowest[term_number]:
+                    lowest[term_number] = dep_entry
+            else:
+                stack.pop()
+                self.exit[term_number] = len(order)
+                if lowest[term_number] <= entry[term_number]:
+                    self.separate[term_number] = None
+                if stack and lowest[term_number] < lowest[stack[-1][0]]:
+                    lowest[stack[-1][0]] = lowest[term_number]
+
+    def __contains__(self, head_id):
+
+        return head_id in self.entry
+
+    def get_dependents(self, head_id):
+        '''
+        Returns the terms embedded under a head in depth first order
+        :param head_id: term number of head (must have been visited)
+        :return: read-only view or list of term numbers (shared, do not modify)
+        '''
+        if head_id in self.separate:
+            dependents = self.separate[head_id]
+            if dependents is None:
+                dependents = collect_full_dependents(self.graph, head_id)
+                self.separate[head_id] = dependents
+            return dependents
+        return self.order[self.entry[head_id] + 1:self.exit[head_id]]
+
+
+def collect_full_dependents(graph, head_id):
+    '''
+    Function that collects all terms embedded under a head in depth first order (if the head is part of a cycle,
+    the head itself also ends up among its dependents)
+    :param graph: cDependencyGraph
+    :param head_id: term number of head
+    :return: list of term numbers
+    '''
+    dependents = []
+    seen = set()
+    stack = [iter(graph.get_dependent_ids(head_id))]
+    while stack:
+        for dep_id in stack[-1]:
+            if not dep_id in seen:
+                seen.add(dep_id)
+                dependents.append(dep_id)
+                stack.append(iter(graph.get_dependent_ids(dep_id)))
+                break
+        else:
+            stack.pop()
     return dependents
 
 
-def get_constituent_revised(head_id, nafobj):
+def get_sentence_range(terms, term_number):
+    '''
+    Function that finds the terms of the sentence of a term. Terms without a sentence number belong to the sentence
+    of the term before them (like in get_sentence_windows).
+    :param terms: cTermTable
+    :param term_number: term number
+    :return: first term number of sentence and term number after it
+    '''
+    sentences = terms.sentences
+    start = term_number
+    while start > 0 and sentences[start] is None:
+        start -= 1
+    sentence = sentences[start]
+    previous = start - 1
+    while previous >= 0 and (sentences[previous] is None or sentences[previous] == sentence):
+        if sentences[previous] == sentence:
+            start = previous
+        previous -= 1
+    end = term_number + 1
+    while end < len(sentences) and (sentences[end] is None or sentences[end] == sentence):
+        end += 1
+    return start, end
+
+
+def get_full_dependents(context, head_id):
+    '''
+    Function that returns all terms embedded under a head (its dependents and dependents of its dependents) in
+    depth first order. The terms of a sentence are indexed once, when the first head in it is requested.
+    :param context: extraction context of input naf
+    :param head_id: term number of head
+    :return: read-only view or list of term numbers (shared, do not modify)
+    '''
+    index = context.dependent_index
+    if index is None or not head_id in index:
+        start, end = get_sentence_range(context.terms, head_id)
+        index = cDependentIndex(context.graph, start, end)
+        context.dependent_index = index
+    return index.get_dependents(head_id)
+
+
+def get_constituent_revised(head_id, context):
     '''
     Function that creates the largest constituent headed by a given term
-    :param head_id: id of head of constituent
-    :return: list of cConstiuent objects (id, lemma and pos of terms making up the constituent)
+    :param head_id: term number of head of constituent
+    :return: tuple of cConstiuent objects (id, lemma and pos of terms making up the constituent; shared by the
+    descriptions of the head, do not modify)
     '''
-    global dep_extractor
 
-    constituents = []
-    for dep in dep_extractor.get_full_dependents(head_id, []):
-        term = nafobj.get_term(dep)
-        constituent = cConstituentComponent(term.get_lemma(),dep,term.get_pos())
-        constituents.append(constituent)
+    constituents = context.constituent_components.get(head_id)
+    if constituents is None:
+        terms = context.terms
+        constituents = tuple(cConstituentComponent(terms.lemmas[dep],terms.ids[dep],terms.pos[dep])
+                             for dep in get_full_dependents(context, head_id))
+        context.constituent_components[head_id] = constituents
     return constituents
 
 
+def get_constituent(context, head_id):
+    '''
+    Function that creates the largest constituent headed by a given term
+    :param context: extraction context of input naf
+    :param head_id: term number of head of constituent
+    :return: list of term numbers making up the constituent
+    '''
+
+    dependents = list(get_full_dependents(context, head_id)) + [head_id]
+    return dependents
 
 
-def create_sequence_in_lemmas(nafobj, term_ids):
+def create_sequence_in_lemmas(context, term_numbers):
     '''
-    Function that takes a list of term ids and creates a list of lemmas ordered according to surface order
-    :param nafobj: input naf object
-    :param term_ids: list of term ids
-    :return: ordered list of lemmas
+    Function that takes a list of term numbers and creates a list of lemmas ordered according to surface order
+    :param context: extraction context of input naf
+    :param term_numbers: list of term numbers
+    :return: list with the string of the forms (lemmas or surface forms) of the terms in surface order
     '''
-    global term2lemma
+    offsets = context.terms.offsets
     offset2lemmas = {}
 
-    for tid in term_ids:
-        myterm = nafobj.get_term(tid)
-        first_token_wid = myterm.get_span().get_span_ids()[0]
-        first_token = nafobj.get_token(first_token_wid)
-        offset = int(first_token.get_offset())
-        offset2lemmas[offset] = term2lemma.get(tid)
+    for term_number in term_numbers:
+        offset2lemmas[offsets[term_number]] = context.forms[term_number]
 
     #FIXME: make string with extra space dependent on end word and offset next word
     lemma_string = ''
@@ -235,635 +552,214 @@ def create_sequence_in_lemmas(nafobj, term_ids):
     return [lemma_string.rstrip()]
 
 
-def get_constituent_in_ordered_lemmas(nafobj, head_id):
+def get_constituent_in_ordered_lemmas(context, head_id):
+
+    lemmas = context.ordered_constituents.get(head_id)
+    if lemmas is None:
+        my_constituent = get_constituent(context, head_id)
+        lemmas = create_sequence_in_lemmas(context, my_constituent)
+        context.ordered_constituents[head_id] = lemmas
 
-    my_constituent = get_constituent(head_id)
-    lemmas = create_sequence_in_lemmas(nafobj, my_constituent)
+    return list(lemmas)
 
-    return lemmas
 
-def get_name_constituent(deps, tid):
+def get_name_constituent(context, head_id):
     '''
     Special function for obtaining names (treating special case of name + apposition modifier
-    :param deps: dependencies of the head
-    :param tid: head identifier
-    :return: list of identifiers
+    :param context: extraction context of input naf
+    :param head_id: term number of head
+    :return: list of term numbers
     '''
 
-    my_constituent = [tid]
-    for dep in deps:
-        if 'mwp' in dep[1]:
-            my_constituent.append(dep[0])
+    my_constituent = [head_id]
+    for dep_id, relation in context.graph.get_dependents(head_id):
+        if relation == context.rules.multiword_relation:
+            my_constituent.append(dep_id)
     return my_constituent
 
-def get_lemma_from_term(nafobj, term_id):
+
+def get_lemma_from_term(context, term_id):
     '''
     Function that extracts a terms lemma
-    :param nafobj: input naf
-    :param term_id: identifier of the term
+    :param context: extraction context of input naf
+    :param term_id: term number
     :return:
     '''
-    term = nafobj.get_term(term_id)
-    lemma = term.get_lemma()
-
-    return lemma
+    return context.terms.lemmas[term_id]
 
 
-def get_pos_from_term(nafobj, term_id):
+def get_pos_from_term(context, term_id):
     '''
     Function that extracts pos of term
-    :param nafobj: input naf
-    :param term_id: identifier of the term
+    :param context: extraction context of input naf
+    :param term_id: term number
     :return:
     '''
-    term = nafobj.get_term(term_id)
-    pos = term.get_pos()
+    return context.terms.pos[term_id]
 
-    return pos
+def has_predicative_complement(context, head_id):
 
-def has_predicative_complement(head_id):
-    if head_id in head2deps:
-        for dep in head2deps.get(head_id):
-            if 'hd/predc' in dep:
-                return True
-    return False
-
-
-def get_basics_and_constituents_from_coordinated(nafobj, head_id):
-
-    global term2lemma
-    additions = []
-    full_constituent = get_constituent_in_ordered_lemmas(nafobj, head_id)
-    additions.append(full_constituent)
-    if head_id in head2deps:
-        for dep in head2deps.get(head_id):
-            headlemma = term2lemma.get(dep[0])
-            additions.append(headlemma)
-            if dep[0] in head2deps:
-                constituent = get_constituent_in_ordered_lemmas(nafobj, dep[0])
-                additions.append(constituent)
-
-    return additions
-
-
-def get_predicative_info(nafobj, head_id):
-
-    global term2lemma
-    descriptions = []
-    basicroles = []
-    for deprel in head2deps.get(head_id):
-        gram_rel = deprel[1]
-        if gram_rel == 'hd/predc':
-            pos = get_pos_from_term(nafobj, deprel[0])
-            if pos == 'vg':
-                basicroles = get_basics_and_constituents_from_coordinated(nafobj, deprel[0])
-                form = basicroles[0]
-            #predicative structure means no agent relation, property instead
-            else:
-                form = term2lemma.get(deprel[0])
-                description = cDescription(deprel[0],form,'property',pos)
-                descriptions.append(description)
-
-                ###NEXT: look at how to create `constituent information'
-            # also add full constituent if longer than one word
-                if deprel[0] in head2deps:
-                    constituent = get_constituent_in_ordered_lemmas(nafobj, deprel[0])
-                    basicroles.append(constituent)
-    return form, descriptions
+    return context.rules.predicative_complement_relation in context.graph.get_dependent_relations(head_id)
 
 
-def analyze_subject_relations_new(nafobj, head_id, term_portrait):
+def analyze_subject_relations_new(context, head_id, term_portrait, relation):
     '''
 
-    :param nafobj:
+    :param context:
     :param head_id:
     :param term_portait:
+    :param relation: relation code of the subject relation
     :return:
     '''
 
-    global term2lemma, head2deps
 
-    pos = get_pos_from_term(nafobj,head_id)
-    if has_predicative_complement(head_id):
-        add_rows_for_predicative_description(head_id,pos,nafobj,term_portrait)
+    pos = get_pos_from_term(context,head_id)
+    if has_predicative_complement(context, head_id):
+        add_rows_for_predicative_description(head_id,pos,context,term_portrait)
     else:
         dtype = 'agent'
-        dependency_rel = 'hd/su'
-        add_rows_for_activity_description(head_id, nafobj, term_portrait, dependency_rel, dtype)
-
-
-       # add_rows_for_description(head_id, nafobj, head2deps, term_portrait, relation)
+        add_rows_for_activity_description(head_id, context, term_portrait, relation, dtype)
 
-    #headlemma = term2lemma.get(head_id)
-    #headpos = get_pos_from_term(nafobj, head_id)
 
+def analyze_pobject(context, head_id):
 
-
-
-def analyze_subject_relations_old(nafobj, head_id, term_portrait):
-
-    #FIXME: make the roles lists right away
-    global head2deps, term2lemma
-
-    #mptid,description.id,description.type,word.form,word.pos,word.id,'constituent'
-
-
-    #default: subject expresses agent
-    basicrole = 'agent'
-    #add lemma of event
-    headlemma = term2lemma.get(head_id)
-    headpos = get_pos_from_term(nafobj, head_id)
-
-    description = cDescription(head_id, headlemma, basicrole, headpos)
-
-    descriptions = [description]
-    basicroles = [basicrole]
-    predicative = False
-
-    if has_predicative_complement(head_id):
-        headlemma, descriptions = get_predicative_info(nafobj, head_id)
-        predicative = True
-
-    if head_id in head2deps:
-        for deprel in head2deps.get(head_id):
-            #ignore entity that is agent
-            gram_rel = deprel[1]
-
-            argpos = get_pos_from_term(nafobj, deprel[0])
-            if gram_rel == 'hd/vc':
-                if argpos == 'vg':
-                    args = get_basics_and_constituents_from_coordinated(nafobj, deprel[0])
-                    for arg in args:
-                        if isinstance(arg, list):
-                            arg = " ".join(arg)
-                        basicroles.append(basicrole + ' ' + arg)
-                else:
-                    headlemma = term2lemma.get(head_id)
-                    arglemma = term2lemma.get(deprel[0])
-                    basicrole = 'agent;'
-                    if not headlemma in ['heb'] and not argpos == 'noun':
-                        basicrole += headlemma + ' '
-                    basicrole += arglemma
-                    basicroles = [basicrole]
-                    if not argpos == 'noun':
-                        analyze_subject_relations(nafobj, deprel[0], term_portrait)
-                    elif deprel[0] in head2deps:
-                        constituent = get_constituent_in_ordered_lemmas(nafobj, deprel[0])
-                        constituent = " ".join(constituent)
-                        completer_role = basicrole + ' ' + constituent.replace(';',',')
-                        basicroles.append(completer_role)
-            elif gram_rel in ['hd/obj1', 'hd/ld', 'dp/dp', 'hd/pc', 'hd/pobj1', 'hd/obj2', 'hd/se','hd/mod','hd/predm','whd/body']:
-                if argpos == 'vg':
-                    args = get_basics_and_constituents_from_coordinated(nafobj, deprel[0])
-                    for arg in args:
-                        if isinstance(arg, list):
-                            arg = " ".join(arg)
-                        if isinstance(basicrole, list):
-                            basicrole = " ".join(basicrole)
-                        basicroles.append(basicrole + ' ' + arg)
-                else:
-                    arglemma = term2lemma.get(deprel[0])
-                    if isinstance(basicrole, list):
-                        basicrole = " ".join(basicrole)
-
-                    completer_role = basicrole + ' ' + arglemma
-                    basicroles.append(completer_role)
-                    if deprel[0] in head2deps:
-                        constituent = get_constituent_in_ordered_lemmas(nafobj, deprel[0])
-                        constituent = " ".join(constituent)
-                        completer_role = basicrole + ' ' + constituent.replace(';',',')
-                        basicroles.append(completer_role)
-            #ignore subject relation (= entity itself)
-            elif not gram_rel in ['nucl/sat','hd/su', 'hd/svp', 'nucl/tag', 'tag/nucl', 'hd/sat','-- / --', 'hd/predc', 'cmp/body','hd/vc','sat/nucl']:
-                _debug(gram_rel, 'not covered in subject rules', deprel[0], head_id)
-
-    if predicative:
-        for brole in descriptions:
-            if isinstance(brole, cDescription):
-                term_portrait.add_property(brole)
-           # if isinstance(brole, str):
-           #     my_property = brole.split(';')
-           # elif isinstance(brole, list):
-           #     my_property = brole
-           # else:
-           #     _debug('BROLE pb', brole)
-           # my_property.append(headpos)
-            #FIXME find out why 'agent' roles end up here
-          #  if len(my_property) == 2:
-                ###HEREHEREHEREsee if we have all info: mptid,description.id,description.type,word.form,word.pos,word.id,'constituent'
-           #     term_portrait.add_property(my_property)
- #   else:
- #       for brole in basicroles:
- #           activity = brole.split(';')
- #           activity.append(headpos)
-
-  #          if not len(activity) == 3:
-  #              _debug('PROPERTY PLACE 2', activity)
-  #          term_portrait.add_activity(activity)
-
-
-def analyze_pobject(nafobj, head_id):
-
-    global term2lemma
-    governing_rels = dep2heads.get(head_id)
+    rules = context.rules
+    governing_rels = context.graph.get_heads(head_id)
 
 
     basic_role = None
     general_head = head_id
-    #sometimes dep has no head, make sure not a None-type
-    if governing_rels is None:
-        governing_rels = []
-        termlemma = term2lemma.get(head_id)
+    #sometimes dep has no head
+    if len(governing_rels) == 0:
+        termlemma = context.forms[head_id]
         #preposition is also head of clause in these cases
-        basic_role = termlemma + '-rol' #+ termlemma
+        basic_role = termlemma + rules.preposition_role_suffix
     #FIXME; we now get one out of two in coordinated structures
-    for deprel in governing_rels:
-        if deprel[1] in ['hd/mod', 'hd/ld','hd/obj1','cmp/body','hd/predc','crd/mod','hd/pc']:
-            prep_lemma = term2lemma.get(head_id)
-            head_pos = get_pos_from_term(nafobj, deprel[0])
-            if head_pos == 'vg':
-               # lemmas = get_basics_and_constituents_from_coordinated(nafobj, deprel[0])
-                basic_role = prep_lemma + '-rol' #+ lemmas[0]
+    for head, relation in governing_rels:
+        role = rules.preposition_head_relations.get(relation)
+        if role == 'preposition':
+            prep_lemma = context.forms[head_id]
+            head_pos = get_pos_from_term(context, head)
+            if head_pos == rules.coordination_pos:
+                basic_role = prep_lemma + rules.preposition_role_suffix
+                if context.coverage is not None:
+                    count_rule(context, 'preposition head', 'coordination', relation)
                 _debug('Coordination in prepositional structure; taking full constituent only')
             else:
-                #head_lemma = term2lemma.get(deprel[0])
-                basic_role = prep_lemma + '-rol' #+ head_lemma
-            general_head = deprel[0]
-        elif deprel[1] == 'hd/obj2':
-            basic_role = 'recipient'
-            general_head = deprel[0]
-        elif not deprel[1] in ['crd/cnj','dp/dp']:
-            _debug(deprel, 'between PP and head')
+                basic_role = prep_lemma + rules.preposition_role_suffix
+                if context.coverage is not None:
+                    count_rule(context, 'preposition head', role, relation)
+            general_head = head
+        elif role is not None:
+            basic_role = role
+            general_head = head
+            if context.coverage is not None:
+                count_rule(context, 'preposition head', role, relation)
+        elif not relation in rules.ignored_preposition_head_relations:
+            if context.coverage is not None:
+                count_rule(context, 'preposition head', 'not covered', relation)
+            _debug(context.terms.ids[head], relation_names[relation], 'between PP and head')
+        else:
+            if context.coverage is not None:
+                count_rule(context, 'preposition head', 'ignored', relation)
     return basic_role, general_head
 
 
-def analyze_obj2_relations(nafobj, head_id, term_portrait):
+def analyze_obj2_relations(context, head_id, term_portrait, relation):
     '''
     Function that creates involvement in activities based on obj2 relations
-    :param nafobj: input naf
-    :param head_id: identifier of verb
+    :param context: extraction context of input naf
+    :param head_id: term number of verb
     :param term_portrait: term project object
+    :param relation: relation code of the obj2 relation
     :return:
     '''
-    headlemma = get_lemma_from_term(nafobj, head_id)
-    if not headlemma in ['ben','heb','doe']:
+    headlemma = get_lemma_from_term(context, head_id)
+    if not headlemma in context.rules.role_verbs:
         dtype = 'recipient'
     else:
         dtype = 'has_role'
 
-    add_rows_for_activity_description(head_id, nafobj, term_portrait,'hd/obj2',dtype)
+    add_rows_for_activity_description(head_id, context, term_portrait,relation,dtype)
 
 
-def analyze_obj2_relations_old(nafobj, head_id, term_portrait):
-    '''
-    Function that creates involvement in activities based on obj2 relations
-    :param nafobj: input naf
-    :param head_id: identifier of verb
-    :param term_portrait: term project object
-    :return:
-    '''
-    global term2lemma
-
-    headlemma = term2lemma.get(head_id)
-    if not headlemma in ['ben','heb','doe']:
-        basicrole = 'recipient;'
-    else:
-        basicrole = 'hasrole;'
-    basicrole += headlemma
-
-    basicroles = [basicrole]
-    headpos = get_pos_from_term(nafobj, head_id)
-
-    for deprel in head2deps.get(head_id):
-        gramrel = deprel[1]
-        if gramrel == 'hd/su' and 'recipient' in basicrole:
-            specific_basis = 'recipient;' + headlemma
-            argpos = term2lemma.get(deprel[0])
-            if argpos == 'vg':
-                args = get_basics_and_constituents_from_coordinated(nafobj, deprel[0])
-                for arg in args:
-                    basicroles.append(specific_basis + ' FROM ' + arg)
-            else:
-                arglemma = term2lemma.get(deprel[0])
-                if isinstance(specific_basis, list):
-                    specific_basis = " ".join(specific_basis)
-                completer_role = specific_basis + ' FROM ' + arglemma
-                basicroles.append(completer_role)
-                if deprel[0] in head2deps:
-                    constituent = get_constituent_in_ordered_lemmas(nafobj, deprel[0])
-                    constituent = " ".join(constituent)
-                    if isinstance(specific_basis, list):
-                        specific_basis = " ".join(specific_basis)
-                    completer_role = specific_basis + ' ' + constituent.replace(';',',')
-                    basicroles.append(completer_role)
-        elif gramrel in ['hd/su', 'hd/obj1','hd/predm','hd/se','hd/mod','hd/svp','hd/vc','hd/predc','hd/ld','dp/dp']:
-            argpos = term2lemma.get(deprel[0])
-            if argpos == 'vg':
-                args = get_basics_and_constituents_from_coordinated(nafobj, deprel[0])
-                for arg in args:
-                    basicroles.append(basicrole + ' ' + arg)
-            else:
-                arglemma = term2lemma.get(deprel[0])
-                completer_role = basicrole + ' ' + arglemma
-                basicroles.append(completer_role)
-                if deprel[0] in head2deps:
-                    constituent = get_constituent_in_ordered_lemmas(nafobj, deprel[0])
-                    constituent = " ".join(constituent)
-                    completer_role = basicrole + ' ' + constituent.replace(';',',')
-                    basicroles.append(completer_role)
-        elif not gramrel in ['hd/obj2','cmp/body','sat/nucl','-- / --']:
-            _debug(gramrel, 'not covered yet for obj2')
-
-    for brole in basicroles:
-        activity = brole.split(';')
-        activity.append(headpos)
-
-        term_portrait.add_activity(activity)
-
-
-def relevant_obj_cooccurence(headpos, gram_rel, basicrole):
-    if headpos in ['verb', 'adj']:
-        if gram_rel in ['hd/su', 'hd/ld', 'dp/dp', 'hd/pc', 'hd/pobj1', 'hd/obj2', 'hd/se', 'hd/mod','hd/predm','hd/vc']:
-            return True
-    elif headpos == 'prep':
-        if gram_rel in ['hd/su', 'hd/ld', 'dp/dp', 'hd/pc', 'hd/se', 'hd/mod','hd/predm','hd/vc', 'hd/obj1']:
-            return True
-        elif gram_rel == 'hd/pobj' and 'recipient' in basicrole:
-            return True
-        elif gram_rel == 'hd/obj2' and not 'recipient' in basicrole:
-            return True
-    return False
-
-def irrelevant_obj_occurrence(headpos, gram_rel, basicrole):
-
-    if headpos in ['verb','adj']:
-        if gram_rel in ['hd/obj1', 'hd/svp', 'nucl/tag', 'tag/nucl', 'hd/sat', '-- / --', 'hd/predc', 'cmp/body', 'sat/nucl','nucl/sat','hd/det']:
-            return True
-    elif headpos in ['prep','comp']:
-        if gram_rel in ['dlink/nucl','hd/svp', 'nucl/tag', 'tag/nucl', 'hd/sat', '-- / --', 'hd/predc', 'cmp/body', 'sat/nucl','nucl/sat','hd/det','hd/app']:
-            return True
-        elif gram_rel == 'hd/pobj' and not 'recipient' in basicrole:
-            return True
-        elif gram_rel == 'hd/obj2' and 'recipient' in basicrole:
-            return True
-    return False
-
-
-def analyze_object_relations_new(nafobj, head_id, term_portrait, deprel):
+def analyze_object_relations_new(context, head_id, term_portrait, relation):
     '''
     Function for activity roles based on object relations
-    :param nafobj:
+    :param context:
     :param head_id:
     :param term_portrait:
+    :param relation: relation code of the object relation
     :return:
     '''
 
-    headpos = get_pos_from_term(nafobj, head_id)
-    if headpos in ['verb','adj']:
-        add_rows_for_activity_description(head_id, nafobj, term_portrait, deprel,'undergoer')
-    elif headpos in ['prep','comp']:
+    headpos = get_pos_from_term(context, head_id)
+    role = context.rules.object_head_pos.get(headpos)
+    if role == 'preposition':
         #TODOPOB
-        dtype, updated_id = analyze_pobject(nafobj, head_id)
+        dtype, updated_id = analyze_pobject(context, head_id)
         if dtype is not None:
-            add_rows_for_activity_description(updated_id, nafobj, term_portrait, deprel, dtype, [head_id])
+            add_rows_for_activity_description(updated_id, context, term_portrait, relation, dtype, [head_id])
+    elif role is not None:
+        add_rows_for_activity_description(head_id, context, term_portrait, relation, role)
 
 
-def analyze_object_relations_old(nafobj, head_id, term_portrait):
-    '''
-    Function that creates involvement in activities based on object relations
-    :param nafobj:
-    :param head_id:
-    :param term_portrait:
-    :return:
-    '''
-
-    global term2lemma
-    headpos = get_pos_from_term(nafobj, head_id)
-    basicroles = []
-
-    if headpos in ['prep','comp']:
-        basicrole, head_id = analyze_pobject(nafobj, head_id)
-        basicroles = [basicrole]
-    elif headpos in ['verb','adj']:
-        basicrole = 'undergoer;'
-        # add lemma of event
-        basicrole += term2lemma.get(head_id)
-        basicroles = [basicrole]
-
-    if headpos in ['verb', 'adj', 'prep', 'comp'] and not basicrole is None:
-
-        for deprel in head2deps.get(head_id):
-            # ignore entity that is agent
-            gram_rel = deprel[1]
-            if gram_rel == 'hd/su':
-                argpos = get_pos_from_term(nafobj, deprel[0])
-                if argpos == 'vg':
-                    args = get_basics_and_constituents_from_coordinated(nafobj, deprel[0])
-                    for arg in args:
-                        if isinstance(arg, list):
-                            arg = " ".join(arg)
-                        basicroles.append(basicrole + ' BY ' + arg)
-                else:
-                    arglemma = term2lemma.get(deprel[0])
-                    completer_role = basicrole + ' BY ' + arglemma
-                    basicroles.append(completer_role)
-                    if deprel[0] in head2deps:
-                        constituent = get_constituent_in_ordered_lemmas(nafobj, deprel[0])
-                        constituent = " ".join(constituent)
-                        completer_role = basicrole + ' BY ' + constituent.replace(';', ',')
-                        basicroles.append(completer_role)
-            elif relevant_obj_cooccurence(headpos, gram_rel, basicrole):
-                argpos = get_pos_from_term(nafobj, deprel[0])
-                if argpos == 'vg':
-                    args = get_basics_and_constituents_from_coordinated(nafobj, deprel[0])
-                    for arg in args:
-                        if isinstance(arg, list):
-                            arg = " ".join(arg)
-                        basicroles.append(basicrole + ' ' + arg)
-                #FIXME: TO VERIFY: ARE THERE CASES WHERE THIS CONDITION GOES WRONG?
-                elif not argpos == headpos:
-                    arglemma = term2lemma.get(deprel[0])
-                    completer_role = basicrole + ' ' + arglemma
-                    basicroles.append(completer_role)
-                    if deprel[0] in head2deps:
-                        constituent = get_constituent_in_ordered_lemmas(nafobj, deprel[0])
-                        constituent = " ".join(constituent)
-                        completer_role = basicrole + ' ' + constituent.replace(';',',')
-                        basicroles.append(completer_role)
-            elif not irrelevant_obj_occurrence(headpos, gram_rel, basicrole):
-                _debug(gram_rel, 'not covered in object1 rules', deprel[0], head_id)
-    elif not headpos == 'prep':
-        _debug(headpos, 'head of obj1')
-
-    for brole in basicroles:
-        if brole is not None:
-            activity = brole.split(';')
-            activity.append(headpos)
-
-            term_portrait.add_activity(activity)
-
-def is_passive(deprels):
+def is_passive(deprels, rules):
 
     rels = []
-    for drel in deprels:
-        rels.append(drel[1])
-    if 'hd/su' in rels and 'hd/obj1' in rels:
+    for head, relation in deprels:
+        rels.append(relation)
+    if rules.subject_relation in rels and rules.object_relation in rels:
         return True
     else:
         return False
 
 
-def add_information_passive(nafobj, head_id):
-    '''
-    Function that adds additional arguments to vc for passives
-    :param nafobj: input naf
-    :param head_id: id of verbal complement
-    :param basicrole: basic relation where role is added
-    :return:
-    '''
-    global term2lemma
-    basicroles = []
-    for deprel in head2deps.get(head_id):
-        # ignore entity that is agent
-        gram_rel = deprel[1]
-        if gram_rel in ['hd/ld', 'dp/dp', 'hd/pc', 'hd/pobj1', 'hd/obj2', 'hd/se', 'hd/mod']:
-            argpos = get_pos_from_term(nafobj, deprel[0])
-            if argpos == 'vg':
-                args = get_basics_and_constituents_from_coordinated(nafobj, deprel[0])
-                for arg in args:
-                    basicroles.append(arg)
-            else:
-                arglemma = term2lemma.get(deprel[0])
-                basicroles.append(arglemma)
-                if deprel[0] in head2deps:
-                    constituent = get_constituent_in_ordered_lemmas(nafobj, deprel[0])
-                    constituent = " ".join(constituent)
-                    basicroles.append(constituent.replace(';',','))
-        elif not gram_rel in ['hd/su', 'hd/obj1', 'hd/svp', 'nucl/tag', 'tag/nucl', 'hd/sat', '-- / --', 'hd/predc','hd/vc']:
-            _debug(gram_rel, 'not covered in rules for vc head passives')
-    return basicroles
-
-
-
-def analyze_passive_structure(nafobj, entityid, term_portrait):
+def analyze_passive_structure(context, entityid, term_portrait):
     '''
     Function to analyze passive structure
-    :param nafobj: input naf
-    :param head_id: identifier of head
+    :param context: extraction context of input naf
+    :param head_id: term number of head
     :param term_portrait: microportrait object
     :return:
     '''
 
-    heads = dep2heads.get(entityid)
+    object_relation = context.rules.object_relation
+    heads = context.graph.get_heads(entityid)
     #FIXME: add rule that makes sure agent is recovered as well
-    for head in heads:
-        if head[1] == 'hd/obj1':
-            add_rows_for_activity_description(head[0],nafobj,term_portrait,'hd/obj1','undergoer')
+    for head, relation in heads:
+        if relation == object_relation:
+            add_rows_for_activity_description(head,context,term_portrait,object_relation,'undergoer')
 
 
-
-def analyze_passive_structure_old(nafobj, entityid, term_portrait):
-    '''
-    Function to analyze passive structure
-    :param nafobj: input naf
-    :param head_id: identifier of head
-    :param term_portrait: microportrait object
-    :return:
+def analyze_coord_relations(context, head_id, term_portrait, relation):
     '''
-    heads = dep2heads.get(entityid)
-    if len(heads) > 0:
-        headpos = get_pos_from_term(nafobj, heads[0][0])
 
-    basicrole = 'undergoer'
-    basicroles = []
-    #obj_additions = []
-    #subj_additions = []
-    #FIXME: add rule that makes sure agent is recovered as well
-    ####TODO TODO: adapt function to new format
-    for head in heads:
-        if head[1] == 'hd/obj1':
-            add_rows_for_activity_description(head[0],nafobj,term_portrait,'hd/obj1',basicrole)
-            event_lemma = term2lemma.get(head[0])
-            basicrole += event_lemma
-            basicroles.append(basicrole)
-            #event_lemma is form,
-
-            #creates finished roles (we have the basic
-            obj_additions = add_information_passive(nafobj, head[0])
-        elif head[1] == 'hd/su':
-            subj_additions = add_information_passive(nafobj, head[0])
-
-    for obj_add in obj_additions:
-        obj_add = " ".join(obj_add)
-        fullrole = basicrole + ' ' + obj_add
-        basicroles.append(fullrole)
-    for su_add in subj_additions:
-        su_add = " ".join(su_add)
-        fullrole = basicrole + ' ' + su_add
-        basicroles.append(fullrole)
-
-    for br in basicroles:
-        activity = br.split(';')
-        activity.append(headpos)
-  #      term_portrait.add_activity(activity)
-
-
-def analyze_coord_relations(nafobj, head_id, term_portrait):
-    '''
-
-    :param nafobj:
+    :param context:
     :param head_id:
     :param term_portrait:
+    :param relation: relation code of the coordination relation
     :return:
     '''
-    heads = dep2heads.get(head_id)
-    if heads is None:
-        heads = []
+    rules = context.rules
+    heads = context.graph.get_heads(head_id)
         # FIXME: in these cases, microportraits are not merged (todo: what is label or property; same term should not be label or property more than once)
-    if len(heads) == 1 or (len(heads) > 0 and not is_passive(heads)):
+    if len(heads) == 1 or (len(heads) > 0 and not is_passive(heads, rules)):
         # FIXME: weird bug...
-        myhead = heads[0]
-        if myhead[1] == 'hd/su':
-            analyze_subject_relations_new(nafobj, myhead[0], term_portrait)
-        elif myhead[1] == 'hd/obj1':
-            analyze_object_relations_new(nafobj, myhead[0], term_portrait, 'hd/obj1')
-        elif myhead[1] == 'hd/obj2':
-            analyze_obj2_relations(nafobj, myhead[0], term_portrait)
-        elif myhead[1] == 'crd/cnj':
-            analyze_coord_relations(nafobj, myhead[0], term_portrait)
-        elif not myhead[1] in ['dp/dp', 'tag/nucl', 'hd/predc', 'hd/predm', 'hd/hd', 'hd/mod', 'cmp/body', 'hd/app',
-                                   'mwp/mwp', '-- / --', 'dp/dp', 'nucl/sat']:
-            _debug(myhead[1], 'in coordinated relation', myhead[0])
-
-
-def analyze_coord_relations_old(nafobj, head_id, term_portrait):
-    '''
-    Function that deals with activities for coordinated structures
-    :param nafobj: input naf
-    :param head_id: identifier of coordinated head
-    :param term_portrait: microportrait object
-    :return:
-    '''
-    heads = dep2heads.get(head_id)
-    if heads is None:
-        heads = []
-        #FIXME: in these cases, microportraits are not merged (todo: what is label or property; same term should not be label or property more than once)
-    if len(heads) == 1 or not is_passive(heads):
-        #FIXME: weird bug...
-        for myhead in heads:
-            myhead = heads[0]
-            if myhead[1] == 'hd/su':
-                analyze_subject_relations(nafobj, myhead[0], term_portrait)
-            elif myhead[1] == 'hd/obj1':
-                analyze_object_relations(nafobj, myhead[0], term_portrait)
-            elif myhead[1] == 'hd/obj2':
-                analyze_obj2_relations(nafobj, myhead[0], term_portrait)
-            elif myhead[1] == 'crd/cnj':
-                analyze_coord_relations(nafobj, myhead[0], term_portrait)
-            elif not myhead[1] in ['dp/dp','tag/nucl','hd/predc','hd/predm','hd/hd', 'hd/mod', 'cmp/body', 'hd/app', 'mwp/mwp', '-- / --', 'dp/dp','nucl/sat']:
-                _debug(myhead[1], 'in coordinated relation', myhead[0])
-    else:
-        analyze_passive_structure(nafobj, head_id, term_portrait)
+        myhead, relation = heads[0]
+        analysis = rules.coordinated_head_relations.get(relation)
+        if analysis is not None:
+            if context.coverage is not None:
+                count_rule(context, 'coordinated head', analysis, relation)
+            head_analyses[analysis](context, myhead, term_portrait, relation)
+        elif not relation in rules.ignored_coordinated_head_relations:
+            if context.coverage is not None:
+                count_rule(context, 'coordinated head', 'not covered', relation)
+            _debug(relation_names[relation], 'in coordinated relation', context.terms.ids[myhead])
+        else:
+            if context.coverage is not None:
+                count_rule(context, 'coordinated head', 'ignored', relation)
+
 
 def duplicate_heads(heads):
     '''
@@ -890,127 +786,130 @@ def extract_ids_from_multiple_heads(heads):
         rels.add(headrel[0])
     return rels
 
-def is_deeper_head_with_relation(head_id, rels, dep2heads):
+def is_deeper_head_with_relation(head_id, rels, graph):
     '''
     Function that finds out which of two shared heads is dependent on the other
     :param heads: list of head and relation
-    :param dep2heads: general object that links dependents to their heads
+    :param graph: dependency graph of document
     :return:
     '''
-    if head_id in dep2heads:
-        for new_head in dep2heads.get(head_id):
-            if new_head[0] in rels:
-                return new_head[1]
+    for new_head, relation in graph.get_heads(head_id):
+        if new_head in rels:
+            return relation
 
 
-def identify_applicable_heads(heads, dep2heads):
+def identify_applicable_heads(heads, graph, rules):
     '''
     Function that identifies which heads should be maintained for extracting roles
     :param heads: list of heads of dependent under analyses
-    :param dep2heads: object that links any term to its heads
+    :param graph: dependency graph of document
+    :param rules: compiled extraction rules
     :return:
     '''
     if duplicate_heads(heads):
         for head_rel in heads:
             rels = extract_ids_from_multiple_heads(heads)
-            deeper_head_rel = is_deeper_head_with_relation(head_rel[0], rels, dep2heads)
-            if deeper_head_rel == 'hd/vc':
+            deeper_head_rel = is_deeper_head_with_relation(head_rel[0], rels, graph)
+            if deeper_head_rel == rules.verbal_complement_relation:
                 return [head_rel]
 
-def is_coordinated_or_control_structure(heads, dep2heads):
+def is_coordinated_or_control_structure(heads, graph, rules):
     '''
     Function that checks whether duplicated heads are part of coordinated structure
     :param heads: the heads of a dependent
-    :param dep2heads: object that links a dependent to its heads
+    :param graph: dependency graph of document
+    :param rules: compiled extraction rules
     :return: boolean
     '''
     coordinated = True
-    coordination_or_control_relations = ['crd/cnj','rhd/body','cmp/body','sat/nucl','whd/body']
+    coordination_or_control_relations = rules.coordination_or_control_relations
     for headrel in heads:
-        if headrel[0] in dep2heads:
-            for head_of_head_rel in dep2heads.get(headrel[0]):
-                #FIXME: simplification
-                if not head_of_head_rel[1] in coordination_or_control_relations:
-                    if head_of_head_rel[0] in dep2heads:
-                        one_up = dep2heads.get(head_of_head_rel[0])
-                        if len(one_up) == 1 and one_up[0][1] in coordination_or_control_relations:
-                            coordinated = True
-                        else:
-                            coordinated = False
-                    else:
-                        coordinated = False
+        for head_of_head, relation in graph.get_heads(headrel[0]):
+            #FIXME: simplification
+            if not relation in coordination_or_control_relations:
+                one_up = graph.get_heads(head_of_head)
+                if len(one_up) == 1 and one_up[0][1] in coordination_or_control_relations:
+                    coordinated = True
+                else:
+                    coordinated = False
     return coordinated
 
-def check_which_heads_to_maintain(heads):
+def check_which_heads_to_maintain(heads, rules):
     '''
     Function that selects heads among alternative based on their function
     :param heads: the head ids and their relation
+    :param rules: compiled extraction rules
     :return:
     '''
     selected_relations = []
     for headrel in heads:
-        if not headrel[1] == 'hd/mod':
+        if not headrel[1] == rules.modifier_relation:
             selected_relations.append(headrel)
     return selected_relations
 
-def investigate_relations(nafobj, tid, term_portrait):
+def investigate_relations(context, tid, term_portrait):
 
     ###UNDER CONSTRUCTION: check what happens if multiple heads.
     ###TODO: CLEAN CODE
     ###TODO: see what we want to do with modals: add something that incorporates tense/modality?
 
-    heads = dep2heads.get(tid)
+    rules = context.rules
+    heads = context.graph.get_heads(tid)
     if len(heads) > 1:
-        heads = check_which_heads_to_maintain(heads)
+        heads = check_which_heads_to_maintain(heads, rules)
         #TODO if not same heads and not passives
         if duplicate_heads(heads):
-            if not is_coordinated_or_control_structure(heads, dep2heads):
-                hierarchy = identify_applicable_heads(heads, dep2heads)
+            if not is_coordinated_or_control_structure(heads, context.graph, rules):
+                hierarchy = identify_applicable_heads(heads, context.graph, rules)
                 if hierarchy is not None:
                     heads = hierarchy
                 else:
                     heads = []
-        elif is_passive(heads):
-            analyze_passive_structure(nafobj, tid, term_portrait)
+        elif is_passive(heads, rules):
+            if context.coverage is not None:
+                count_rule(context, 'head', 'passive', rules.object_relation)
+            analyze_passive_structure(context, tid, term_portrait)
             heads = []
-        #    print(heads)
-    for head_rel in heads:
-        if head_rel[1] == 'hd/su':
-            analyze_subject_relations_new(nafobj, head_rel[0], term_portrait)
-        elif head_rel[1] in ['hd/obj1','hd/se','hd/pobj1','hd/vc','dlink/nucl']:
-            analyze_object_relations_new(nafobj, head_rel[0], term_portrait, head_rel[1])
-                ###TODO: check if needed..
-        elif head_rel[1] in ['crd/cnj','cnj/cnj']:
-            analyze_coord_relations(nafobj, head_rel[0], term_portrait)
-        elif head_rel[1] == 'hd/obj2':
-            analyze_obj2_relations(nafobj, head_rel[0], term_portrait)
-        elif not head_rel[1] in ['hd/sup','rhd/body','hd/predc', 'hd/hd', 'hd/mod', 'hd/me', 'cmp/body', 'hd/app', 'mwp/mwp', '-- / --', 'dp/dp','nucl/sat','tag/nucl','crd/cnj','cnj/cnj']:
-            _debug(head_rel[1], 'relations investigation', head_rel[0])
-  #  else:
-    #    _debug('No heads found in relations extraction (should not occur, in principle only labels with head are targeted')
-        #print('contains passive', tid, get_lemma_from_term(nafobj, tid))
-        #analyze_passive_structure(nafobj, tid, term_portrait)
-
-
-def get_activity_relations(nafobj, term_portrait):
+    for head, relation in heads:
+        analysis = rules.head_relations.get(relation)
+        if analysis is not None:
+            if context.coverage is not None:
+                count_rule(context, 'head', analysis, relation)
+            head_analyses[analysis](context, head, term_portrait, relation)
+        elif not relation in rules.ignored_head_relations:
+            if context.coverage is not None:
+                count_rule(context, 'head', 'not covered', relation)
+            _debug(relation_names[relation], 'relations investigation', context.terms.ids[head])
+        else:
+            if context.coverage is not None:
+                count_rule(context, 'head', 'ignored', relation)
+
+
+#analyses of the activity of a head (see head_relations in rules)
+head_analyses = {'subject': analyze_subject_relations_new,
+                 'object': analyze_object_relations_new,
+                 'coordination': analyze_coord_relations,
+                 'secondary_object': analyze_obj2_relations}
+
+
+def get_activity_relations(context, term_portrait):
     '''
     Function that identifies whether entity is involved in activity according to syntactic structure
-    :param nafobj: input nafobj
+    :param context: extraction context of input naf
     :param term_portrait: the microportrait object
     :return: None
     '''
-    global dep2heads
 
-    tid = term_portrait.get_identifier()
-    investigate_relations(nafobj, tid, term_portrait)
+    tid = context.terms.index[term_portrait.get_identifier()]
+    investigate_relations(context, tid, term_portrait)
 
 
-def add_rows_for_single_description(head_id, pos, nafobj, term_portrait,dtype, mention_id=None):
+def add_rows_for_single_description(head_id, pos, context, term_portrait,dtype, mention_id=None):
     '''
     Function that adds all rows belonging to a single constituent
-    :param head_id: identifier of head
+    :param head_id: term number of head
     :param pos: pos of head
-    :param nafobj: nafobj containing info
+    :param context: extraction context of input naf
     :param term_portrait: portrait we're updating
     :return: None
     '''
@@ -1018,264 +917,359 @@ def add_rows_for_single_description(head_id, pos, nafobj, term_portrait,dtype, m
     if mention_id is None:
         mention_id = head_id
 
-    my_constituent = get_constituent_revised(head_id, nafobj)
-    lemma = get_lemma_from_term(nafobj, head_id)
+    my_constituent = get_constituent_revised(head_id, context)
+    lemma = get_lemma_from_term(context, head_id)
 
-    description = cDescription(head_id, lemma, dtype, pos, mention_id)
+    term_ids = context.terms.ids
+    description = cDescription(term_ids[head_id], lemma, dtype, pos, term_ids[mention_id])
     description.constituent_components = my_constituent
 
     if dtype == 'label':
         term_portrait.add_label(description)
-        term_portrait.add_colabel(head_id)
+        term_portrait.add_colabel(term_ids[head_id])
     else:
         term_portrait.add_property(description)
 
-def add_rows_for_predicative_description(head_id, pos, nafobj, term_portrait):
+def add_rows_for_predicative_description(head_id, pos, context, term_portrait):
     '''
     Function for predicative descriptions
     :param head_id:
     :param pos:
-    :param nafobj:
-    :param head2deps:
+    :param context:
     :return:
     '''
-    global head2deps
 
-    for dependent in head2deps.get(head_id):
-        if dependent[1] == 'hd/predc':
-            deppos = get_pos_from_term(nafobj, dependent[0])
-            if deppos == 'vg':
-                for dep in head2deps.get(dependent[0]):
-                    pos = get_pos_from_term(nafobj, dep[0])
-                    #add_rows_for_predicative_description(dep[0], pos, nafobj, term_portrait)
-                    add_rows_for_single_description(dep[0], pos, nafobj, term_portrait, 'property', head_id)
+    graph = context.graph
+    rules = context.rules
+    for dependent, relation in graph.get_dependents(head_id):
+        if relation == rules.predicative_complement_relation:
+            deppos = get_pos_from_term(context, dependent)
+            if deppos == rules.coordination_pos:
+                for dep in graph.get_dependent_ids(dependent):
+                    pos = get_pos_from_term(context, dep)
+                    add_rows_for_single_description(dep, pos, context, term_portrait, 'property', head_id)
             else:
-                add_rows_for_single_description(dependent[0], pos, nafobj, term_portrait, 'property', head_id)
+                add_rows_for_single_description(dependent, pos, context, term_portrait, 'property', head_id)
 
 
-def create_dependent(main_id, main_rel, nafobj):
+def create_dependent(main_id, main_rel, context):
     '''
     Function that creates dependencies for activity relation
-    :param dep_id:
-    :param dep_rel:
-    :param nafobj:
+    :param main_id: term number of dependent
+    :param main_rel: relation code
+    :param context:
     :return:
     '''
-    global head2deps
 
-    form = get_lemma_from_term(nafobj, main_id)
-    pos = get_pos_from_term(nafobj, main_id)
-    dependency = cDependent(main_id, form, main_rel, pos)
-    if main_id in head2deps:
-        dependency.constituent_components = get_constituent_revised(main_id, nafobj)
-    #print(dependency.constituent_component)
+    form = get_lemma_from_term(context, main_id)
+    pos = get_pos_from_term(context, main_id)
+    dependency = cDependent(context.terms.ids[main_id], form, relation_names[main_rel], pos)
+    if context.graph.has_dependents(main_id):
+        dependency.constituent_components = get_constituent_revised(main_id, context)
     return dependency
 
 
-def add_rows_for_activity_description(head_id, nafobj, term_portrait, dependency_rel, dtype, excluded=[]):
+def add_rows_for_activity_description(head_id, context, term_portrait, dependency_rel, dtype, excluded=[]):
     '''
 
     :param head_id:
-    :param nafobj:
+    :param context:
     :param term_portrait:
-    :param dependency:
+    :param dependency_rel: relation code of the relation between the head and the entity
     :return:
     '''
-    global head2deps
-    ##in one go? see if possible....sub
-    ##add_rows_for_description(head_id, nafobj, head2deps, term_portrait, relation)
 
-    lemma = get_lemma_from_term(nafobj, head_id)
-    pos = get_pos_from_term(nafobj, head_id)
-    description = cDescription(head_id, lemma, dtype, pos)
+    lemma = get_lemma_from_term(context, head_id)
+    pos = get_pos_from_term(context, head_id)
+    description = cDescription(context.terms.ids[head_id], lemma, dtype, pos)
 
-    for dependent in head2deps.get(head_id):
-        if not (dependent[0] in excluded or dependent[1] == dependency_rel):
-            dependent_object = create_dependent(dependent[0], dependent[1], nafobj)
+    for dependent, relation in context.graph.get_dependents(head_id):
+        if not (dependent in excluded or relation == dependency_rel):
+            dependent_object = create_dependent(dependent, relation, context)
             description.add_dependent(dependent_object)
 
     term_portrait.add_activity(description)
 
 
-def add_rows_for_description(head_id, nafobj, head2deps, term_portrait,dtype):
+def add_rows_for_description(head_id, context, term_portrait,dtype):
     '''
     Function
     :param head_id:
-    :param nafobj:
-    :param head2deps:
+    :param context:
     :param term_portrait:
     :return:
     '''
-    pos = get_pos_from_term(nafobj, head_id)
-    if pos == 'vg':
-        if head_id in head2deps:
-            for dep in head2deps.get(head_id):
-                pos = get_pos_from_term(nafobj, dep[0])
-                add_rows_for_single_description(dep[0],pos, nafobj, term_portrait,dtype,head_id)
+    pos = get_pos_from_term(context, head_id)
+    if pos == context.rules.coordination_pos:
+        for dep in context.graph.get_dependent_ids(head_id):
+            pos = get_pos_from_term(context, dep)
+            add_rows_for_single_description(dep,pos, context, term_portrait,dtype,head_id)
     else:
-        add_rows_for_single_description(head_id, pos, nafobj, term_portrait,dtype)
+        add_rows_for_single_description(head_id, pos, context, term_portrait,dtype)
 
 
 
-def extract_sentence_portrait(nafobj, term):
+def extract_sentence_portrait(context, term_number):
     '''
     Extracts portrait information
-    :param nafobj: input file nafobj
-    :param term: the term for which the portrait is being extracted
+    :param context: extraction context of input naf
+    :param term_number: number of the term for which the portrait is being extracted
     :return: microportrait information
     '''
-    global dep2heads, head2deps
+    graph = context.graph
+    rules = context.rules
+    term_ids = context.terms.ids
+    tid = term_ids[term_number]
     #create portrait for term with id as microportrait id
-    tid = term.get_id()
     term_portrait = cMicroportait(tid)
-    term_portrait.set_pos(term.get_pos())
+    term_portrait.set_pos(get_pos_from_term(context, term_number))
     #check if mwp
     name = False
-    mwp = False
     #FIXME: parser output specific: create resources that map functions for resource to activity; also: no SRL information available yet...
     #FIXME: identify names when not primary label as well (create name interpretation function and always check)
     #modification, etc
-    if term_portrait.get_pos() == 'name' and tid in head2deps:
+    if term_portrait.get_pos() == rules.name_pos and graph.has_dependents(term_number):
         name = True
 
-    if tid in head2deps:
-        for dep in head2deps.get(tid):
-            #term = nafobj.get_term(dep[0])
-            if dep[1] in ['hd/det','hd/app'] or (dep[1] == 'mwp/mwp' and not name):
-
-                add_rows_for_description(dep[0],nafobj,head2deps,term_portrait,'label')
-
-            elif dep[1] in ['hd/mod','dp/dp','cnj/cnj','rhd/body','hd/vc','tag/nucl','nucl/tag','-- / --','whd/body','hd/me','sat/nucl','rhd/mod']:
-
-                add_rows_for_description(dep[0],nafobj,head2deps,term_portrait,'property')
+    for dep, relation in graph.get_dependents(term_number):
+        if relation == rules.multiword_relation and not name:
+            dtype = 'label'
+        else:
+            dtype = rules.entity_dependents.get(relation)
+        if dtype is not None:
+            if context.coverage is not None:
+                count_rule(context, 'entity dependent', dtype, relation)
+            add_rows_for_description(dep,context,term_portrait,dtype)
 
-            else:
-                _debug(dep[1], 'new dependency of entity')
+        else:
+            if context.coverage is not None:
+                count_rule(context, 'entity dependent', 'not covered', relation)
+            _debug(relation_names[relation], 'new dependency of entity')
     if not name:
-        description = cDescription(tid,term2lemma.get(tid),'label',term.get_pos())
+        description = cDescription(tid,context.forms[term_number],'label',term_portrait.get_pos())
         term_portrait.add_label(description)
     else:
         #FIXME hack for ordering
-        lemma = {int(tid.split('_')[1]):term2lemma.get(tid)}
-        for dep in head2deps.get(tid):
-            if dep[1] == 'mwp/mwp':
-                depterm = nafobj.get_term(dep[0])
-                if depterm.get_pos() == 'name':
-                    lemma[int(dep[0].split('_')[1])] = depterm.get_lemma()
+        lemma = {int(tid.split('_')[1]):context.forms[term_number]}
+        for dep, relation in graph.get_dependents(term_number):
+            if relation == rules.multiword_relation:
+                if get_pos_from_term(context, dep) == rules.name_pos:
+                    lemma[int(term_ids[dep].split('_')[1])] = get_lemma_from_term(context, dep)
         ultimate_lemma = ''
         for wnr in sorted(lemma):
             ultimate_lemma += lemma[wnr] + ' '
-        description = cDescription(tid,ultimate_lemma.rstrip(),'label',term.get_pos())
+        description = cDescription(tid,ultimate_lemma.rstrip(),'label',term_portrait.get_pos())
         term_portrait.add_label(description)
 
     #activity relations FIXME: split these in different functions, so that srl-based or syntax based can be options
 
     ###TEMP-OFF
 
-    if tid in dep2heads:
-        get_activity_relations(nafobj, term_portrait)
+    if graph.has_heads(term_number):
+        get_activity_relations(context, term_portrait)
     return term_portrait
 
 
-def get_term_info(nafobj):
-
-    global term2lemma
-
+def create_term_table(nafobj):
+    '''
+    Function that goes through the terms of a naf once and stores all term and token information we need
+    :param nafobj: input naf
+    :return: cTermTable
+    '''
+    terms = cTermTable()
     for term in nafobj.get_terms():
-        tid = term.get_id()
-        term2lemma[tid] = term.get_lemma()
+        add_term_info(terms, nafobj, term)
 
+    return terms
 
-def get_token_info(nafobj):
+
+def add_term_info(terms, nafobj, term):
     '''
-    Function that stores token (surface form) for each term id
-    :param nafobj: input nafobj
+    Function that adds a naf term with the information of its tokens to the term table
+    :param terms: cTermTable
+    :param nafobj: naf object the tokens of the term are taken from
+    :param term: naf term
     :return: None
     '''
+    tokens = [nafobj.get_token(wid) for wid in term.get_span().get_span_ids()]
+    offset = None
+    sentence = None
+    if len(tokens) > 0 and tokens[0] is not None:
+        if tokens[0].get_offset() is not None:
+            offset = int(tokens[0].get_offset())
+        if tokens[0].get_sent() is not None:
+            sentence = int(tokens[0].get_sent())
+    surface = None
+    if not None in tokens and not any(token.get_text() is None for token in tokens):
+        surface = ' '.join(token.get_text() for token in tokens).rstrip().lower()
+    terms.add_term(term.get_id(), term.get_lemma(), surface, term.get_pos(), offset, sentence)
 
-    global term2lemma
-    for term in nafobj.get_terms():
-        tid = term.get_id()
-        tspan = term.get_span().get_span_ids()
-        surface = ''
-        for wid in tspan:
-            token = nafobj.get_token(wid)
-            surface += token.get_text() + ' '
-        term2lemma[tid] = surface.rstrip().lower()
+
+def get_term_number(terms, tid):
+    '''
+    Function that returns the number of a term in the term table; terms that are only found in the dependency
+    layer are added without information
+    :param terms: cTermTable
+    :param tid: term id
+    :return: term number
+    '''
+    term_number = terms.index.get(tid)
+    if term_number is None:
+        term_number = len(terms)
+        terms.add_term(tid, None, None, None, None, None)
+    return term_number
 
 
-def fill_headdep_dicts(nafobj):
+def create_dependency_graph(nafobj, terms):
+    '''
+    Function that reads the dependency layer into a dependency graph over term numbers
+    :param nafobj: input naf
+    :param terms: cTermTable of input naf
+    :return: cDependencyGraph
     '''
-    Function that creates dictionaries of dep to heads and head to deps
-    :param nafobj: nafobj from input file
+    #because output Dutch parser does not guarantee that dependents have just one head, terms can have several heads
+    heads = array('i')
+    dependents = array('i')
+    relations = array('i')
+    for dep in nafobj.get_dependencies():
+        heads.append(get_term_number(terms, dep.get_from()))
+        dependents.append(get_term_number(terms, dep.get_to()))
+        relations.append(get_relation_code(dep.get_function()))
+
+    return cDependencyGraph(create_rows(len(terms), heads, dependents, relations),
+                            create_rows(len(terms), dependents, heads, relations))
+
+
+def get_term_info(context):
+
+    context.forms = context.terms.lemmas
+
+
+def get_token_info(context):
+    '''
+    Function that uses the token (surface form) of each term as its form
+    :param context: extraction context of input naf
     :return: None
     '''
-    global dep2heads, head2deps
 
-    for dep in nafobj.get_dependencies():
-        #because output Dutch parser does not guarantee that dependents have just one head, dep2heads also has list as value
-        head = dep.get_from()
-        mydep = dep.get_to()
-        relation = dep.get_function()
-        dep2heads[mydep].append([head, relation])
-        head2deps[head].append([mydep, relation])
+    context.forms = context.terms.surfaces
+
 
-def create_info_dicts(nafobj, surface=False):
+def create_info_dicts(context, surface=False):
     '''
     Funtction that extracts information form naf which we will need a lot
-    :param nafobj: input naf
+    :param context: extraction context of input naf
     :return: None
     '''
-    #FIXME: move to local variables or use basic objects for storing info
-    fill_headdep_dicts(nafobj)
+    if isinstance(context.nafobj, cCompiledLayers):
+        #term table and graph were created when the document was cached (see naf_cache.py)
+        context.terms = context.nafobj.terms
+        context.graph = context.nafobj.graph
+    else:
+        context.terms = create_term_table(context.nafobj)
+        context.graph = create_dependency_graph(context.nafobj, context.terms)
     #if surface, we're extracting tokens rather than lemmas
     if surface:
-        get_token_info(nafobj)
+        get_token_info(context)
     else:
-        get_term_info(nafobj)
+        get_term_info(context)
 
 
-def get_colabels(minimicroportraits):
+def index_colabels(colabel_index, term_portrait):
+    '''
+    Registers the portrait as owner of each of its colabels
+    :param colabel_index: dictionary of term id and the ids of portraits that have it as colabel
+    :param term_portrait: newly created portrait
+    :return: None
+    '''
+    for colabel in term_portrait.get_colabels():
+        colabel_index[colabel].append(term_portrait.get_identifier())
 
-    colabs = []
-    for k, v in minimicroportraits.items():
-        colabs += v.colabels
 
-    return colabs
+def get_remaining_owners(tid, colabel_index):
+    '''
+    Finds the portraits that are kept and (directly or through other redundant portraits) have tid as colabel
+    :param tid: id of redundant portrait
+    :param colabel_index: dictionary of term id and the ids of portraits that have it as colabel
+    :return: list of portrait ids
+    '''
+    owners = []
+    seen = set([tid])
+    to_check = [tid]
+    while len(to_check) > 0:
+        current = to_check.pop()
+        for owner in colabel_index.get(current, []):
+            if not owner in seen:
+                seen.add(owner)
+                if owner in colabel_index:
+                    to_check.append(owner)
+                else:
+                    owners.append(owner)
+    return owners
 
 
-def remove_duplicate_portraits(minimicroportraits):
+def add_new_information(main_portrait, redundant_portrait):
+    '''
+    Adds descriptions of a redundant portrait whose head is not described in the main portrait yet
+    :param main_portrait: portrait that is kept
+    :param redundant_portrait: portrait that is removed
+    :return: None
+    '''
+    described = set()
+    for description in main_portrait.labels + main_portrait.properties + main_portrait.activities:
+        described.add(description.id)
+    for description in redundant_portrait.labels:
+        if not description.id in described:
+            main_portrait.add_label(description)
+            main_portrait.add_colabel(description.id)
+            described.add(description.id)
+    for description in redundant_portrait.properties:
+        if not description.id in described:
+            main_portrait.add_property(description)
+            described.add(description.id)
+    for description in redundant_portrait.activities:
+        if not description.id in described:
+            main_portrait.add_activity(description)
+            described.add(description.id)
+
+
+def remove_duplicate_portraits(minimicroportraits, colabel_index, merge_redundant=False):
     '''
     Removes redudant labels
     :param minimicroportraits: descriptions
+    :param colabel_index: dictionary of term id and the ids of portraits that have it as colabel (see index_colabels)
+    :param merge_redundant: if True, information of removed portraits that is new is added to the portraits they are part of
     :return: updated descriptions (duplicates removed)
     '''
-    #FIXME: steps:
-    #1. instead of simply removing, go through colabels, a) add information not there yet b) add to redundant (not counting twice)
-    redundant_labels = get_colabels(minimicroportraits)
     updated_portraits = {}
     for k, v in minimicroportraits.items():
-        if not k in redundant_labels:
+        if not k in colabel_index:
             updated_portraits[k] = v
-        #FIXME: if redundant label introduces new information, this should be added
+    if merge_redundant:
+        for k, v in minimicroportraits.items():
+            if k in colabel_index:
+                for owner in get_remaining_owners(k, colabel_index):
+                    add_new_information(updated_portraits.get(owner), v)
     return updated_portraits
 
 
-def extract_sentence_level_portraits(nafobj):
+def extract_sentence_level_portraits(context, merge_redundant=False):
     '''
     Goes through nafobject and extracts microportaits on sentence leven
-    :param nafobj: nafobj of input file
+    :param context: extraction context of input naf
+    :param merge_redundant: if True, new information of redundant portraits is added rather than dropped
     :return: dictionary of term_ids and their microportait on sentence level
     '''
 
-    global dep_extractor
     minimicroportaits = {}
-    dep_extractor = nafobj.get_dependency_extractor()
-    for term in nafobj.get_terms():
-        if term.get_pos() in target_pos:
-            term_portrait = extract_sentence_portrait(nafobj, term)
-            minimicroportaits[term.get_id()] = term_portrait
-    sentence_level_portraits = remove_duplicate_portraits(minimicroportaits)
+    colabel_index = defaultdict(list)
+    target_pos = context.rules.target_pos
+    for term_number, pos in enumerate(context.terms.pos):
+        if pos in target_pos:
+            term_portrait = extract_sentence_portrait(context, term_number)
+            minimicroportaits[term_portrait.get_identifier()] = term_portrait
+            index_colabels(colabel_index, term_portrait)
+    sentence_level_portraits = remove_duplicate_portraits(minimicroportaits, colabel_index, merge_redundant)
 
     return sentence_level_portraits
 
@@ -1314,176 +1308,396 @@ def derive_rows_from_description(description, mptid):
     return rows
 
 
-def create_output(slportraits, prefix, outputfile):
+def derive_rows_from_portrait(portrait, mptid):
+    '''
+    Generator that yields the rows of a portrait: labels, properties and activities (role,event)
+    :param portrait: cMicroportait
+    :param mptid: identifier of portrait in output
+    :return: rows
+    '''
+    for descriptions in [portrait.labels, portrait.properties, portrait.activities]:
+        for description in descriptions:
+            #cDescription
+            for row in derive_rows_from_description(description, mptid):
+                yield row
+
 
-    portraits = []
+def derive_output_rows(slportraits, prefix):
+    '''
+    Generator that yields the output rows of all portraits, one portrait at a time (punctuation and malformed
+    rows are left out)
+    :param slportraits: dictionary of term ids and their microportraits
+    :param prefix: prefix of portrait identifiers (input file name)
+    :return: rows
+    '''
     for k, v in slportraits.items():
         mptid = prefix + k
-        for label in v.labels:
-            #cDescription
+        for row in derive_rows_from_portrait(v, mptid):
+            if len(row) == 8:
+                if not row[4] == 'punct':
+                    yield row
+            else:
+                _debug(row)
+
+
+def create_output(slportraits, prefix, outputfile, output_format='csv', stats=None):
+    '''
+    Function that writes the rows of all portraits
+    :param slportraits: dictionary of term ids and their microportraits
+    :param prefix: prefix of portrait identifiers (input file name)
+    :param outputfile: file object (binary for parquet and arrow, text otherwise)
+    :param output_format: 'csv', 'jsonl', 'parquet' or 'arrow' (see writers.py)
+    :param stats: cDocumentStats in which the number of rows is recorded (None: not recorded)
+    :return: None
+    '''
+    rows = derive_output_rows(slportraits, prefix)
+    if stats is not None:
+        rows = stats.count_rows(rows)
+    output_writers[output_format](rows, outputfile)
+
+class cCoreferenceIndex():
+    '''
+    Class that indexes entity coreference chains: each mention (term id of a head target) points to the
+    chains it occurs in and each chain to its mentions. Only chains that link at least two different terms are kept.
+    '''
+
+    def __init__(self):
+
+        self.mention2chains = defaultdict(list)
+        self.chain2members = []
+
+    def add_chain(self, mentions):
+        '''
+        Adds chain if it links different terms
+        :param mentions: list of term ids in chain
+        '''
+        members = []
+        seen = set()
+        for tid in mentions:
+            if not tid in seen:
+                seen.add(tid)
+                members.append(tid)
+        if len(members) > 1:
+            chain_id = len(self.chain2members)
+            self.chain2members.append(members)
+            for tid in members:
+                self.mention2chains[tid].append(chain_id)
+
+    def __contains__(self, tid):
+
+        return tid in self.mention2chains
+
+    def get_chains(self, tid):
+
+        return self.mention2chains.get(tid, [])
+
+    def get_members(self, chain_id):
+
+        return self.chain2members[chain_id]
+
+
+def get_entity_chains(nafobj):
+    '''
+    Function that gets the term ids of the heads of the mentions of each entity coreference chain
+    :param nafobj: input naf
+    :return: list of lists of term ids
+    '''
+    if isinstance(nafobj, cCompiledLayers):
+        return nafobj.entity_chains
+    chains = []
+    for coref in nafobj.get_corefs():
+        if coref.get_type() == 'entity':
+            chains.append(get_mention_heads(coref))
+    return chains
+
+
+def get_mention_heads(coref):
+    '''
+    Function that returns the term ids marked as head in the spans of a coreference chain
+    :param coref: naf coreference
+    :return: list of term ids
+    '''
+    corefering_ids = []
+    for coref_span in coref.get_spans():
+        for target in coref_span:
+            if target.is_head():
+                corefering_ids.append(target.get_id())
+    return corefering_ids
 
-            label_rows = derive_rows_from_description(label, mptid)
-            portraits += label_rows
-           # mylabel = [mptid, 'label']
-           # mylabel += label
-        for property in v.properties:
-
-            property_rows = derive_rows_from_description(property, mptid)
-           # my_property = [mptid, 'property']
-           # my_property += property
-            portraits += property_rows
-        #activity consists of role,event
-        for activity in v.activities:
-           activity_rows = derive_rows_from_description(activity, mptid)
-           portraits += activity_rows
-           # my_activity = [mptid] + activity
-           # portraits.append(my_activity)
-
-    myout = csv.writer(outputfile, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-    myout.writerow(['mp_identifier','mention_id','relation','description','pos','term_id','dep_rel','constituent_head'])
-    for portrait in portraits:
-        if len(portrait) == 8:
-            if not portrait[4] == 'punct':
-                myout.writerow(portrait)
-        else:
-            _debug(portrait)
 
 def get_coreferences_from_naf(nafobj):
     '''
     Function that get all coreference relations from naf object
     :param nafobj: input naf
-    :return: dictionary from term ids to list of terms they corefer with
+    :return: cCoreferenceIndex of entity chains
     '''
 
     #FIXME: we want to match head only...we now take anything in the span....
-    coref_dict = defaultdict(list)
-    for coref in nafobj.get_corefs():
-        if coref.get_type() == 'entity':
-            corefering_ids = []
-            for coref_span in coref.get_spans():
-                for target in coref_span:
-                    if target.is_head():
-                        corefering_ids.append(target.get_id())
-            for tid in corefering_ids:
-                for coreftid in corefering_ids:
-                    if not coreftid == tid:
-                        coref_dict[tid].append(coreftid)
-    return coref_dict
+    coref_index = cCoreferenceIndex()
+    for corefering_ids in get_entity_chains(nafobj):
+        coref_index.add_chain(corefering_ids)
+    return coref_index
 
 
-def retrieve_merge_candidates(my_coref_dict, sentence_level_portraits):
+def retrieve_merge_candidates(coref_index, sentence_level_portraits):
     '''
     Function that identifies which sentence level portraits may merge across sentences
-    :param my_coref_dict: dictionary mapping each term id to all other term ids it corefers with
+    :param coref_index: cCoreferenceIndex of entity chains
     :param sentence_level_portraits: dictionary of term id and its sentence level portraits
     :return: list of term identifier keys fro mergreable portraits
     '''
 
     merge_candidates = []
     for tid, portrait in sentence_level_portraits.items():
-        if tid in my_coref_dict:
+        if tid in coref_index:
             merge_candidates.append(tid)
         else:
             for colabel in portrait.get_colabels():
-                if colabel in my_coref_dict:
+                if colabel in coref_index:
                     merge_candidates.append(tid)
+                    break
     return merge_candidates
 
-def already_merging(tid1, tid2, to_merge):
 
-    if tid1 in to_merge and tid2 in to_merge.get(tid1):
-        return True
-    elif tid2 in to_merge and tid1 in to_merge.get(tid2):
-        return True
-    else:
-        for v in to_merge.values():
-            if tid1 in v and tid2 in v:
-                return True
+class cDisjointSet():
+    '''
+    Union-find structure (with path compression and union by size) used to group portraits that should be merged.
+    The order in which elements were added is kept in order, so that groups can be sorted in document order.
+    '''
+
+    def __init__(self):
 
-    return False
+        self.parent = {}
+        self.size = {}
+        self.order = {}
 
+    def add(self, element):
 
-def update_merged_dict(merged, previousk, newk):
+        if not element in self.parent:
+            self.parent[element] = element
+            self.size[element] = 1
+            self.order[element] = len(self.order)
+
+    def find(self, element):
+        '''
+        Returns representative of the group of element, pointing all elements on the way directly to it
+        '''
+        root = element
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[element] != root:
+            next_element = self.parent[element]
+            self.parent[element] = root
+            element = next_element
+        return root
+
+    def union(self, element1, element2):
+        '''
+        Joins the groups of two elements; the representative of the larger group becomes that of the joined group
+        '''
+        root1 = self.find(element1)
+        root2 = self.find(element2)
+        if root1 != root2:
+            if self.size[root1] < self.size[root2]:
+                root1, root2 = root2, root1
+            self.parent[root2] = root1
+            self.size[root1] += self.size.pop(root2)
 
-    for k, v in merged.items():
-        if v == previousk:
-            merged[k] = newk
 
+def get_merge_ids(tid, portrait):
 
-def merge_coreference_portraits(nafobj, sentence_level_portraits):
+    return [tid] + portrait.get_colabels()
+
+
+def merge_portrait_into(main_portrait, merge_portrait):
+
+    main_portrait.labels += merge_portrait.labels
+    main_portrait.properties += merge_portrait.properties
+    main_portrait.activities += merge_portrait.activities
+    main_portrait.colabels += merge_portrait.colabels
+
+
+def merge_portrait_group(portraits, group):
+    '''
+    Merges a group of coreferring candidates into the first candidate of the group
+    :param portraits: dictionary of term id and portraits (updated in place: merged portraits are removed)
+    :param group: candidates of the group in document order
+    :return: None
+    '''
+    main_portrait = portraits[group[0]]
+    for candidate in group[1:]:
+        merge_portrait_into(main_portrait, portraits.pop(candidate))
+
+
+def get_candidate_chains(coref_index, candidate, portrait):
+
+    chains = set()
+    for tid in get_merge_ids(candidate, portrait):
+        chains.update(coref_index.get_chains(tid))
+    return chains
+
+
+def merge_coreference_portraits(context, sentence_level_portraits):
+    '''
+    Merges sentence level portraits whose term or colabels corefer. Candidates that share a chain (directly or
+    through other candidates) are grouped with a disjoint set and each group is merged into its first candidate.
+    :param context: extraction context of input naf
+    :param sentence_level_portraits: dictionary of term id and its sentence level portraits (updated in place)
+    :return: None
+    '''
 
     #1. get coreferences from naf (dict each term identifier to all its coreferences
     #FIXME: create evaluation data for this function and make sure it works properly.
 
-    my_coref_dict = get_coreferences_from_naf(nafobj)
-    to_merge = defaultdict(list)
-    merge_candidates = retrieve_merge_candidates(my_coref_dict, sentence_level_portraits)
-
-    for possible_merge in merge_candidates:
-        merge_ids = [possible_merge] + sentence_level_portraits.get(possible_merge).get_colabels()
-        merging_with = []
-        for tid in merge_ids:
-            if tid in my_coref_dict:
-                merging_with += [tid] + my_coref_dict.get(tid)
-        for candidate in merge_candidates:
-            if not candidate == possible_merge:
-                merge_ids = [candidate] + sentence_level_portraits.get(candidate).get_colabels()
-                if len(set(merge_ids) & set(merging_with)) > 0:
-                    if not already_merging(candidate, possible_merge, to_merge):
-                        if candidate in to_merge:
-                            to_merge[candidate].append(possible_merge)
-                        else:
-                            to_merge[possible_merge].append(candidate)
-
-    merged = {}
-    for k, v in to_merge.items():
-        main_portrait = sentence_level_portraits.get(k)
-        if main_portrait is None:
-            replacement_id = merged.get(k)
-            main_portrait = sentence_level_portraits.get(replacement_id)
-            k = replacement_id
-        for merger in v:
-            merge_portrait = sentence_level_portraits.get(merger)
-            if merge_portrait is None:
-                previously_merged = merged.get(merger)
-                if previously_merged == k:
-                    continue
-                merge_portrait = sentence_level_portraits.get(previously_merged)
-                merged[previously_merged] = k
-                update_merged_dict(merged, previously_merged, k)
-                if previously_merged in sentence_level_portraits:
-                    del sentence_level_portraits[previously_merged]
-            else:
-                del sentence_level_portraits[merger]
-            #FIXME: make sure nothing is going wrong here; if portraits should be merged, they should be merged
-            if not merge_portrait is None and not main_portrait is None:
-                main_portrait.labels += merge_portrait.labels
-                main_portrait.properties += merge_portrait.properties
-                main_portrait.activities += merge_portrait.activities
-                main_portrait.colabels += merge_portrait.colabels
-                merged[merger] = k
-            elif main_portrait is None and not merge_portrait is None:
-                main_portrait = merge_portrait
+    coref_index = get_coreferences_from_naf(context.nafobj)
+    context.coreferences = coref_index
+    merge_candidates = retrieve_merge_candidates(coref_index, sentence_level_portraits)
+
+    #2. index which candidates cover a mention of each chain
+    portrait_groups = cDisjointSet()
+    chain2candidates = defaultdict(list)
+    for candidate in merge_candidates:
+        portrait_groups.add(candidate)
+        for chain_id in get_candidate_chains(coref_index, candidate, sentence_level_portraits.get(candidate)):
+            chain2candidates[chain_id].append(candidate)
+
+    #3. join all candidates covering the same chain
+    for chain_candidates in chain2candidates.values():
+        for candidate in chain_candidates[1:]:
+            portrait_groups.union(chain_candidates[0], candidate)
 
+    #4. merge each group (candidates are collected in document order)
+    groups = defaultdict(list)
+    for candidate in merge_candidates:
+        groups[portrait_groups.find(candidate)].append(candidate)
+    for group in groups.values():
+        if len(group) > 1:
+            merge_portrait_group(sentence_level_portraits, group)
 
 
-def extract_microportraits(inputfile, outputfile, surface, nocoref):
+def create_extraction_context(nafobj, surface=False, language='nl'):
+    '''
+    Function that creates a fresh extraction context for a naf object
+    :param nafobj: input naf
+    :param surface: if True, descriptions use surface forms rather than lemmas
+    :param language: language whose extraction rules are used
+    :return: cExtractionContext
+    '''
+    context = cExtractionContext(nafobj, get_rules(language))
+    #language independent: creates term table, dependency graph and forms
+    create_info_dicts(context, surface)
+
+    return context
+
+
+def record_document_counts(stats, context, sentence_level_portraits):
+    '''
+    Function that records the size of a document and the number of portraits found in it
+    :param stats: cDocumentStats
+    :param context: extraction context of input naf
+    :param sentence_level_portraits: dictionary of term ids and their (merged) microportraits
+    :return: None
+    '''
+    stats.set_count('terms', len(context.terms))
+    stats.set_count('dependencies', len(context.graph.dep_ids))
+    if context.coreferences is not None:
+        stats.set_count('coreference_chains', len(context.coreferences.chain2members))
+        stats.set_count('coreferring_mentions', len(context.coreferences.mention2chains))
+    stats.set_count('portraits', len(sentence_level_portraits))
+    if context.coverage is not None:
+        stats.add_coverage(context.coverage)
+
+
+def extract_portraits_from_naf(nafobj, surface=False, nocoref=False, merge_redundant=False, language='nl', stats=None,
+                               shards=None):
+    '''
+    Function that extracts the (merged) microportraits of a single naf object.
+    All document information is kept in a local context, so this can be called for many documents in one process.
+    :param nafobj: input naf
+    :param surface: if True, descriptions use surface forms rather than lemmas
+    :param nocoref: if True, portraits are not merged based on coreference
+    :param merge_redundant: if True, new information of redundant portraits is added to the portraits they are part of
+    :param language: language whose extraction rules are used
+    :param stats: cDocumentStats in which time per stage and counts are recorded (None: nothing is recorded)
+    :param shards: if set, sentence level portraits are extracted by this number of worker processes (see sharded.py)
+    :return: dictionary of term ids and their microportraits
+    '''
+    context = run_stage(stats, 'create_info_dicts', create_extraction_context, nafobj, surface, language)
+    if stats is not None and stats.coverage is not None:
+        context.coverage = defaultdict(int)
+    if shards is not None:
+        from .sharded import extract_sharded_portraits
+        sentence_level_portraits = run_stage(stats, 'extract_sentence_level_portraits', extract_sharded_portraits,
+                                             context, merge_redundant, shards)
+    else:
+        sentence_level_portraits = run_stage(stats, 'extract_sentence_level_portraits', extract_sentence_level_portraits,
+                                             context, merge_redundant)
+    if stats is not None:
+        stats.set_count('sentence_level_portraits', len(sentence_level_portraits))
+    if not nocoref:
+        run_stage(stats, 'merge_coreference_portraits', merge_coreference_portraits, context, sentence_level_portraits)
+    if stats is not None:
+        record_document_counts(stats, context, sentence_level_portraits)
+
+    return sentence_level_portraits
+
+
+def load_naf(inputfile, reader='kafnaf', cache_dir=None, digest=None):
+    '''
+    Function that reads a naf file with the selected reader
+    :param inputfile: the input naf file
+    :param reader: 'kafnaf' (full KafNafParser object) or 'stream' (only the layers needed, read with iterparse)
+    :param cache_dir: directory with compiled layers of naf files (see naf_cache.py; None: no cache)
+    :param digest: sha256 of the content of the file, if known (used as key of the cache)
+    :return: naf object (cCompiledLayers if a cache is used)
+    '''
+    if cache_dir is not None:
+        from .naf_cache import load_cached_naf
+        return load_cached_naf(inputfile, reader, cache_dir, digest)
+    #compressed files are decompressed while they are parsed
+    with open_naf(inputfile) as naf:
+        if reader == 'stream':
+            return read_naf_layers(naf)
+        return KafNafParser(naf)
+
+
+def get_identifier_prefix(inputfile):
+    '''
+    Function that returns the prefix of the portrait identifiers of an input file (its name without .naf and
+    without the extension of a compression)
+    :param inputfile: name of input file
+    :return: prefix
+    '''
+    return strip_compression_extension(inputfile).rstrip('.naf')
+
+
+def extract_microportraits(inputfile, outputfile, surface, nocoref, reader='kafnaf', merge_redundant=False, language='nl',
+                           output_format='csv', stats=None, cache_dir=None, window=None, shards=None):
     '''
     Function that calls functions extracting components of microportraits and merges them
     :param inputfile: the input naf file
     :param outputfile: the output file in csv
+    :param reader: naf reader to use (see load_naf)
+    :param merge_redundant: if True, new information of redundant portraits is kept (see remove_duplicate_portraits)
+    :param language: language whose extraction rules are used
+    :param output_format: format of output (see create_output)
+    :param stats: cDocumentStats in which time per stage and counts are recorded (None: nothing is recorded)
+    :param cache_dir: directory with compiled layers of naf files (None: no cache)
+    :param window: if set, the document is extracted this number of sentences at a time (see windowed.py)
+    :param shards: if set, the sentences of the document are divided over this number of worker processes
     :return: None
     '''
-    global target_pos
 
-    nafobj = KafNafParser(inputfile)
-    #language independent: creates dep2heads, head2deps, term2lemmas (todo: create better storage functions)
-    create_info_dicts(nafobj, surface)
-    sentence_level_portraits = extract_sentence_level_portraits(nafobj)
-    if not nocoref:
-        merge_coreference_portraits(nafobj, sentence_level_portraits)
-    prefix = inputfile.rstrip('.naf')
-    create_output(sentence_level_portraits, prefix, outputfile)
+    if window is not None:
+        from .windowed import extract_windowed
+        extract_windowed(inputfile, outputfile, window, surface, nocoref, merge_redundant, language, output_format,
+                         stats, cache_dir)
+        return
+    nafobj = run_stage(stats, 'read', load_naf, inputfile, reader, cache_dir)
+    sentence_level_portraits = extract_portraits_from_naf(nafobj, surface, nocoref, merge_redundant, language, stats,
+                                                          shards)
+    prefix = get_identifier_prefix(inputfile)
+    run_stage(stats, 'create_output', create_output, sentence_level_portraits, prefix, outputfile, output_format, stats)
 
 
 
@@ -1495,20 +1709,117 @@ def main():
     parser.add_argument('-s', '--surface', action='store_true', default=False)
     parser.add_argument('-v', '--verbose', action='store_true', default=False)
     parser.add_argument('-c', '--nocoref', action='store_true', default=False)
-    #TODO multiple languages will be supported. Default is Dutch
-    parser.add_argument('-l','--language', default='nl')
+    parser.add_argument('-m', '--mergeredundant', action='store_true', default=False, help="Add new information of portraits that are part of another portrait instead of dropping it")
+    #languages are those with a rule table in rules.py. Default is Dutch
+    parser.add_argument('-l','--language', choices=sorted(rule_tables), default='nl')
     #TODO roles in activities can be derived from dependencies or from srl output, default is dependencies
     parser.add_argument('-r', '--rolebases', default='dep')
-
-    parser.add_argument("inputfile", help="Input filename (NAF)")
+    #stream only reads the text, terms, deps and coreference layers (faster, less memory on large files)
+    parser.add_argument('--reader', choices=['kafnaf', 'stream'], default='kafnaf')
+    parser.add_argument('--cache', help="Directory where the parsed layers of each NAF file are cached (keyed by content hash), so later runs skip XML parsing")
+    parser.add_argument('--format', choices=sorted(output_writers), default='csv', help="Output format (parquet and arrow require pyarrow)")
+    parser.add_argument('--compress', choices=sorted(compression_extensions), default=None, help="Compress the output (zstd requires zstandard); compressed input is recognised by extension or content")
+    parser.add_argument('--shards', type=int, default=None, help="Divide the sentences of a single large document over this number of worker processes")
+    parser.add_argument('--window', type=int, default=None, help="Extract very large documents this number of sentences at a time, keeping memory proportional to the window (rows of merged portraits come when their coreference chains end)")
+
+    parser.add_argument("inputfile", nargs='?', help="Input filename (NAF); - reads a stream of NAF documents from stdin")
+    parser.add_argument('--separator', choices=['xml', 'nul', 'length'], default='xml', help="How documents on stdin are separated: concatenated (xml), followed by a NUL byte (nul) or preceded by a line with their length in bytes (length)")
+    #batch mode: one csv per input file is written to the output directory
+    parser.add_argument('-i', '--input-dir', help="Directory with input NAF files (batch mode)")
+    parser.add_argument('-a', '--archive', help="Tar (also compressed) or zip archive with input NAF files (batch mode; --output-dir can be a directory or a .tar, .tar.gz, .tgz, .tar.xz, .tar.bz2 or .zip archive)")
+    parser.add_argument('-f', '--file-list', help="File with one input NAF path per line (batch mode)")
+    parser.add_argument('-o', '--output-dir', help="Directory where output csv files are written (batch mode)")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Number of worker processes in batch mode (default: number of cores)")
+    parser.add_argument('--chunksize', type=int, default=None, help="Number of files sent to a worker at once in batch mode")
+    parser.add_argument('--readers', type=int, default=None, help="Read input files with this number of threads ahead of extraction and write output in a separate thread (batch mode)")
+    parser.add_argument('--incremental', action='store_true', default=False, help="Skip files whose content, extractor version and options are unchanged since the last batch run into the output directory (see manifest.py)")
+    #statistics: time per stage, counts and throughput, per document and aggregated over the run
+    parser.add_argument('--profile', action='store_true', default=False, help="Print time per stage, counts and throughput to stderr")
+    parser.add_argument('--stats-json', help="Write time per stage, counts and throughput (also per document) to this json file")
+    parser.add_argument('--coverage', action='store_true', default=False, help="Print how often each extraction rule fired (and relations no rule covers) to stderr")
 
     args = parser.parse_args()
+    batch = args.input_dir is not None or args.file_list is not None or args.archive is not None
+    if batch and args.output_dir is None:
+        parser.error('batch mode (--input-dir/--file-list/--archive) requires --output-dir')
+    if not batch and args.inputfile is None:
+        parser.error('an input file or --input-dir/--file-list/--archive is required')
+    if args.archive is not None and (args.input_dir is not None or args.file_list is not None):
+        parser.error('--archive cannot be combined with --input-dir/--file-list')
+    if args.archive is not None and (args.incremental or args.window is not None or args.readers is not None):
+        parser.error('--archive cannot be combined with --incremental, --window or --readers')
+    if args.window is not None and args.window < 1:
+        parser.error('--window must be at least 1')
+    if args.readers is not None and (not batch or args.window is not None or args.readers < 1):
+        parser.error('--readers applies to batch mode without --window and must be at least 1')
+    if args.shards is not None and (batch or args.inputfile == '-' or args.window is not None):
+        parser.error('--shards applies to a single input file without --window (batch mode uses --workers)')
+    if args.shards is not None and args.shards < 1:
+        parser.error('--shards must be at least 1')
+    if args.window is not None and args.inputfile == '-':
+        parser.error('--window is not supported for documents read from stdin')
+    if args.format in binary_formats:
+        try:
+            check_pyarrow(args.format)
+        except ImportError as e:
+            parser.error(str(e))
+    if args.compress == 'zstd':
+        try:
+            check_zstd()
+        except ImportError as e:
+            parser.error(str(e))
     if args.verbose:
         logging.basicConfig(filename='debug.log',level=logging.DEBUG, format='[%(asctime)s %(name)-12s %(levelname)-5s] %(message)s')
    # else:
    #     logging.basicConfig(level=logging.INFO,format='[%(asctime)s %(name)-12s %(levelname)-5s] %(message)s')
 
-    extract_microportraits(args.inputfile, sys.stdout, args.surface, args.nocoref)
+    stats = None
+    if args.profile or args.stats_json is not None or args.coverage:
+        stats = cBatchStats(args.coverage)
+
+    failed = []
+    if args.archive is not None:
+        from .archive import run_archive
+        failed = run_archive(args.archive, args.output_dir, args.surface, args.nocoref, args.workers, args.reader, args.mergeredundant, args.language, args.format, stats, args.cache, args.compress)
+    elif batch:
+        from .batch import collect_input_files, run_batch
+        try:
+            inputfiles = collect_input_files(args.input_dir, args.file_list)
+        except ValueError as e:
+            parser.error(str(e))
+        failed = run_batch(inputfiles, args.output_dir, args.surface, args.nocoref, args.workers, args.chunksize, args.reader, args.mergeredundant, args.language, args.format, stats, args.incremental, args.cache, args.window, args.readers, args.compress)
+    else:
+        outputfile = sys.stdout
+        if args.format in binary_formats:
+            outputfile = sys.stdout.buffer
+        if args.compress is not None:
+            outputfile = open_output(sys.stdout.buffer, args.format, args.compress)
+        if args.inputfile == '-':
+            from .naf_stream import extract_stream
+            #a compressed stream is decompressed as it is read
+            with open_naf(sys.stdin.buffer) as inputstream:
+                failed = extract_stream(inputstream, outputfile, args.surface, args.nocoref, args.reader, args.mergeredundant, args.language, args.format, args.separator, stats)
+        else:
+            document_stats = None
+            if stats is not None:
+                document_stats = cDocumentStats(args.inputfile, args.coverage)
+            extract_microportraits(args.inputfile, outputfile, args.surface, args.nocoref, args.reader, args.mergeredundant, args.language, args.format, document_stats, args.cache, args.window, args.shards)
+            if stats is not None:
+                stats.add_document(document_stats.to_dict())
+        if args.compress is not None:
+            #writes the end of the compressed stream (stdout itself stays open)
+            outputfile.close()
+
+    if stats is not None:
+        stats.finish()
+    if args.stats_json is not None:
+        stats.write_json(args.stats_json)
+    if args.profile:
+        stats.print_summary()
+    if args.coverage:
+        stats.print_coverage()
+    if len(failed) > 0:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import struct
+import tempfile
+from array import array
+
+from .microportraits import cTermTable, cDependencyGraph, create_term_table, create_dependency_graph, get_entity_chains, load_naf
+from .naf_reader import cCompiledLayers
+from .rules import get_relation_code, relation_names
+from .manifest import hash_file
+
+
+#a cache file starts with the magic, the length of a json header and the header, followed by the sections it lists
+magic = b'MPCACHE\n'
+#increase when the layout or the way layers are compiled changes, so that old cache files are not used
+cache_format = 1
+cache_extension = '.mpc'
+#None in string columns (unknown lemma, surface or pos); cannot occur in xml text
+none_value = '\x01'
+#other columns are arrays of integers
+string_columns = ['ids', 'lemmas', 'surfaces', 'pos', 'chain_members']
+
+
+def encode_strings(values):
+    '''
+    Function that encodes a list of strings (or None) as NUL separated utf-8
+    '''
+    return '\0'.join(none_value if value is None else value for value in values).encode('utf-8')
+
+
+def decode_strings(data, count):
+
+    if count == 0:
+        return []
+    return [None if value == none_value else value for value in str(data, 'utf-8').split('\0')]
+
+
+def encode_numbers(values):
+    '''
+    Function that turns a list of integers (or None, stored as -1) into an array
+    '''
+    return array('i', [-1 if value is None else value for value in values])
+
+
+def decode_numbers(numbers):
+
+    return [None if value == -1 else value for value in numbers]
+
+
+def compile_layers(nafobj):
+    '''
+    Function that creates the term table, dependency graph and entity chains of a naf object
+    :param nafobj: input naf
+    :return: cCompiledLayers
+    '''
+    terms = create_term_table(nafobj)
+    graph = create_dependency_graph(nafobj, terms)
+    return cCompiledLayers(terms, graph, get_entity_chains(nafobj))
+
+
+def write_cache(layers, path):
+    '''
+    Function that writes compiled layers to a cache file. Relation codes are numbers of this process, so they are
+    stored as positions in a list of relation names in the header. The file is written under a temporary name and
+    renamed, so that parallel workers never read a partial file.
+    :param layers: cCompiledLayers
+    :param path: path of cache file
+    :return: None
+    '''
+    terms = layers.terms
+    graph = layers.graph
+    relations = sorted(set(graph.dep_relations))
+    positions = dict((code, position) for position, code in enumerate(relations))
+    chain_offsets = [0]
+    chain_members = []
+    for chain in layers.entity_chains:
+        chain_members.extend(chain)
+        chain_offsets.append(len(chain_members))
+    columns = [('ids', terms.ids), ('lemmas', terms.lemmas), ('surfaces', terms.surfaces), ('pos', terms.pos),
+               ('chain_members', chain_members), ('offsets', encode_numbers(terms.offsets)),
+               ('sentences', encode_numbers(terms.sentences)), ('dep_offsets', graph.dep_offsets),
+               ('dep_ids', graph.dep_ids), ('dep_relations', array('i', [positions[code] for code in graph.dep_relations])),
+               ('head_offsets', graph.head_offsets), ('head_ids', graph.head_ids),
+               ('head_relations', array('i', [positions[code] for code in graph.head_relations])),
+               ('chain_offsets', array('i', chain_offsets))]
+    header = {'format': cache_format, 'byteorder': sys.byteorder, 'itemsize': array('i').itemsize,
+              'chains': len(layers.entity_chains), 'relations': [relation_names[code] for code in relations],
+              'sections': []}
+    #sections start at multiples of 8 bytes after the header
+    sections = []
+    position = 0
+    for name, values in columns:
+        if name in string_columns:
+            data = encode_strings(values)
+        else:
+            data = values.tobytes()
+        sections.append((name, data))
+        header['sections'].append([name, position, len(data), len(values)])
+        position += len(data) + (-len(data) % 8)
+    header_data = json.dumps(header).encode('utf-8')
+    header_data += b' ' * (-(len(magic) + 4 + len(header_data)) % 8)
+    cache_dir = os.path.dirname(path)
+    handle, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as outfile:
+            outfile.write(magic)
+            outfile.write(struct.pack('<I', len(header_data)))
+            outfile.write(header_data)
+            for name, data in sections:
+                outfile.write(data)
+                outfile.write(b'\0' * (-len(data) % 8))
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def read_cache(path):
+    '''
+    Function that reads compiled layers from a cache file. All columns are decoded into lists and arrays (relation
+    codes and strings have to be converted anyway), so the file is read as a whole rather than mapped.
+    :param path: path of cache file
+    :return: cCompiledLayers (None if the file has another format)
+    '''
+    with open(path, 'rb') as infile:
+        data = memoryview(infile.read())
+    if data[:len(magic)] != magic:
+        return None
+    header_length = struct.unpack('<I', data[len(magic):len(magic) + 4])[0]
+    start = len(magic) + 4
+    header = json.loads(bytes(data[start:start + header_length]).decode('utf-8'))
+    if header['format'] != cache_format or header['itemsize'] != array('i').itemsize:
+        return None
+    start += header_length
+    columns = {}
+    for name, position, length, count in header['sections']:
+        #a view, so a section is only copied once, into its column
+        section = data[start + position:start + position + length]
+        if name in string_columns:
+            columns[name] = decode_strings(section, count)
+        else:
+            columns[name] = array('i')
+            columns[name].frombytes(section)
+            if header['byteorder'] != sys.byteorder:
+                columns[name].byteswap()
+    data = None
+
+    terms = cTermTable()
+    terms.ids = columns['ids']
+    terms.lemmas = columns['lemmas']
+    terms.surfaces = columns['surfaces']
+    terms.pos = columns['pos']
+    terms.offsets = decode_numbers(columns['offsets'])
+    terms.sentences = decode_numbers(columns['sentences'])
+    terms.index = dict((tid, term_number) for term_number, tid in enumerate(terms.ids))
+    codes = [get_relation_code(relation) for relation in header['relations']]
+    dep_relations = array('i', [codes[position] for position in columns['dep_relations']])
+    head_relations = array('i', [codes[position] for position in columns['head_relations']])
+    graph = cDependencyGraph((columns['dep_offsets'], columns['dep_ids'], dep_relations),
+                             (columns['head_offsets'], columns['head_ids'], head_relations))
+    chain_offsets = columns['chain_offsets']
+    chain_members = columns['chain_members']
+    entity_chains = [chain_members[chain_offsets[number]:chain_offsets[number + 1]] for number in range(header['chains'])]
+    return cCompiledLayers(terms, graph, entity_chains)
+
+
+def load_cached_naf(inputfile, reader, cache_dir, digest=None):
+    '''
+    Function that loads the compiled layers of a naf file from the cache, or reads and compiles the file and adds it
+    to the cache. Cache files are named after the hash of the content of the naf file.
+    :param inputfile: the input naf file (path, or file object if digest is given)
+    :param reader: naf reader used if the file is not in the cache ('kafnaf' or 'stream')
+    :param cache_dir: cache directory
+    :param digest: sha256 of the content of the naf file (None: computed from the file)
+    :return: cCompiledLayers
+    '''
+    if digest is None:
+        digest = hash_file(inputfile)
+    path = os.path.join(cache_dir, digest + cache_extension)
+    if os.path.exists(path):
+        layers = read_cache(path)
+        if layers is not None:
+            return layers
+    layers = compile_layers(load_naf(inputfile, reader))
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    write_cache(layers, path)
+    return layers
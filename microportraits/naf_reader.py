@@ -0,0 +1,302 @@
+from lxml import etree
+
+#elements we read and the layers they belong to; all other layers are skipped
+layer_elements = {'text': 'wf', 'terms': 'term', 'deps': 'dep', 'coreferences': 'coref'}
+
+
+class cSpan():
+    '''
+    Class that captures the span of a term (list of token ids)
+    '''
+    __slots__ = ['span_ids']
+
+    def __init__(self, span_ids):
+
+        self.span_ids = span_ids
+
+    def get_span_ids(self):
+
+        return self.span_ids
+
+
+class cTarget():
+    '''
+    Class that captures a target in the span of a coreference
+    '''
+    __slots__ = ['id', 'head']
+
+    def __init__(self, tid, head):
+        '''
+        Initiates target
+        :param tid: term id
+        :param head: whether the target is marked as head
+        '''
+        self.id = tid
+        self.head = head
+
+    def get_id(self):
+
+        return self.id
+
+    def is_head(self):
+
+        return self.head
+
+
+class cToken():
+    '''
+    Class that captures the information of a token (wf) we need
+    '''
+    __slots__ = ['id', 'text', 'offset', 'sent']
+
+    def __init__(self, wid, text, offset, sent):
+
+        self.id = wid
+        self.text = text
+        self.offset = offset
+        self.sent = sent
+
+    def get_id(self):
+
+        return self.id
+
+    def get_text(self):
+
+        return self.text
+
+    def get_offset(self):
+
+        return self.offset
+
+    def get_sent(self):
+
+        return self.sent
+
+
+class cTerm():
+    '''
+    Class that captures the information of a term we need
+    '''
+    __slots__ = ['id', 'lemma', 'pos', 'span']
+
+    def __init__(self, tid, lemma, pos, span):
+
+        self.id = tid
+        self.lemma = lemma
+        self.pos = pos
+        self.span = span
+
+    def get_id(self):
+
+        return self.id
+
+    def get_lemma(self):
+
+        return self.lemma
+
+    def get_pos(self):
+
+        return self.pos
+
+    def get_span(self):
+
+        return self.span
+
+
+class cDependency():
+    '''
+    Class that captures a dependency relation
+    '''
+    __slots__ = ['head', 'dependent', 'function']
+
+    def __init__(self, head, dependent, function):
+
+        self.head = head
+        self.dependent = dependent
+        self.function = function
+
+    def get_from(self):
+
+        return self.head
+
+    def get_to(self):
+
+        return self.dependent
+
+    def get_function(self):
+
+        return self.function
+
+
+class cCoreference():
+    '''
+    Class that captures a coreference chain (list of spans, each a list of cTarget)
+    '''
+    __slots__ = ['id', 'type', 'spans']
+
+    def __init__(self, cid, ctype, spans):
+
+        self.id = cid
+        self.type = ctype
+        self.spans = spans
+
+    def get_id(self):
+
+        return self.id
+
+    def get_type(self):
+
+        return self.type
+
+    def get_spans(self):
+
+        return iter(self.spans)
+
+
+class cNafLayers():
+    '''
+    Class that holds the text, terms, deps and coreference layers of a naf file in plain python objects.
+    It offers the part of the KafNafParser interface used by the extractor, so it can replace a KafNafParser object.
+    '''
+
+    def __init__(self):
+
+        self.tokens = {}
+        self.terms = []
+        self.term_index = {}
+        self.dependencies = []
+        self.corefs = []
+
+    def get_token(self, token_id):
+
+        return self.tokens.get(token_id)
+
+    def get_term(self, term_id):
+
+        return self.term_index.get(term_id)
+
+    def get_terms(self):
+
+        return iter(self.terms)
+
+    def get_dependencies(self):
+
+        return iter(self.dependencies)
+
+    def get_corefs(self):
+
+        return iter(self.corefs)
+
+
+def add_token(layers, element):
+
+    wid = element.get('id')
+    layers.tokens[wid] = cToken(wid, element.text, element.get('offset'), element.get('sent'))
+
+
+def read_term(element):
+
+    span_ids = []
+    span = element.find('span')
+    if span is not None:
+        for target in span.iterfind('target'):
+            span_ids.append(target.get('id'))
+    return cTerm(element.get('id'), element.get('lemma'), element.get('pos'), cSpan(span_ids))
+
+
+def add_term(layers, element):
+
+    term = read_term(element)
+    layers.terms.append(term)
+    layers.term_index[term.id] = term
+
+
+def read_dependency(element):
+
+    return cDependency(element.get('from'), element.get('to'), element.get('rfunc'))
+
+
+def add_dependency(layers, element):
+
+    layers.dependencies.append(read_dependency(element))
+
+
+def read_coreference(element):
+
+    spans = []
+    for span in element.iterfind('span'):
+        targets = []
+        for target in span.iterfind('target'):
+            targets.append(cTarget(target.get('id'), target.get('head') is not None))
+        spans.append(targets)
+    return cCoreference(element.get('id'), element.get('type'), spans)
+
+
+def add_coreference(layers, element):
+
+    layers.corefs.append(read_coreference(element))
+
+
+element_readers = {'wf': add_token, 'term': add_term, 'dep': add_dependency, 'coref': add_coreference}
+
+
+def release_element(element):
+    '''
+    Function that frees an element that has been read, together with its already read siblings
+    :param element: lxml element
+    :return: None
+    '''
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+        #also drop layers (or header) preceding the layer we are reading
+        grandparent = parent.getparent()
+        if grandparent is not None:
+            while parent.getprevious() is not None:
+                del grandparent[0]
+
+
+def read_naf_layers(inputfile):
+    '''
+    Function that reads the layers needed for extraction from a naf file with iterparse.
+    Elements are freed as soon as they are read, other layers are dropped as soon as the next needed
+    layer is reached and parsing stops once all needed layers have been read.
+    :param inputfile: path to (or file object of) naf file
+    :return: cNafLayers
+    '''
+    layers = cNafLayers()
+    tags = list(layer_elements.keys()) + list(layer_elements.values())
+    remaining_layers = set(layer_elements.keys())
+    for event, element in etree.iterparse(inputfile, events=('end',), tag=tags, remove_comments=True):
+        tag = element.tag
+        if tag in element_readers:
+            element_readers[tag](layers, element)
+        elif element.getparent() is not None and element.getparent().getparent() is None:
+            #finished one of the layers we need
+            remaining_layers.discard(tag)
+            if len(remaining_layers) == 0:
+                break
+        release_element(element)
+
+    return layers
+
+
+class cCompiledLayers():
+    '''
+    Class that holds the term table, dependency graph and entity coreference chains of a naf file as created by the
+    extractor. Documents loaded from the cache (see naf_cache.py) are passed on as cCompiledLayers instead of a
+    naf object.
+    '''
+
+    def __init__(self, terms, graph, entity_chains):
+        '''
+        :param terms: cTermTable
+        :param graph: cDependencyGraph
+        :param entity_chains: list of lists of term ids (heads of the mentions of each entity chain)
+        '''
+
+        self.terms = terms
+        self.graph = graph
+        self.entity_chains = entity_chains
@@ -0,0 +1,207 @@
+import logging
+import traceback
+
+from .microportraits import load_naf, extract_portraits_from_naf, derive_output_rows
+from .writers import output_writers
+from .stats import run_stage, cDocumentStats
+
+
+#end of a document in streams of concatenated (xml) and NUL separated documents; length separated streams have a
+#line with the length in bytes before each document
+end_of_document = {'xml': b'</NAF>', 'nul': b'\0'}
+read_size = 65536
+
+
+class cDocumentStream():
+    '''
+    Class that reads the naf documents of a binary stream one after the other. Between start_document and the end
+    of the document, it is a file object (read) that returns the bytes of that document only, so a document can be
+    parsed incrementally while the next one has not been read yet.
+    '''
+
+    def __init__(self, inputfile, separator='xml'):
+        '''
+        Initiates stream
+        :param inputfile: binary file object (e.g. sys.stdin.buffer)
+        :param separator: 'xml' (concatenated documents), 'nul' (documents followed by a NUL byte) or 'length'
+        (each document preceded by a line with its length in bytes)
+        '''
+
+        self.inputfile = inputfile
+        self.separator = separator
+        #read1 returns what is available, so a document is extracted as soon as it is complete in a pipe
+        self.read_chunk = getattr(inputfile, 'read1', inputfile.read)
+        self.buffer = b''
+        self.eof = False
+        self.ended = True
+        self.remaining = 0
+
+    def fill(self):
+        '''
+        Reads the next chunk of the stream into the buffer
+        :return: False if the stream has ended
+        '''
+        if self.eof:
+            return False
+        chunk = self.read_chunk(read_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def start_document(self):
+        '''
+        Skips whitespace before the next document and reads its length line (length separated streams)
+        :return: False if there are no more documents
+        '''
+        while True:
+            self.buffer = self.buffer.lstrip()
+            if self.buffer or not self.fill():
+                break
+        if not self.buffer:
+            return False
+        if self.separator == 'length':
+            while not b'\n' in self.buffer:
+                if not self.fill():
+                    raise ValueError('stream ended in length line of document')
+            line, self.buffer = self.buffer.split(b'\n', 1)
+            self.remaining = int(line)
+        self.ended = False
+        return True
+
+    def read(self, size=-1):
+        '''
+        Returns (at most size) bytes of the current document; b'' at its end
+        '''
+        if size is None or size < 0:
+            size = read_size
+        while not self.ended:
+            if self.separator == 'length':
+                data = self.read_length_separated(size)
+            else:
+                data = self.read_until_end_of_document(size)
+            if data is not None:
+                return data
+        return b''
+
+    def read_length_separated(self, size):
+
+        if self.remaining == 0:
+            self.ended = True
+            return b''
+        if not self.buffer and not self.fill():
+            raise ValueError('stream ended before end of document')
+        data = self.buffer[:min(size, self.remaining)]
+        self.buffer = self.buffer[len(data):]
+        self.remaining -= len(data)
+        return data
+
+    def read_until_end_of_document(self, size):
+        '''
+        Returns bytes of the current document up to its end marker (None if more input is needed first)
+        '''
+        marker = end_of_document[self.separator]
+        position = self.buffer.find(marker)
+        if position >= 0:
+            #the closing tag is part of the document, the NUL byte is not
+            end = position
+            if self.separator == 'xml':
+                end += len(marker)
+            if size < end:
+                data = self.buffer[:size]
+                self.buffer = self.buffer[size:]
+                return data
+            data = self.buffer[:end]
+            self.buffer = self.buffer[position + len(marker):]
+            self.ended = True
+            return data
+        #keep bytes that may be the start of a marker split over two chunks
+        available = len(self.buffer) - len(marker) + 1
+        if available > 0:
+            data = self.buffer[:min(size, available)]
+            self.buffer = self.buffer[len(data):]
+            return data
+        if not self.fill():
+            data = self.buffer
+            self.buffer = b''
+            self.ended = True
+            return data
+        return None
+
+    def skip_document(self):
+        '''
+        Reads the rest of the current document (readers can stop before the end of a document)
+        '''
+        while self.read(read_size):
+            pass
+
+
+def iterate_documents(inputfile, separator='xml'):
+    '''
+    Generator that yields the documents of a stream as file objects; a document must be used before the next is read
+    :param inputfile: binary file object
+    :param separator: how documents are separated (see cDocumentStream)
+    :return: file objects of documents
+    '''
+    stream = cDocumentStream(inputfile, separator)
+    while stream.start_document():
+        yield stream
+        stream.skip_document()
+
+
+def derive_stream_rows(documents, outputfile, options, stats=None, failed=None):
+    '''
+    Generator that extracts the documents of a stream one by one and yields their rows. Portrait identifiers start
+    with stdin and the number of the document (e.g. stdin3:t_12).
+    :param documents: iterable of document file objects
+    :param outputfile: output file object (flushed after each document)
+    :param options: dictionary of extraction options (surface, nocoref, reader, merge_redundant, language)
+    :param stats: cBatchStats to which statistics of each document are added (None: not collected)
+    :param failed: list to which the numbers of documents that could not be extracted are added
+    :return: rows
+    '''
+    for number, document in enumerate(documents, 1):
+        name = 'stdin{}:'.format(number)
+        document_stats = None
+        if stats is not None:
+            document_stats = cDocumentStats(name, stats.coverage is not None)
+        try:
+            nafobj = run_stage(document_stats, 'read', load_naf, document, options['reader'])
+            portraits = extract_portraits_from_naf(nafobj, options['surface'], options['nocoref'],
+                                                   options['merge_redundant'], options['language'], document_stats)
+        except Exception:
+            logging.error('could not extract microportraits from document %d of stream\n%s', number, traceback.format_exc())
+            if failed is not None:
+                failed.append(number)
+            if stats is not None:
+                stats.add_failure()
+            continue
+        nafobj = None
+        rows = derive_output_rows(portraits, name)
+        if document_stats is not None:
+            rows = document_stats.count_rows(rows)
+        for row in rows:
+            yield row
+        if stats is not None:
+            stats.add_document(document_stats.to_dict())
+        outputfile.flush()
+
+
+def extract_stream(inputfile, outputfile, surface=False, nocoref=False, reader='kafnaf', merge_redundant=False,
+                   language='nl', output_format='csv', separator='xml', stats=None):
+    '''
+    Function that extracts the microportraits of a stream of naf documents, writing the rows of all documents to a
+    single output (one document is in memory at a time)
+    :param inputfile: binary file object with naf documents
+    :param outputfile: file object (binary for parquet and arrow, text otherwise)
+    :param separator: how documents are separated (see cDocumentStream)
+    :param stats: cBatchStats in which statistics of each document are collected (None: not collected)
+    :return: list of numbers of documents for which extraction failed
+    '''
+    options = {'surface': surface, 'nocoref': nocoref, 'reader': reader, 'merge_redundant': merge_redundant,
+               'language': language}
+    failed = []
+    rows = derive_stream_rows(iterate_documents(inputfile, separator), outputfile, options, stats, failed)
+    output_writers[output_format](rows, outputfile)
+    return failed
@@ -0,0 +1,170 @@
+import io
+import os
+import queue
+import hashlib
+import threading
+import traceback
+from multiprocessing import Pool
+
+from .microportraits import load_naf, extract_portraits_from_naf, derive_output_rows, get_identifier_prefix
+from .writers import output_writers
+from .compression import open_output
+from .stats import run_stage, cDocumentStats
+from .manifest import create_record
+
+
+def read_inputs(tasks, documents, incremental=False):
+    '''
+    Function run by reader threads: reads input files (taken from tasks until it is empty) and puts their content on
+    documents, which blocks while extraction is behind
+    :param tasks: queue of batch tasks (see extract_file in batch.py)
+    :param documents: bounded queue of (task, content, manifest record, error message) tuples
+    :param incremental: if True, a manifest record is created from the content that is read
+    :return: None
+    '''
+    while True:
+        try:
+            task = tasks.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            with open(task[0], 'rb') as infile:
+                content = infile.read()
+            record = None
+            if incremental:
+                record = create_record(task[0], content)
+                record['output'] = task[1]
+            documents.put((task, content, record, None))
+        except Exception:
+            documents.put((task, None, None, traceback.format_exc()))
+
+
+def extract_rows(task, content, record):
+    '''
+    Function that extracts the output rows of one file from its content in a worker process; errors are caught so
+    that a single file cannot stop a batch
+    :param task: batch task (see extract_file in batch.py)
+    :param content: content of the naf file (bytes)
+    :param record: manifest record of the file (passed on)
+    :return: tuple of task, error message (None if extraction succeeded), list of rows, cDocumentStats (None if not
+    collected) and record
+    '''
+    inputfile, outputfile, options, collect_stats, collect_coverage, incremental = task
+    stats = None
+    if collect_stats:
+        stats = cDocumentStats(inputfile, collect_coverage)
+    try:
+        digest = None
+        if options.get('cache_dir') is not None:
+            digest = hashlib.sha256(content).hexdigest()
+        nafobj = run_stage(stats, 'read', load_naf, io.BytesIO(content), options['reader'], options.get('cache_dir'), digest)
+        content = None
+        portraits = extract_portraits_from_naf(nafobj, options['surface'], options['nocoref'], options['merge_redundant'],
+                                               options['language'], stats)
+        rows = list(derive_output_rows(portraits, get_identifier_prefix(inputfile)))
+    except Exception:
+        return task, traceback.format_exc(), [], None, None
+    return task, None, rows, stats, record
+
+
+def write_output(rows, outputfile, output_format, compression=None, stats=None):
+    '''
+    Function that writes the rows of one file
+    :param rows: list of output rows
+    :param outputfile: path of output file
+    :param output_format: output format (see writers.py)
+    :param compression: compression of output file (None: not compressed)
+    :param stats: cDocumentStats in which the number of rows is recorded (None: not recorded)
+    :return: None
+    '''
+    outfile = open_output(outputfile, output_format, compression)
+    if stats is not None:
+        rows = stats.count_rows(rows)
+    with outfile:
+        output_writers[output_format](rows, outfile)
+
+
+def write_results(results, number_of_tasks, slots, handle_result):
+    '''
+    Function run by the writer thread: writes the rows of extracted files as they come in
+    :param results: queue of results of extract_rows
+    :param number_of_tasks: number of results to write
+    :param slots: semaphore released for each written file, so new files can be sent to the workers
+    :param handle_result: function called with (inputfile, error, statistics, manifest record) of each file
+    :return: None
+    '''
+    for _ in range(number_of_tasks):
+        task, error, rows, stats, record = results.get()
+        inputfile, outputfile, options = task[:3]
+        if error is None:
+            try:
+                run_stage(stats, 'create_output', write_output, rows, outputfile, options.get('output_format', 'csv'),
+                          options.get('compression'), stats)
+            except Exception:
+                #do not leave partial output behind
+                if os.path.exists(outputfile):
+                    os.remove(outputfile)
+                error = traceback.format_exc()
+        rows = None
+        if error is not None:
+            handle_result((inputfile, error, None, None))
+        elif stats is not None:
+            handle_result((inputfile, None, stats.to_dict(), record))
+        else:
+            handle_result((inputfile, None, None, record))
+        slots.release()
+
+
+def run_pipeline(tasks, workers, readers, handle_result, in_flight=None):
+    '''
+    Function that runs batch tasks as a pipeline: reader threads read input files ahead, worker processes extract
+    their rows and a writer thread writes output files, so reading, extraction and writing overlap. The number of
+    files that have been read but not written is bounded, so reading waits when extraction or writing is behind.
+    :param tasks: list of batch tasks (see extract_file in batch.py)
+    :param workers: number of worker processes
+    :param readers: number of reader threads
+    :param handle_result: function called with (inputfile, error, statistics, manifest record) of each file, from
+    the writer thread
+    :param in_flight: maximum number of files that are being extracted or waiting to be written (default: twice
+    the number of workers)
+    :return: None
+    '''
+    if in_flight is None:
+        in_flight = 2 * workers
+    task_queue = queue.Queue()
+    for task in tasks:
+        task_queue.put(task)
+    incremental = len(tasks) > 0 and tasks[0][5]
+    #files read ahead of extraction, files being extracted or written and extracted files waiting to be written
+    documents = queue.Queue(readers)
+    slots = threading.BoundedSemaphore(in_flight)
+    results = queue.Queue()
+
+    reader_threads = [threading.Thread(target=read_inputs, args=(task_queue, documents, incremental), daemon=True)
+                      for _ in range(readers)]
+    writer_thread = threading.Thread(target=write_results, args=(results, len(tasks), slots, handle_result), daemon=True)
+    #workers are started before the threads, so that they are forked from a single threaded process
+    pool = Pool(workers)
+    for thread in reader_threads:
+        thread.start()
+    writer_thread.start()
+    try:
+        for _ in range(len(tasks)):
+            task, content, record, error = documents.get()
+            slots.acquire()
+            if error is not None:
+                results.put((task, error, [], None, None))
+            else:
+                submit_task(pool, task, content, record, results)
+        writer_thread.join()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def submit_task(pool, task, content, record, results):
+
+    def failed(error):
+        results.put((task, ''.join(traceback.format_exception(type(error), error, error.__traceback__)), [], None, None))
+
+    pool.apply_async(extract_rows, (task, content, record), callback=results.put, error_callback=failed)
@@ -0,0 +1,147 @@
+#dependency relations are stored as integer codes, numbered in order of first occurrence
+relation_names = []
+relation_codes = {}
+
+
+def get_relation_code(relation):
+    '''
+    Function that returns the integer code of a dependency relation (adding it if it is new)
+    :param relation: name of relation (e.g. 'hd/su')
+    :return: integer
+    '''
+    code = relation_codes.get(relation)
+    if code is None:
+        code = len(relation_names)
+        relation_codes[relation] = code
+        relation_names.append(relation)
+    return code
+
+
+def get_relation_codes(relations):
+
+    return frozenset(get_relation_code(relation) for relation in relations)
+
+
+#rules per language; relations are names of the parser output, actions are interpreted by the extraction code
+rule_tables = {
+    'nl': {
+        #pos of terms we create portraits for
+        'target_pos': ['noun', 'name', 'pron'],
+        'name_pos': 'name',
+        'coordination_pos': 'vg',
+        'subject_relation': 'hd/su',
+        'object_relation': 'hd/obj1',
+        'predicative_complement_relation': 'hd/predc',
+        'verbal_complement_relation': 'hd/vc',
+        'modifier_relation': 'hd/mod',
+        'multiword_relation': 'mwp/mwp',
+        #dependents of an entity and the kind of description they provide (multiword parts are labels, except for names)
+        'entity_dependents': {
+            'label': ['hd/det', 'hd/app'],
+            'property': ['hd/mod', 'dp/dp', 'cnj/cnj', 'rhd/body', 'hd/vc', 'tag/nucl', 'nucl/tag', '-- / --',
+                         'whd/body', 'hd/me', 'sat/nucl', 'rhd/mod'],
+        },
+        #relation between an entity and its head and the analysis of the head's activity
+        'head_relations': {
+            'subject': ['hd/su'],
+            'object': ['hd/obj1', 'hd/se', 'hd/pobj1', 'hd/vc', 'dlink/nucl'],
+            'coordination': ['crd/cnj', 'cnj/cnj'],
+            'secondary_object': ['hd/obj2'],
+        },
+        'ignored_head_relations': ['hd/sup', 'rhd/body', 'hd/predc', 'hd/hd', 'hd/mod', 'hd/me', 'cmp/body', 'hd/app',
+                                   'mwp/mwp', '-- / --', 'dp/dp', 'nucl/sat', 'tag/nucl', 'crd/cnj', 'cnj/cnj'],
+        #same for the head of a coordination an entity is part of
+        'coordinated_head_relations': {
+            'subject': ['hd/su'],
+            'object': ['hd/obj1'],
+            'secondary_object': ['hd/obj2'],
+            'coordination': ['crd/cnj'],
+        },
+        'ignored_coordinated_head_relations': ['dp/dp', 'tag/nucl', 'hd/predc', 'hd/predm', 'hd/hd', 'hd/mod',
+                                               'cmp/body', 'hd/app', 'mwp/mwp', '-- / --', 'nucl/sat'],
+        'coordination_or_control_relations': ['crd/cnj', 'rhd/body', 'cmp/body', 'sat/nucl', 'whd/body'],
+        #pos of the head of an object and the role of the entity ('preposition': role depends on preposition)
+        'object_head_pos': {
+            'undergoer': ['verb', 'adj'],
+            'preposition': ['prep', 'comp'],
+        },
+        #relation between a preposition and its head
+        'preposition_head_relations': {
+            'preposition': ['hd/mod', 'hd/ld', 'hd/obj1', 'cmp/body', 'hd/predc', 'crd/mod', 'hd/pc'],
+            'recipient': ['hd/obj2'],
+        },
+        'ignored_preposition_head_relations': ['crd/cnj', 'dp/dp'],
+        'preposition_role_suffix': '-rol',
+        #verbs whose secondary object has a role rather than being a recipient
+        'role_verbs': ['ben', 'heb', 'doe'],
+    },
+}
+
+
+class cRules():
+    '''
+    Class that holds the rules of a language compiled to relation codes, frozensets and dispatch dicts
+    '''
+
+    def __init__(self, language, table):
+        '''
+        Compiles rule table
+        :param language: language code
+        :param table: rule table (see rule_tables)
+        '''
+
+        self.language = language
+        self.target_pos = frozenset(table['target_pos'])
+        self.name_pos = table['name_pos']
+        self.coordination_pos = table['coordination_pos']
+        self.subject_relation = get_relation_code(table['subject_relation'])
+        self.object_relation = get_relation_code(table['object_relation'])
+        self.predicative_complement_relation = get_relation_code(table['predicative_complement_relation'])
+        self.verbal_complement_relation = get_relation_code(table['verbal_complement_relation'])
+        self.modifier_relation = get_relation_code(table['modifier_relation'])
+        self.multiword_relation = get_relation_code(table['multiword_relation'])
+        self.entity_dependents = compile_actions(table['entity_dependents'])
+        self.head_relations = compile_actions(table['head_relations'])
+        self.ignored_head_relations = get_relation_codes(table['ignored_head_relations'])
+        self.coordinated_head_relations = compile_actions(table['coordinated_head_relations'])
+        self.ignored_coordinated_head_relations = get_relation_codes(table['ignored_coordinated_head_relations'])
+        self.coordination_or_control_relations = get_relation_codes(table['coordination_or_control_relations'])
+        self.object_head_pos = compile_actions(table['object_head_pos'], False)
+        self.preposition_head_relations = compile_actions(table['preposition_head_relations'])
+        self.ignored_preposition_head_relations = get_relation_codes(table['ignored_preposition_head_relations'])
+        self.preposition_role_suffix = table['preposition_role_suffix']
+        self.role_verbs = frozenset(table['role_verbs'])
+
+
+def compile_actions(actions, relations=True):
+    '''
+    Function that turns a mapping of action to relations (or pos tags) into a dict from relation code (or pos) to action
+    :param actions: dictionary of action and list of relations
+    :param relations: if False, the values are pos tags and are used as they are
+    :return: dictionary
+    '''
+    compiled = {}
+    for action, keys in actions.items():
+        for key in keys:
+            if relations:
+                key = get_relation_code(key)
+            compiled[key] = action
+    return compiled
+
+
+compiled_rules = {}
+
+
+def get_rules(language):
+    '''
+    Function that returns the compiled rules of a language (compiled once per process)
+    :param language: language code
+    :return: cRules
+    '''
+    rules = compiled_rules.get(language)
+    if rules is None:
+        if not language in rule_tables:
+            raise ValueError('no extraction rules for language {}'.format(language))
+        rules = cRules(language, rule_tables[language])
+        compiled_rules[language] = rules
+    return rules
@@ -0,0 +1,397 @@
+import io
+import os
+import sys
+import stat
+import signal
+import logging
+import argparse
+import threading
+import traceback
+import socketserver
+from multiprocessing import Pool, TimeoutError, cpu_count
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from .microportraits import load_naf, extract_portraits_from_naf, derive_output_rows, get_identifier_prefix
+from .rules import rule_tables
+from .writers import output_writers, binary_formats, check_pyarrow, write_csv
+from .batch import get_chunksize
+
+
+content_types = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8',
+                 'parquet': 'application/vnd.apache.parquet', 'arrow': 'application/vnd.apache.arrow.file'}
+
+
+def extract_document(task):
+    '''
+    Function that extracts the output rows of one document in a worker; errors are caught so that a single document
+    cannot stop the server
+    :param task: tuple of document (path or naf content as bytes, possibly compressed), name (portrait identifiers
+    start with the name without .naf, like the input file name in normal runs) and dictionary of options
+    :return: tuple of name, error message (None if extraction succeeded) and list of rows
+    '''
+    document, name, options = task
+    try:
+        if isinstance(document, bytes):
+            document = io.BytesIO(document)
+        nafobj = load_naf(document, options['reader'])
+        portraits = extract_portraits_from_naf(nafobj, options['surface'], options['nocoref'], options['merge_redundant'],
+                                               options['language'])
+        rows = list(derive_output_rows(portraits, get_identifier_prefix(name)))
+    except Exception:
+        return name, traceback.format_exc(), []
+    return name, None, rows
+
+
+def ignore_interrupt():
+    '''
+    Initializer of workers: ctrl-c stops the server, which lets the workers finish their documents
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def write_results(results, output_format, outputfile, header=True):
+    '''
+    Function that writes the rows of all extracted documents of a request
+    :param results: list of (name, error, rows) tuples (see extract_document)
+    :param output_format: output format (see writers.py)
+    :param outputfile: file object (binary for parquet and arrow, text otherwise)
+    :param header: if False, no csv header is written
+    :return: None
+    '''
+    rows = (row for name, error, document_rows in results for row in document_rows)
+    if output_format == 'csv':
+        write_csv(rows, outputfile, header)
+    else:
+        output_writers[output_format](rows, outputfile)
+
+
+class cExtractionServer():
+    '''
+    Class that keeps a pool of warm worker processes and bounds the number of requests waiting for them
+    '''
+
+    def __init__(self, options, workers=None, queue_size=64, timeout=None):
+        '''
+        Starts worker processes
+        :param options: dictionary of extraction options (surface, nocoref, merge_redundant, language, reader)
+        :param workers: number of worker processes (default: number of cores)
+        :param queue_size: maximum number of requests that are being extracted or waiting
+        :param timeout: seconds a request waits for its documents before it gives up (None: no limit)
+        '''
+
+        if workers is None:
+            workers = cpu_count()
+        self.options = options
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.pool = Pool(workers, ignore_interrupt)
+
+    def submit(self, documents, block=True, callback=None):
+        '''
+        Submits the documents of a request; the documents of a request are sent to the workers in batches
+        :param documents: list of (document, name) tuples (see extract_document)
+        :param block: if False, None is returned instead of waiting when the queue is full
+        :param callback: function called with the list of results when all documents are extracted
+        :return: AsyncResult and function that frees the slot of the request (None if the queue is full)
+        '''
+        if not self.slots.acquire(block):
+            return None
+        #the slot is freed once: when extraction ends, or earlier by a request that stops waiting for it
+        once = threading.Lock()
+
+        def release():
+            if once.acquire(False):
+                self.slots.release()
+
+        def finished(results):
+            release()
+            if callback is not None:
+                callback(results)
+
+        def failed(error):
+            release()
+            logging.error('extraction request failed: %s', error)
+
+        tasks = [(document, name, self.options) for document, name in documents]
+        chunksize = get_chunksize(len(tasks), self.workers)
+        return self.pool.map_async(extract_document, tasks, chunksize, finished, failed), release
+
+    def extract(self, documents):
+        '''
+        Extracts the documents of a request and waits for them, at most self.timeout seconds
+        :param documents: list of (document, name) tuples (see extract_document)
+        :return: list of (name, error, rows) tuples (None if the queue is full)
+        :raise TimeoutError: if the documents are not extracted in time (e.g. because a worker died or hangs)
+        '''
+        submitted = self.submit(documents, block=False)
+        if submitted is None:
+            return None
+        result, release = submitted
+        try:
+            return result.get(self.timeout)
+        finally:
+            release()
+
+    def close(self):
+
+        self.pool.close()
+        self.pool.join()
+
+
+def resolve_request_path(paths_root, path):
+    '''
+    Function that resolves a path sent to /extract-paths against the directory the server may read from
+    :param paths_root: real path of the directory
+    :param path: path relative to paths_root (or absolute)
+    :return: real path of file, None if it is not inside paths_root
+    '''
+    resolved = os.path.realpath(os.path.join(paths_root, path))
+    if resolved.startswith(os.path.join(paths_root, '')):
+        return resolved
+    return None
+
+
+class cRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Handler of http requests:
+    POST /extract (body: naf document; query: name, format) returns the rows of the document
+    POST /extract-paths (body: newline separated paths of naf files under --paths-root; query: format) returns the rows
+    of all files; only served if the server was started with --paths-root
+    GET /health returns ok
+    '''
+
+    def do_GET(self):
+
+        if urlparse(self.path).path == '/health':
+            self.send_text(200, 'ok\n')
+        else:
+            self.send_text(404, 'not found\n')
+
+    def do_POST(self):
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        output_format = query.get('format', [self.server.output_format])[0]
+        if not output_format in output_writers:
+            self.send_text(400, 'unknown format {}\n'.format(output_format))
+            return
+        if output_format in binary_formats:
+            try:
+                check_pyarrow(output_format)
+            except ImportError as e:
+                self.send_text(400, '{}\n'.format(e))
+                return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path == '/extract':
+            documents = [(body, query.get('name', ['document'])[0])]
+        elif url.path == '/extract-paths' and self.server.paths_root is not None:
+            paths = [line.strip() for line in body.decode('utf-8').splitlines() if line.strip()]
+            documents = []
+            for path in paths:
+                resolved = resolve_request_path(self.server.paths_root, path)
+                if resolved is None:
+                    self.send_text(403, '{} is not inside the directory the server reads from\n'.format(path))
+                    return
+                documents.append((resolved, path))
+        else:
+            self.send_text(404, 'not found\n')
+            return
+        try:
+            results = self.server.extraction.extract(documents)
+        except TimeoutError:
+            logging.error('extraction of %s did not finish within %s seconds', ', '.join(name for document, name in documents),
+                          self.server.extraction.timeout)
+            self.send_text(504, 'extraction did not finish within {} seconds\n'.format(self.server.extraction.timeout))
+            return
+        if results is None:
+            self.send_text(503, 'queue full, try again later\n', {'Retry-After': '1'})
+            return
+        errors = []
+        for name, error, rows in results:
+            if error is not None:
+                #the traceback is only logged, the client gets the name of the document
+                logging.error('could not extract microportraits from %s\n%s', name, error)
+                errors.append('could not extract microportraits from {}\n'.format(name))
+        if len(errors) > 0:
+            self.send_text(422, ''.join(errors))
+            return
+        if output_format in binary_formats:
+            outputfile = io.BytesIO()
+            write_results(results, output_format, outputfile)
+            content = outputfile.getvalue()
+        else:
+            outputfile = io.StringIO(newline='')
+            write_results(results, output_format, outputfile)
+            content = outputfile.getvalue().encode('utf-8')
+        self.send_content(200, content, content_types[output_format])
+
+    def send_text(self, code, text, headers={}):
+
+        self.send_content(code, text.encode('utf-8'), 'text/plain; charset=utf-8', headers)
+
+    def send_content(self, code, content, content_type, headers={}):
+
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def address_string(self):
+
+        #clients of a unix socket have no address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'local'
+
+    def log_message(self, format, *args):
+
+        logging.info('%s %s', self.address_string(), format % args)
+
+
+class cThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+
+class cThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+
+def serve_http(server, extraction, output_format, paths_root=None):
+    '''
+    Function that handles http requests until interrupted
+    :param server: http server (tcp or unix socket)
+    :param extraction: cExtractionServer
+    :param output_format: output format of requests that do not specify one
+    :param paths_root: directory whose files can be extracted with /extract-paths (None: /extract-paths is not served)
+    :return: None
+    '''
+    server.extraction = extraction
+    server.output_format = output_format
+    server.paths_root = None
+    if paths_root is not None:
+        server.paths_root = os.path.realpath(paths_root)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def remove_stale_socket(path):
+
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.remove(path)
+
+
+class cResultWriter():
+    '''
+    Class that writes the rows of documents as their extraction finishes (the csv header is written once)
+    '''
+
+    def __init__(self, output_format, outputfile):
+
+        self.output_format = output_format
+        self.outputfile = outputfile
+        self.header = True
+        self.failed = []
+
+    def write(self, results):
+
+        for name, error, rows in results:
+            if error is not None:
+                logging.error('could not extract microportraits from %s\n%s', name, error)
+                self.failed.append(name)
+        write_results(results, self.output_format, self.outputfile, self.header)
+        self.header = False
+        self.outputfile.flush()
+
+
+def serve_stdin(extraction, output_format, inputfile=sys.stdin, outputfile=sys.stdout):
+    '''
+    Function that extracts the naf files whose paths are read from inputfile (one per line) and writes their rows to
+    outputfile in the order in which extraction finishes
+    :param extraction: cExtractionServer
+    :param output_format: 'csv' or 'jsonl'
+    :return: list of files for which extraction failed
+    '''
+    writer = cResultWriter(output_format, outputfile)
+    for line in inputfile:
+        path = line.strip()
+        if path:
+            #blocks while the queue is full, so that paths are not read faster than they are extracted
+            extraction.submit([(path, path)], callback=writer.write)
+    extraction.close()
+    return writer.failed
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='python -m microportraits serve',
+                                     description='Keeps worker processes alive and extracts microportraits of documents sent over http, a unix socket or stdin')
+    endpoint = parser.add_mutually_exclusive_group()
+    endpoint.add_argument('--port', type=int, default=8080, help="Port of http endpoint (default 8080)")
+    endpoint.add_argument('--socket', help="Path of unix socket to serve http on instead of a port")
+    endpoint.add_argument('--stdin', action='store_true', default=False, help="Read paths of naf files from stdin and write their rows to stdout")
+    parser.add_argument('--host', default='127.0.0.1', help="Address of http endpoint (default 127.0.0.1)")
+    parser.add_argument('-s', '--surface', action='store_true', default=False)
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    parser.add_argument('-c', '--nocoref', action='store_true', default=False)
+    parser.add_argument('-m', '--mergeredundant', action='store_true', default=False)
+    parser.add_argument('-l', '--language', choices=sorted(rule_tables), default='nl')
+    parser.add_argument('--reader', choices=['kafnaf', 'stream'], default='kafnaf')
+    parser.add_argument('--format', choices=sorted(output_writers), default='csv', help="Default output format (http requests can set format=...)")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Number of worker processes (default: number of cores)")
+    parser.add_argument('--timeout', type=float, default=300, help="Seconds an http request waits for its documents before it gets 504 (default 300; 0: no limit)")
+    parser.add_argument('--paths-root', help="Serve POST /extract-paths for naf files in this directory (paths are relative to it; not served by default)")
+    parser.add_argument('--queue-size', type=int, default=64, help="Maximum number of requests being extracted or waiting; http requests beyond it get 503")
+    args = parser.parse_args(argv)
+
+    if args.stdin and args.format in binary_formats:
+        parser.error('--stdin writes csv or jsonl')
+    if args.format in binary_formats:
+        try:
+            check_pyarrow(args.format)
+        except ImportError as e:
+            parser.error(str(e))
+    if args.paths_root is not None and not os.path.isdir(args.paths_root):
+        parser.error('--paths-root {} is not a directory'.format(args.paths_root))
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format='[%(asctime)s %(name)-12s %(levelname)-5s] %(message)s')
+
+    options = {'surface': args.surface, 'nocoref': args.nocoref, 'merge_redundant': args.mergeredundant,
+               'language': args.language, 'reader': args.reader}
+    #workers are started before any thread, so that they are forked from a single threaded process
+    timeout = args.timeout
+    if timeout <= 0:
+        timeout = None
+    extraction = cExtractionServer(options, args.workers, args.queue_size, timeout)
+    if args.stdin:
+        failed = serve_stdin(extraction, args.format)
+        if len(failed) > 0:
+            sys.exit(1)
+        return
+    if args.socket is not None:
+        remove_stale_socket(args.socket)
+        server = cThreadingUnixHTTPServer(args.socket, cRequestHandler)
+        logging.info('serving on unix socket %s', args.socket)
+    else:
+        server = cThreadingHTTPServer((args.host, args.port), cRequestHandler)
+        logging.info('serving on http://%s:%d', args.host, args.port)
+    try:
+        serve_http(server, extraction, args.format, args.paths_root)
+    finally:
+        extraction.close()
+        if args.socket is not None:
+            remove_stale_socket(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import logging
+import multiprocessing
+from collections import defaultdict
+
+from .microportraits import (extract_sentence_portrait, index_colabels, remove_duplicate_portraits,
+                             extract_sentence_level_portraits)
+from .windowed import get_sentence_windows
+
+
+#extraction context of the document being sharded, set in each worker by init_shard_worker
+shard_context = None
+
+
+def init_shard_worker(context):
+    '''
+    Initializer of shard workers. Workers are forked, so the context (term table, graph and relation codes of the
+    parent) is shared with the parent rather than sent to each worker.
+    :param context: extraction context of input naf
+    :return: None
+    '''
+    global shard_context
+    shard_context = context
+
+
+def extract_shard(shard):
+    '''
+    Function that extracts the sentence level portraits of the target terms of a range of sentences in a worker
+    :param shard: (start, end) range of term numbers
+    :return: tuple of list of portraits (in document order) and counts of extraction rules (None if not collected)
+    '''
+    context = shard_context
+    start, end = shard
+    if context.coverage is not None:
+        context.coverage = defaultdict(int)
+    portraits = []
+    target_pos = context.rules.target_pos
+    pos = context.terms.pos
+    for term_number in range(start, end):
+        if pos[term_number] in target_pos:
+            portraits.append(extract_sentence_portrait(context, term_number))
+    #caches are filled per head and heads do not cross sentences
+    context.dependent_index = None
+    context.constituent_components.clear()
+    context.ordered_constituents.clear()
+    coverage = None
+    if context.coverage is not None:
+        coverage = dict(context.coverage)
+    return portraits, coverage
+
+
+def get_shards(terms, workers):
+    '''
+    Function that splits the terms of a document into ranges of whole sentences, four per worker so that workers
+    that finish early take over remaining ranges
+    :param terms: cTermTable
+    :param workers: number of worker processes
+    :return: list of (start, end) ranges of term numbers
+    '''
+    number_of_sentences = 0
+    previous = None
+    for sentence in terms.sentences:
+        if sentence is not None and sentence != previous:
+            number_of_sentences += 1
+            previous = sentence
+    sentences_per_shard = max(1, -(-number_of_sentences // (workers * 4)))
+    return list(get_sentence_windows(terms, sentences_per_shard))
+
+
+def extract_sharded_portraits(context, merge_redundant=False, workers=None):
+    '''
+    Function that extracts sentence level portraits like extract_sentence_level_portraits, with the sentences of the
+    document divided over worker processes. Removing duplicates (and merging coreferring portraits afterwards) is
+    done on the combined portraits, so the result is the same as in a single process.
+    :param context: extraction context of input naf
+    :param merge_redundant: if True, new information of redundant portraits is added rather than dropped
+    :param workers: number of worker processes (default: number of cores)
+    :return: dictionary of term_ids and their microportait on sentence level
+    '''
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if not 'fork' in multiprocessing.get_all_start_methods():
+        #relation codes and the context can only be shared with forked workers
+        logging.warning('sentence sharding needs fork, extracting in one process')
+        workers = 1
+    shards = get_shards(context.terms, workers)
+    if workers == 1 or len(shards) < 2:
+        return extract_sentence_level_portraits(context, merge_redundant)
+    pool = multiprocessing.get_context('fork').Pool(workers, init_shard_worker, (context,))
+    try:
+        #imap returns the shards in document order
+        return combine_shard_portraits(context, pool.imap(extract_shard, shards), merge_redundant)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def combine_shard_portraits(context, results, merge_redundant=False):
+    '''
+    Function that combines the portraits of all shards and removes duplicate portraits
+    :param context: extraction context of input naf (coverage counts of the shards are added to it)
+    :param results: iterable of results of extract_shard, in document order
+    :param merge_redundant: if True, new information of redundant portraits is added rather than dropped
+    :return: dictionary of term_ids and their microportait on sentence level
+    '''
+    minimicroportaits = {}
+    colabel_index = defaultdict(list)
+    for portraits, shard_coverage in results:
+        for term_portrait in portraits:
+            minimicroportaits[term_portrait.get_identifier()] = term_portrait
+            index_colabels(colabel_index, term_portrait)
+        if shard_coverage is not None:
+            for key, count in shard_coverage.items():
+                context.coverage[key] += count
+    return remove_duplicate_portraits(minimicroportaits, colabel_index, merge_redundant)
@@ -0,0 +1,207 @@
+import sys
+import json
+import time
+from collections import OrderedDict
+
+
+#stages of the extraction of a document, in order
+stages = ['read', 'create_info_dicts', 'extract_sentence_level_portraits', 'merge_coreference_portraits', 'create_output']
+
+
+class cDocumentStats():
+    '''
+    Class that records wall and cpu time per stage and counts of a single document
+    '''
+
+    def __init__(self, inputfile, coverage=False):
+        '''
+        Initiates empty statistics
+        :param inputfile: the input naf file
+        :param coverage: if True, counts of the extraction rules that fired are collected
+        '''
+
+        self.inputfile = inputfile
+        self.stages = OrderedDict()
+        self.counts = OrderedDict()
+        self.coverage = None
+        if coverage:
+            self.coverage = {}
+
+    def add_time(self, stage, wall, cpu):
+
+        if not stage in self.stages:
+            self.stages[stage] = {'wall': 0.0, 'cpu': 0.0}
+        self.stages[stage]['wall'] += wall
+        self.stages[stage]['cpu'] += cpu
+
+    def set_count(self, name, count):
+
+        self.counts[name] = count
+
+    def count_rows(self, rows):
+        '''
+        Generator that passes on rows while counting them
+        :param rows: iterable of output rows
+        :return: rows
+        '''
+        self.counts['rows'] = 0
+        for row in rows:
+            self.counts['rows'] += 1
+            yield row
+
+    def add_coverage(self, coverage):
+        '''
+        Adds counts of extraction rules
+        :param coverage: dictionary of (branch, outcome, relation) and count
+        :return: None
+        '''
+        for key, count in coverage.items():
+            self.coverage[key] = self.coverage.get(key, 0) + count
+
+    def to_dict(self):
+
+        document_stats = {'file': self.inputfile, 'stages': self.stages, 'counts': self.counts}
+        if self.coverage is not None:
+            document_stats['coverage'] = coverage_to_list(self.coverage)
+        return document_stats
+
+
+def coverage_to_list(coverage):
+    '''
+    Function that turns counts of extraction rules into a list of [branch, outcome, relation, count] (usable in json),
+    sorted by branch and decreasing count
+    :param coverage: dictionary of (branch, outcome, relation) and count
+    :return: list
+    '''
+    items = sorted(coverage.items(), key=lambda item: (item[0][0], -item[1], item[0][1], item[0][2]))
+    return [[branch, outcome, relation, count] for (branch, outcome, relation), count in items]
+
+
+def run_stage(stats, stage, function, *args):
+    '''
+    Function that calls function with args, recording its wall and cpu time as stage if stats are collected
+    :param stats: cDocumentStats (None if no statistics are collected)
+    :param stage: name of stage
+    :param function: function to call
+    :return: result of function
+    '''
+    if stats is None:
+        return function(*args)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = function(*args)
+    stats.add_time(stage, time.perf_counter() - wall, time.process_time() - cpu)
+    return result
+
+
+class cBatchStats():
+    '''
+    Class that aggregates the statistics of the documents of a run
+    '''
+
+    def __init__(self, coverage=False):
+        '''
+        Initiates statistics of a run
+        :param coverage: if True, counts of the extraction rules that fired are collected
+        '''
+
+        self.start = time.time()
+        self.end = None
+        self.documents = []
+        self.failed = 0
+        self.stages = OrderedDict((stage, {'wall': 0.0, 'cpu': 0.0}) for stage in stages)
+        self.counts = OrderedDict()
+        self.coverage = None
+        if coverage:
+            self.coverage = {}
+
+    def add_document(self, document_stats):
+        '''
+        Adds statistics of a document
+        :param document_stats: dictionary (see cDocumentStats.to_dict)
+        :return: None
+        '''
+        self.documents.append(document_stats)
+        for stage, times in document_stats['stages'].items():
+            if not stage in self.stages:
+                self.stages[stage] = {'wall': 0.0, 'cpu': 0.0}
+            self.stages[stage]['wall'] += times['wall']
+            self.stages[stage]['cpu'] += times['cpu']
+        for name, count in document_stats['counts'].items():
+            self.counts[name] = self.counts.get(name, 0) + count
+        if self.coverage is not None:
+            for branch, outcome, relation, count in document_stats.get('coverage', []):
+                key = (branch, outcome, relation)
+                self.coverage[key] = self.coverage.get(key, 0) + count
+
+    def add_failure(self):
+
+        self.failed += 1
+
+    def finish(self):
+        '''
+        Marks the end of the run (reports created later use this time)
+        '''
+        self.end = time.time()
+
+    def create_report(self):
+        '''
+        Creates report of the run
+        :return: dictionary with totals, throughput and statistics per document
+        '''
+        end = self.end
+        if end is None:
+            end = time.time()
+        wall_time = end - self.start
+        throughput = OrderedDict()
+        if wall_time > 0:
+            throughput['documents_per_second'] = len(self.documents) / wall_time
+            for name in ['terms', 'rows']:
+                if name in self.counts:
+                    throughput[name + '_per_second'] = self.counts[name] / wall_time
+        report = OrderedDict()
+        report['documents'] = len(self.documents)
+        report['failed'] = self.failed
+        report['wall_time'] = wall_time
+        report['stages'] = self.stages
+        report['counts'] = self.counts
+        report['throughput'] = throughput
+        if self.coverage is not None:
+            report['coverage'] = coverage_to_list(self.coverage)
+        report['per_document'] = self.documents
+        return report
+
+    def write_json(self, outputfile):
+
+        with open(outputfile, 'w') as outfile:
+            json.dump(self.create_report(), outfile, indent=2)
+
+    def print_summary(self, outputfile=None):
+        '''
+        Prints time per stage (summed over documents), counts and throughput
+        :param outputfile: file to print to (default: stderr)
+        :return: None
+        '''
+        if outputfile is None:
+            outputfile = sys.stderr
+        report = self.create_report()
+        outputfile.write('{} documents ({} failed) in {:.2f}s\n'.format(report['documents'], report['failed'], report['wall_time']))
+        outputfile.write('{:<36}{:>10}{:>10}\n'.format('stage', 'wall (s)', 'cpu (s)'))
+        for stage, times in report['stages'].items():
+            outputfile.write('{:<36}{:>10.3f}{:>10.3f}\n'.format(stage, times['wall'], times['cpu']))
+        for name, count in report['counts'].items():
+            outputfile.write('{}: {}\n'.format(name, count))
+        for name, value in report['throughput'].items():
+            outputfile.write('{}: {:.1f}\n'.format(name, value))
+
+    def print_coverage(self, outputfile=None):
+        '''
+        Prints how often each outcome of the extraction rules fired, per branch and relation
+        :param outputfile: file to print to (default: stderr)
+        :return: None
+        '''
+        if outputfile is None:
+            outputfile = sys.stderr
+        outputfile.write('{:<20}{:<18}{:<16}{:>10}\n'.format('branch', 'outcome', 'relation', 'count'))
+        for branch, outcome, relation, count in coverage_to_list(self.coverage):
+            outputfile.write('{:<20}{:<18}{:<16}{:>10}\n'.format(branch, outcome, relation, count))
@@ -0,0 +1,265 @@
+from collections import defaultdict
+from array import array
+
+from lxml import etree
+
+from .microportraits import (cTermTable, cDependencyGraph, cExtractionContext, cCoreferenceIndex, cDisjointSet, create_rows,
+                             add_term_info, get_term_number, get_mention_heads, get_token_info, get_term_info,
+                             extract_sentence_portrait, index_colabels, remove_duplicate_portraits,
+                             retrieve_merge_candidates, get_candidate_chains, merge_portrait_group, derive_output_rows,
+                             record_document_counts, load_naf, get_identifier_prefix)
+from .naf_reader import (cNafLayers, cCompiledLayers, layer_elements, add_token, read_term, read_dependency,
+                         read_coreference, release_element)
+from .rules import get_relation_code, get_rules
+from .writers import output_writers
+from .stats import run_stage
+from .compression import open_naf
+
+
+def read_compiled_layers(inputfile):
+    '''
+    Function that reads a naf file with iterparse directly into a term table, dependency graph and entity chains.
+    Tokens are only kept until the terms layer has been read and no element outlives the moment it is read, so
+    neither a DOM nor an object per term or dependency is kept.
+    :param inputfile: path to (or file object of) naf file
+    :return: cCompiledLayers
+    '''
+    tokens = cNafLayers()
+    terms = cTermTable()
+    heads = array('i')
+    dependents = array('i')
+    relations = array('i')
+    entity_chains = []
+    tags = list(layer_elements.keys()) + list(layer_elements.values())
+    remaining_layers = set(layer_elements.keys())
+    for event, element in etree.iterparse(inputfile, events=('end',), tag=tags, remove_comments=True):
+        tag = element.tag
+        if tag == 'wf':
+            add_token(tokens, element)
+        elif tag == 'term':
+            add_term_info(terms, tokens, read_term(element))
+        elif tag == 'dep':
+            if 'terms' in remaining_layers:
+                #dependencies before the terms layer are numbered once all terms are known
+                tokens.dependencies.append(read_dependency(element))
+            else:
+                add_dependency(terms, read_dependency(element), heads, dependents, relations)
+        elif tag == 'coref':
+            if element.get('type') == 'entity':
+                entity_chains.append(get_mention_heads(read_coreference(element)))
+        elif element.getparent() is not None and element.getparent().getparent() is None:
+            remaining_layers.discard(tag)
+            if tag == 'terms':
+                tokens.tokens = {}
+            if len(remaining_layers) == 0:
+                break
+        release_element(element)
+
+    for dep in tokens.dependencies:
+        add_dependency(terms, dep, heads, dependents, relations)
+    graph_rows = (create_rows(len(terms), heads, dependents, relations), create_rows(len(terms), dependents, heads, relations))
+    return cCompiledLayers(terms, cDependencyGraph(*graph_rows), entity_chains)
+
+
+def add_dependency(terms, dep, heads, dependents, relations):
+
+    heads.append(get_term_number(terms, dep.get_from()))
+    dependents.append(get_term_number(terms, dep.get_to()))
+    relations.append(get_relation_code(dep.get_function()))
+
+
+def get_sentence_windows(terms, window_size):
+    '''
+    Generator that splits the term numbers of a document into windows of window_size sentences. Terms without a
+    sentence number belong to the sentence of the term before them.
+    :param terms: cTermTable
+    :param window_size: number of sentences per window
+    :return: (start, end) ranges of term numbers
+    '''
+    start = 0
+    sentences_in_window = 0
+    previous = None
+    for term_number, sentence in enumerate(terms.sentences):
+        if sentence is None or sentence == previous:
+            continue
+        previous = sentence
+        if sentences_in_window == window_size:
+            yield start, term_number
+            start = term_number
+            sentences_in_window = 0
+        sentences_in_window += 1
+    if start < len(terms):
+        yield start, len(terms)
+
+
+def extract_window_portraits(context, start, end, merge_redundant=False):
+    '''
+    Function that extracts the sentence level portraits of the terms of one window (see extract_sentence_level_portraits)
+    :param context: extraction context of input naf
+    :param start: first term number of window
+    :param end: term number after window
+    :param merge_redundant: if True, new information of redundant portraits is added rather than dropped
+    :return: dictionary of term ids and their microportraits on sentence level
+    '''
+    minimicroportaits = {}
+    colabel_index = defaultdict(list)
+    target_pos = context.rules.target_pos
+    pos = context.terms.pos
+    for term_number in range(start, end):
+        if pos[term_number] in target_pos:
+            term_portrait = extract_sentence_portrait(context, term_number)
+            minimicroportaits[term_portrait.get_identifier()] = term_portrait
+            index_colabels(colabel_index, term_portrait)
+    #caches are filled per head and heads do not cross sentences
+    context.dependent_index = None
+    context.constituent_components.clear()
+    context.ordered_constituents.clear()
+    return remove_duplicate_portraits(minimicroportaits, colabel_index, merge_redundant)
+
+
+class cPendingMerges():
+    '''
+    Class that keeps the merge candidates of coreference chains that have not ended yet. Candidates are grouped
+    like in merge_coreference_portraits; a group is merged and released once the last mention of each of its chains
+    has been passed.
+    '''
+
+    def __init__(self, coref_index, terms):
+        '''
+        :param coref_index: cCoreferenceIndex of entity chains
+        :param terms: cTermTable
+        '''
+
+        self.coref_index = coref_index
+        self.groups = cDisjointSet()
+        #portraits of candidates and first candidate of each chain
+        self.portraits = {}
+        self.chain_first = {}
+        #candidates, chains and last term number of each group (by representative)
+        self.members = {}
+        self.group_chains = {}
+        self.group_end = {}
+        self.chain_end = []
+        for members in coref_index.chain2members:
+            term_numbers = [terms.index[tid] for tid in members if tid in terms.index]
+            self.chain_end.append(max(term_numbers) if term_numbers else -1)
+
+    def add(self, candidate, portrait):
+
+        self.groups.add(candidate)
+        self.portraits[candidate] = portrait
+        self.members[candidate] = [candidate]
+        self.group_chains[candidate] = []
+        self.group_end[candidate] = -1
+        for chain_id in get_candidate_chains(self.coref_index, candidate, portrait):
+            first = self.chain_first.setdefault(chain_id, candidate)
+            root = self.join(first, candidate)
+            self.group_chains[root].append(chain_id)
+            self.group_end[root] = max(self.group_end[root], self.chain_end[chain_id])
+
+    def join(self, candidate1, candidate2):
+
+        root1 = self.groups.find(candidate1)
+        root2 = self.groups.find(candidate2)
+        if root1 == root2:
+            return root1
+        self.groups.union(root1, root2)
+        root = self.groups.find(root1)
+        other = root2 if root == root1 else root1
+        self.members[root] += self.members.pop(other)
+        self.group_chains[root] += self.group_chains.pop(other)
+        self.group_end[root] = max(self.group_end[root], self.group_end.pop(other))
+        return root
+
+    def pop_finished(self, end):
+        '''
+        Merges and removes the groups whose chains have no mention at or after term number end
+        :param end: first term number that has not been extracted
+        :return: dictionary of term ids and the portraits that remain of the groups
+        '''
+        finished = [root for root, group_end in self.group_end.items() if group_end < end]
+        merged = {}
+        for root in finished:
+            #merged into the candidate that was found first, like merge_coreference_portraits
+            members = sorted(self.members.pop(root), key=self.groups.order.get)
+            portraits = dict((candidate, self.portraits.pop(candidate)) for candidate in members)
+            merge_portrait_group(portraits, members)
+            merged.update(portraits)
+            for chain_id in self.group_chains.pop(root):
+                self.chain_first.pop(chain_id, None)
+            del self.group_end[root]
+        return merged
+
+
+def derive_windowed_rows(context, window_size, prefix, nocoref=False, merge_redundant=False, stats=None):
+    '''
+    Generator that extracts the portraits of a document window by window and yields their rows. Portraits that are
+    not merge candidates are written after their window; candidates are kept until all chains they share have ended.
+    :param context: extraction context of input naf
+    :param window_size: number of sentences per window
+    :param prefix: prefix of portrait identifiers (input file name)
+    :param nocoref: if True, portraits are not merged based on coreference
+    :param merge_redundant: if True, new information of redundant portraits is added rather than dropped
+    :param stats: cDocumentStats in which counts are recorded (None: not recorded)
+    :return: rows
+    '''
+    pending = None
+    if not nocoref:
+        context.coreferences = cCoreferenceIndex()
+        for mentions in context.nafobj.entity_chains:
+            context.coreferences.add_chain(mentions)
+        pending = cPendingMerges(context.coreferences, context.terms)
+    sentence_level_portraits = 0
+    portraits = 0
+    for start, end in get_sentence_windows(context.terms, window_size):
+        window_portraits = extract_window_portraits(context, start, end, merge_redundant)
+        sentence_level_portraits += len(window_portraits)
+        if pending is not None:
+            for candidate in retrieve_merge_candidates(context.coreferences, window_portraits):
+                pending.add(candidate, window_portraits.pop(candidate))
+            window_portraits.update(pending.pop_finished(end))
+            #in document order, so that a document that fits in one window gives the same output as without windows
+            window_portraits = dict(sorted(window_portraits.items(), key=lambda item: context.terms.index[item[0]]))
+        portraits += len(window_portraits)
+        for row in derive_output_rows(window_portraits, prefix):
+            yield row
+    if stats is not None:
+        stats.set_count('sentence_level_portraits', sentence_level_portraits)
+        record_document_counts(stats, context, {})
+        stats.set_count('portraits', portraits)
+
+
+def extract_windowed(inputfile, outputfile, window_size, surface=False, nocoref=False, merge_redundant=False,
+                     language='nl', output_format='csv', stats=None, cache_dir=None):
+    '''
+    Function that extracts the microportraits of a (very large) naf file sentence window by sentence window. The file
+    is read into a compact term table and dependency graph without a DOM and only the portraits of the current
+    window and those waiting for coreference chains that continue after it are in memory. The output has the same
+    rows as extract_microportraits, but merged portraits are written when their last chain ends.
+    :param inputfile: the input naf file
+    :param outputfile: file object (binary for parquet and arrow, text otherwise)
+    :param window_size: number of sentences per window
+    :param stats: cDocumentStats in which time per stage and counts are recorded (None: nothing is recorded)
+    :param cache_dir: directory with compiled layers of naf files (see naf_cache.py; None: no cache)
+    :return: None
+    '''
+    if cache_dir is not None:
+        layers = run_stage(stats, 'read', load_naf, inputfile, 'stream', cache_dir)
+    else:
+        with open_naf(inputfile) as naf:
+            layers = run_stage(stats, 'read', read_compiled_layers, naf)
+    context = cExtractionContext(layers, get_rules(language))
+    context.terms = layers.terms
+    context.graph = layers.graph
+    if surface:
+        get_token_info(context)
+    else:
+        get_term_info(context)
+    if stats is not None and stats.coverage is not None:
+        context.coverage = defaultdict(int)
+    prefix = get_identifier_prefix(inputfile)
+    rows = derive_windowed_rows(context, window_size, prefix, nocoref, merge_redundant, stats)
+    if stats is not None:
+        rows = stats.count_rows(rows)
+    #extraction happens while rows are written
+    run_stage(stats, 'create_output', output_writers[output_format], rows, outputfile)
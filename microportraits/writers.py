@@ -0,0 +1,132 @@
+import sys
+import json
+
+if sys.version_info < (3, 0):
+    import unicodecsv as csv
+else:
+    import csv
+
+#pyarrow is only needed for parquet and arrow output
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+output_columns = ['mp_identifier','mention_id','relation','description','pos','term_id','dep_rel','constituent_head']
+output_extensions = {'csv': '.csv', 'jsonl': '.jsonl', 'parquet': '.parquet', 'arrow': '.arrow'}
+#formats that are written to binary files
+binary_formats = ['parquet', 'arrow']
+#number of rows per record batch in parquet and arrow output
+batch_size = 65536
+
+
+def write_csv(rows, outputfile, header=True):
+    '''
+    Function that writes rows as semicolon separated csv with header
+    :param rows: iterable of output rows
+    :param outputfile: text file object
+    :param header: if False, the header is not written (rows are appended to earlier output)
+    :return: None
+    '''
+    myout = csv.writer(outputfile, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    if header:
+        myout.writerow(output_columns)
+    myout.writerows(rows)
+
+
+def write_jsonl(rows, outputfile):
+    '''
+    Function that writes each row as a json object (with the output columns as keys) on a line
+    :param rows: iterable of output rows
+    :param outputfile: text file object
+    :return: None
+    '''
+    for row in rows:
+        outputfile.write(json.dumps(dict(zip(output_columns, row)), ensure_ascii=False))
+        outputfile.write('\n')
+
+
+def check_pyarrow(output_format):
+
+    if pyarrow is None:
+        raise ImportError('{} output requires pyarrow (pip install pyarrow)'.format(output_format))
+
+
+def get_arrow_schema():
+    '''
+    Function that returns the schema of arrow and parquet output: all columns are dictionary encoded strings
+    :return: pyarrow schema
+    '''
+    column_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return pyarrow.schema([pyarrow.field(column, column_type) for column in output_columns])
+
+
+def create_record_batch(columns, schema):
+    '''
+    Function that turns lists of column values into a record batch of dictionary encoded columns
+    :param columns: list of value lists (one per output column)
+    :param schema: arrow schema of output
+    :return: pyarrow RecordBatch
+    '''
+    arrays = [pyarrow.array(values, type=pyarrow.string()).dictionary_encode() for values in columns]
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def iterate_record_batches(rows, schema):
+    '''
+    Generator that collects rows into record batches of at most batch_size rows
+    :param rows: iterable of output rows
+    :param schema: arrow schema of output
+    :return: record batches
+    '''
+    columns = [[] for column in output_columns]
+    for row in rows:
+        for values, value in zip(columns, row):
+            values.append(value)
+        if len(columns[0]) == batch_size:
+            yield create_record_batch(columns, schema)
+            columns = [[] for column in output_columns]
+    if len(columns[0]) > 0:
+        yield create_record_batch(columns, schema)
+
+
+def write_parquet(rows, outputfile):
+    '''
+    Function that writes rows as a parquet file
+    :param rows: iterable of output rows
+    :param outputfile: binary file object
+    :return: None
+    '''
+    check_pyarrow('parquet')
+    schema = get_arrow_schema()
+    writer = pyarrow.parquet.ParquetWriter(outputfile, schema)
+    try:
+        for batch in iterate_record_batches(rows, schema):
+            writer.write_batch(batch)
+    finally:
+        writer.close()
+
+
+def write_arrow(rows, outputfile):
+    '''
+    Function that writes rows as an arrow ipc file. The file format allows one dictionary per column, so the
+    batches are collected and their dictionaries unified before writing.
+    :param rows: iterable of output rows
+    :param outputfile: binary file object
+    :return: None
+    '''
+    check_pyarrow('arrow')
+    schema = get_arrow_schema()
+    table = pyarrow.Table.from_batches(list(iterate_record_batches(rows, schema)), schema=schema)
+    options = pyarrow.ipc.IpcWriteOptions(unify_dictionaries=True)
+    writer = pyarrow.ipc.new_file(outputfile, schema, options=options)
+    try:
+        writer.write_table(table)
+    finally:
+        writer.close()
+
+
+output_writers = {'csv': write_csv, 'jsonl': write_jsonl, 'parquet': write_parquet, 'arrow': write_arrow}
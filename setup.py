@@ -20,9 +20,13 @@ setup(
     author_email='antske.fokkens@vu.nl',
     url='https://github.com/antske/micro-portraits/',
     license=license,
-    packages=find_packages(exclude=('tests', 'docs')),
+    packages=find_packages(exclude=('tests', 'docs', 'benchmarks')),
     install_requires = py2_requirements + [
         "KafNafParserPy",
-    ]
+    ],
+    extras_require = {
+        "arrow": ["pyarrow"],
+        "zstd": ["zstandard"],
+    }
 )
 
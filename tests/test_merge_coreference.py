@@ -0,0 +1,147 @@
+import os
+import copy
+import time
+import random
+
+import pytest
+
+from microportraits.microportraits import (cMicroportait, cExtractionContext, load_naf, extract_portraits_from_naf,
+                                           get_entity_chains, merge_coreference_portraits, derive_output_rows)
+from microportraits.naf_reader import cCompiledLayers
+from microportraits.rules import get_rules
+
+
+regression_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'regression_tests', 'nl')
+regression_nafs = [os.path.join(regression_dir, 'naf', 'appositions.gold.naf'),
+                   os.path.join(regression_dir, 'systemnaf', 'appositions.out.naf')]
+
+
+def reference_merge(entity_chains, sentence_level_portraits):
+    '''
+    Merges candidates that share a chain (directly or through other candidates) into the first candidate of their group
+    by comparing all candidates with each other
+    :param entity_chains: list of lists of term ids
+    :param sentence_level_portraits: dictionary of term id and its sentence level portraits (updated in place)
+    :return: None
+    '''
+    #chains with a single distinct mention do not link anything
+    chains = [set(mentions) for mentions in entity_chains if len(set(mentions)) > 1]
+    candidate_chains = {}
+    for tid, portrait in sentence_level_portraits.items():
+        merge_ids = set([tid] + portrait.get_colabels())
+        linked = set(number for number, mentions in enumerate(chains) if mentions & merge_ids)
+        if linked:
+            candidate_chains[tid] = linked
+
+    groups = []
+    for candidate, linked in candidate_chains.items():
+        joined = [group for group in groups if any(candidate_chains[other] & linked for other in group)]
+        new_group = [candidate]
+        for group in joined:
+            groups.remove(group)
+            new_group = group + new_group
+        groups.append(sorted(new_group, key=list(candidate_chains).index))
+
+    for group in groups:
+        main_portrait = sentence_level_portraits[group[0]]
+        for candidate in group[1:]:
+            merge_portrait = sentence_level_portraits.pop(candidate)
+            main_portrait.labels += merge_portrait.labels
+            main_portrait.properties += merge_portrait.properties
+            main_portrait.activities += merge_portrait.activities
+            main_portrait.colabels += merge_portrait.colabels
+
+
+def merge_with_chains(entity_chains, sentence_level_portraits):
+
+    context = cExtractionContext(cCompiledLayers(None, None, entity_chains), get_rules('nl'))
+    merge_coreference_portraits(context, sentence_level_portraits)
+
+
+def create_portraits(colabels):
+    '''
+    Creates portraits whose labels are their own term id
+    :param colabels: dictionary of term id and its colabels (in the order of the portraits)
+    :return: dictionary of term id and cMicroportait
+    '''
+    portraits = {}
+    for tid, tid_colabels in colabels.items():
+        portrait = cMicroportait(tid)
+        portrait.labels.append(tid)
+        portrait.colabels += tid_colabels
+        portraits[tid] = portrait
+    return portraits
+
+
+def get_merged_labels(portraits):
+
+    return [(tid, portrait.labels, portrait.colabels) for tid, portrait in portraits.items()]
+
+
+def test_chains_joined_through_colabels():
+
+    #t_1 and t_2 each corefer with a colabel of t_3 only: all three are merged into t_1, the first in document order
+    colabels = {'t_1': [], 't_2': [], 't_3': ['t_8', 't_9']}
+    chains = [['t_1', 't_8'], ['t_2', 't_9']]
+    portraits = create_portraits(colabels)
+    merge_with_chains(chains, portraits)
+    assert get_merged_labels(portraits) == [('t_1', ['t_1', 't_2', 't_3'], ['t_8', 't_9'])]
+
+    expected = create_portraits(colabels)
+    reference_merge(chains, expected)
+    assert get_merged_labels(portraits) == get_merged_labels(expected)
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_random_chains_and_colabels(seed):
+
+    generator = random.Random(seed)
+    number_of_terms = generator.randint(4, 30)
+    tids = ['t_%d' % i for i in range(number_of_terms)]
+    portrait_ids = generator.sample(tids, generator.randint(2, number_of_terms))
+    colabels = {}
+    for tid in portrait_ids:
+        colabels[tid] = generator.sample(tids, generator.choice([0, 0, 1, 2]))
+    chains = []
+    for _ in range(generator.randint(1, 6)):
+        chains.append([generator.choice(tids) for _ in range(generator.randint(1, 4))])
+
+    portraits = create_portraits(colabels)
+    merge_with_chains(chains, portraits)
+    expected = create_portraits(colabels)
+    reference_merge(chains, expected)
+    assert get_merged_labels(portraits) == get_merged_labels(expected)
+
+
+@pytest.mark.parametrize('inputfile', regression_nafs)
+@pytest.mark.parametrize('surface', [False, True])
+def test_regression_naf(inputfile, surface):
+
+    nafobj = load_naf(inputfile)
+    sentence_level_portraits = extract_portraits_from_naf(nafobj, surface, nocoref=True)
+    expected = copy.deepcopy(sentence_level_portraits)
+    reference_merge(get_entity_chains(nafobj), expected)
+
+    portraits = extract_portraits_from_naf(load_naf(inputfile), surface)
+    assert list(derive_output_rows(portraits, 'doc')) == list(derive_output_rows(expected, 'doc'))
+
+
+def time_single_chain_merge(number_of_mentions):
+
+    tids = ['t_%d' % i for i in range(number_of_mentions)]
+    times = []
+    for _ in range(3):
+        portraits = create_portraits(dict((tid, []) for tid in tids))
+        started = time.perf_counter()
+        merge_with_chains([tids], portraits)
+        times.append(time.perf_counter() - started)
+        assert list(portraits) == ['t_0'] and len(portraits['t_0'].labels) == number_of_mentions
+    return min(times)
+
+
+def test_single_chain_scales_linearly():
+
+    #16 times as many mentions: about 16 times as long when linear, 256 times when quadratic
+    small = time_single_chain_merge(1000)
+    large = time_single_chain_merge(16000)
+    assert large < 64 * max(small, 0.001)